@@ -0,0 +1,109 @@
+"""Mailbox actors run by a fixed pool of worker threads.
+
+Each Actor owns a FIFO mailbox and a handler. post() appends a message and,
+if the actor is idle, puts it on the pool's ready queue; a worker takes it
+from there and handles its messages one at a time. An actor is on the ready
+queue at most once, so its handler never runs on two threads at the same
+time and the state it owns needs no lock. A worker hands an actor back to
+the ready queue after BATCH_SIZE messages, so one busy actor can't hold a
+worker while others wait.
+
+The server gives every ChessGame an actor; moves, resignations and
+disconnects for that game are posted to it instead of being handled on the
+connection's thread.
+"""
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+
+# Worker threads per pool; handlers are short and CPU-bound, saving users.pkl is the only I/O
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Messages a worker handles for one actor before moving on to the next ready actor
+BATCH_SIZE = 16
+
+# Recent mailbox delays (post to start of handling) kept for latency percentiles
+LATENCY_SAMPLES = 10000
+
+
+class Actor:
+    """A mailbox whose messages are passed to handler(message) one at a time, in order"""
+
+    def __init__(self, pool, handler, name=None):
+        self.pool = pool
+        self.handler = handler
+        self.name = name
+        self.mailbox = deque()  # (posted_at, message)
+        self.scheduled = False  # on the ready queue or being run by a worker
+        self.lock = threading.Lock()  # guards mailbox and scheduled only, never held while handling
+
+    def post(self, message):
+        """Queue a message for the handler; returns immediately"""
+        with self.lock:
+            self.mailbox.append((time.perf_counter(), message))
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.pool.ready.put(self)
+
+
+class ActorPool:
+    """Fixed set of worker threads draining the mailboxes of ready actors"""
+
+    def __init__(self, workers=DEFAULT_WORKERS, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.ready = queue.SimpleQueue()
+        self.handled = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.threads = [threading.Thread(target=self._run, name=f'actor-worker-{i}', daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def actor(self, handler, name=None):
+        """New actor on this pool"""
+        return Actor(self, handler, name)
+
+    def stop(self):
+        """Let the workers exit once the messages already posted are handled"""
+        for _ in self.threads:
+            self.ready.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self):
+        """Messages handled and mailbox delay percentiles (ms) over recent messages"""
+        samples = sorted(self.latencies)
+        percentiles = {}
+        for label, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1.0)):
+            percentiles[label] = samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000 if samples else 0.0
+        return {'workers': len(self.threads), 'handled': self.handled, 'ready': self.ready.qsize(), **percentiles}
+
+    def _run(self):
+        while True:
+            actor = self.ready.get()
+            if actor is None:
+                return
+            for _ in range(self.batch_size):
+                with actor.lock:
+                    if not actor.mailbox:
+                        actor.scheduled = False
+                        break
+                    posted_at, message = actor.mailbox.popleft()
+                self.latencies.append(time.perf_counter() - posted_at)
+                self.handled += 1
+                try:
+                    actor.handler(message)
+                except Exception as e:
+                    print(f"Error in actor {actor.name}: {e}")
+                    traceback.print_exc()
+            else:
+                # Batch used up: go to the back of the ready queue if more is waiting
+                with actor.lock:
+                    if not actor.mailbox:
+                        actor.scheduled = False
+                        continue
+                self.ready.put(actor)
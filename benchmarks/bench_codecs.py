@@ -0,0 +1,90 @@
+"""Message codec microbenchmark: the json module against orjson and MessagePack.
+
+Times each serializer that is installed on the message shapes that still
+go through a codec, whole: an opponent_move with the whole board (as
+WIRE_JSON sessions get it), a login_response, and v1's move_made, whose
+board is get_board_state's 81 piece dicts. orjson writes the same JSON the
+json module does, so codec.JsonCodec uses it whenever it's installed;
+msgpack is only used when the handshake settles on CODEC_MSGPACK. Each
+message is checked to round-trip first. Prints the codecs this process
+would offer, best first.
+
+    python benchmarks/bench_codecs.py --seconds 2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from codec import CODECS, SUPPORTED_CODECS  # noqa: E402
+from tests.messages import CODEC_MESSAGES  # noqa: E402
+
+sys.path.insert(0, os.path.join(ROOT, 'v1'))
+import chess_server as v1  # noqa: E402
+
+v1_game = v1.ChessGame('bench')
+v1_result = v1_game.make_move(7, 4, 5, 4, v1.PieceColor.WHITE)
+
+MESSAGES = {
+    **CODEC_MESSAGES,
+    'v1 move_made': {'type': 'move_made', 'from_row': 7, 'from_col': 4, 'to_row': 5, 'to_col': 4,
+                     'board': v1_game.get_board_state(), 'current_player': v1_game.current_player.value,
+                     'promotion': v1_result['promotion'], 'promoted_to': v1_result['promoted_to'],
+                     'captured': v1_result['captured'], 'game_status': v1_result['game_status']}
+}
+
+# (encode, decode) by name, for the serializers installed here
+SERIALIZERS = {'json': (lambda message: json.dumps(message).encode('utf-8'), json.loads)}
+if orjson is not None:
+    SERIALIZERS['orjson'] = (orjson.dumps, orjson.loads)
+if msgpack is not None:
+    SERIALIZERS['msgpack'] = (msgpack.packb, msgpack.unpackb)
+
+
+def rate(function, seconds):
+    """Calls per second of function() over about `seconds`"""
+    calls, start = 0, time.perf_counter()
+    while True:
+        for _ in range(200):
+            function()
+        calls += 200
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=1.0, help='time per measurement')
+    args = parser.parse_args()
+
+    print("codecs offered, best first: " + ", ".join(type(CODECS[codec]).__name__ for codec in SUPPORTED_CODECS)
+          + ("" if orjson else " (no orjson: JSON through the json module)"))
+    print(f"{'message':<16}{'codec':<9}{'bytes':>7}{'encode/s':>11}{'decode/s':>11}{'encode MB/s':>13}")
+    for name, message in MESSAGES.items():
+        for serializer, (encode, decode) in SERIALIZERS.items():
+            data = encode(message)
+            assert decode(data) == message, (name, serializer)
+
+            encodes = rate(lambda: encode(message), args.seconds)
+            decodes = rate(lambda: decode(data), args.seconds)
+            print(f"{name:<16}{serializer:<9}{len(data):>7}{encodes:>11.0f}{decodes:>11.0f}"
+                  f"{encodes * len(data) / 1e6:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Handshake storm benchmark: handshake latency and gameplay latency while it lasts.
+
+First times both ends of each handshake version's crypto in this process
+(one core, no sockets) and counts the handshake bytes, and times the
+password hash a login costs the server. Then starts server.py in a
+subprocess (threaded or --async) once per --handshake-processes setting and
+handshake version (X25519 and resumption against a server whose hello is a
+bare X25519 key), starts one game between two headless clients and keeps
+timing a move round trip in it, first on a quiet server and then while
+--storm client processes reconnect over and over with that version. Prints
+handshakes per second, the handshake latency the storm clients saw, and the
+move round trip before and during the storm.
+
+Resuming storm clients log in once for a session ticket and then reconnect
+with it, each time waiting for session_resumed. With --login the other
+storm clients log in on every reconnect, as a player without a ticket has
+to, which is the comparison that matters for resumption.
+
+    python benchmarks/bench_handshakes.py --mode threaded --processes 0 1 --storm 8
+    python benchmarks/bench_handshakes.py --mode async --processes 0 3 --versions 2 --seconds 20
+    python benchmarks/bench_handshakes.py --mode threaded --processes 0 --versions 3 4 --login
+
+The storm clients do their half of the key exchange (DH and PBKDF2) too, so on
+a machine with few cores they compete with the server for CPU; compare the
+settings against each other rather than reading the numbers as absolutes.
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey  # noqa: E402
+
+from handshake import (DH_GENERATOR, DH_PRIME, HANDSHAKE_RESUME, HANDSHAKE_X25519, SUPPORTED_HANDSHAKES,  # noqa: E402
+                       SessionTickets, client_key_exchange, derive_dh_session_key, derive_resumed_session_key,
+                       derive_x25519_session_key, generate_dh_keypair, latency_percentiles, received_ticket,
+                       x25519_message, x25519_public_bytes)
+from headless_client import HeadlessClient  # noqa: E402
+from server import ChessServer  # noqa: E402
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+
+# A move the server always rejects, so the probe game can go on forever
+NULL_MOVE = {'type': 'move', 'from': [4, 4], 'to': [4, 4]}
+
+# Versions benchmarked against a server whose hello is a bare X25519 key
+X25519_HELLO_VERSIONS = (HANDSHAKE_X25519, HANDSHAKE_RESUME)
+
+
+def start_server(mode, port, workdir, processes, handshakes):
+    command = [sys.executable, '-W', 'ignore', SERVER_SCRIPT, '--host', '127.0.0.1', '--port', str(port),
+               '--max-connections', '100000', '--handshake-processes', str(processes),
+               '--handshakes'] + [str(version) for version in handshakes]
+    if mode == 'async':
+        command.append('--async')
+    server = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("server did not start listening")
+
+
+def start_game(port):
+    """Two logged-in clients who have been matched into a game"""
+    players = []
+    for name in ('probe_white', 'probe_black'):
+        player = HeadlessClient('127.0.0.1', port).connect()
+        player.request({'type': 'register', 'username': name, 'password': 'pw', 'email': f'{name}@example.com'})
+        assert player.request({'type': 'login', 'username': name, 'password': 'pw'})['success']
+        players.append(player)
+    for player in players:
+        player.send({'type': 'join_queue'})
+    for player in players:
+        while player.receive().get('type') != 'game_start':
+            pass
+    return players
+
+
+def probe(player, stop, samples):
+    """Time null-move round trips until stop is set"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        player.request(NULL_MOVE)
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.01)
+
+
+def crypto_cost(version, seconds):
+    """(handshakes per second one core manages doing both ends of the crypto, hello + reply bytes)"""
+    p, g = DH_PRIME, DH_GENERATOR
+    done, start = 0, time.perf_counter()
+    tickets = SessionTickets()
+    ticket = tickets.issue('player', 'game')
+    while time.perf_counter() - start < seconds:
+        if version == HANDSHAKE_RESUME:
+            # The server still makes an X25519 key for its hello; the ticket replaces the exchange
+            hello = x25519_message(X25519PrivateKey.generate())
+            reply, client_records, _ = client_key_exchange(hello, ticket=ticket)
+            reply_data = json.loads(reply)
+            session = tickets.open(reply_data['ticket'])
+            nonce = base64.b64decode(reply_data['nonce'])
+            assert derive_resumed_session_key(session['secret'], hello, nonce) == client_records.key
+        elif version == HANDSHAKE_X25519:
+            server_key = X25519PrivateKey.generate()
+            hello = x25519_public_bytes(server_key)
+            reply, client_records, _ = client_key_exchange(hello, version)
+            assert derive_x25519_session_key(server_key, reply) == client_records.key
+        else:
+            keypair = generate_dh_keypair(p, g)
+            hello = json.dumps({'y': keypair[1], 'p': p, 'g': g, 'versions': list(SUPPORTED_HANDSHAKES)}).encode()
+            reply, client_records, _ = client_key_exchange(hello, version)
+            assert derive_dh_session_key(p, g, *keypair, json.loads(reply)['y'], version) == client_records.key
+        done += 1
+    return done / (time.perf_counter() - start), len(hello) + len(reply)
+
+
+def login_cost(seconds):
+    """Password hashes per second: what each login costs the server, and a resumption skips"""
+    server = ChessServer.__new__(ChessServer)
+    server.pepper = b'pepper'
+    salt, done, start = os.urandom(32), 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        server.hash_password('password', salt)
+        done += 1
+    return done / (time.perf_counter() - start)
+
+
+def storm_client(port, version, until, results, login):
+    """Reconnect until the deadline; put this process's handshake durations on results"""
+    durations, failures = [], 0
+    username, ticket = f'storm{os.getpid()}', None
+    if login or version == HANDSHAKE_RESUME:
+        client = HeadlessClient('127.0.0.1', port).connect()
+        client.request({'type': 'register', 'username': username, 'password': 'pw', 'email': f'{username}@example.com'})
+        ticket = received_ticket(client.request({'type': 'login', 'username': username, 'password': 'pw',
+                                                 'session_ticket': True}))
+        client.close()
+    while time.time() < until:
+        start = time.perf_counter()
+        try:
+            if version == HANDSHAKE_RESUME:
+                client = HeadlessClient('127.0.0.1', port, ticket=ticket).connect()
+                ticket = received_ticket(client.receive())
+            else:
+                client = HeadlessClient('127.0.0.1', port, version).connect()
+                if login:
+                    client.request({'type': 'login', 'username': username, 'password': 'pw'})
+                else:
+                    # The server holds no session until it has our reply; a request proves the key works
+                    client.request({'type': 'leave_queue'})
+            client.close()
+            durations.append(time.perf_counter() - start)
+        except OSError:
+            failures += 1
+    results.put((durations, failures))
+
+
+def run(mode, processes, version, args, workdir, port):
+    handshakes = X25519_HELLO_VERSIONS if version in X25519_HELLO_VERSIONS else SUPPORTED_HANDSHAKES
+    server = start_server(mode, port, workdir, processes, handshakes)
+    try:
+        players = start_game(port)
+        stop, quiet = threading.Event(), []
+        prober = threading.Thread(target=probe, args=(players[0], stop, quiet))
+        prober.start()
+        time.sleep(min(3, args.seconds))
+        stop.set()
+        prober.join()
+
+        stop, loaded = threading.Event(), []
+        prober = threading.Thread(target=probe, args=(players[0], stop, loaded))
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        until = time.time() + args.seconds
+        storm = [context.Process(target=storm_client, args=(port, version, until, results, args.login)) for _ in range(args.storm)]
+        for process in storm:
+            process.start()
+        prober.start()
+        durations, failures = [], 0
+        for _ in storm:
+            process_durations, process_failures = results.get()
+            durations += process_durations
+            failures += process_failures
+        for process in storm:
+            process.join()
+        stop.set()
+        prober.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    handshakes = latency_percentiles(durations)
+    quiet, loaded = latency_percentiles(quiet), latency_percentiles(loaded)
+    login = ' with login' if args.login and version != HANDSHAKE_RESUME else ''
+    print(f"{mode}, {processes} handshake processes, handshake v{version}{login}: "
+          f"{len(durations) / args.seconds:.1f} handshakes/s "
+          f"({failures} failed)")
+    print(f"  handshake   p50 {handshakes['p50']:7.1f} ms  p95 {handshakes['p95']:7.1f} ms  "
+          f"p99 {handshakes['p99']:7.1f} ms")
+    print(f"  move, quiet p50 {quiet['p50']:7.1f} ms  p95 {quiet['p95']:7.1f} ms  p99 {quiet['p99']:7.1f} ms")
+    print(f"  move, storm p50 {loaded['p50']:7.1f} ms  p95 {loaded['p95']:7.1f} ms  p99 {loaded['p99']:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('threaded', 'async', 'both'), default='both')
+    parser.add_argument('--processes', type=int, nargs='+', default=[0, 1],
+                        help='--handshake-processes settings to compare (0 = on the connection thread)')
+    parser.add_argument('--versions', type=int, nargs='+', default=list(SUPPORTED_HANDSHAKES),
+                        help='handshake versions the storm clients use')
+    parser.add_argument('--storm', type=int, default=8, help='client processes reconnecting at once')
+    parser.add_argument('--login', action='store_true', help='storm clients without a ticket log in on every reconnect')
+    parser.add_argument('--seconds', type=float, default=10, help='length of the storm')
+    parser.add_argument('--port', type=int, default=9500)
+    args = parser.parse_args()
+
+    for version in args.versions:
+        rate, size = crypto_cost(version, 3)
+        print(f"handshake v{version} crypto, both ends on one core: {rate:.1f} handshakes/s, {size} bytes exchanged")
+    print(f"login password hash, server side: {login_cost(3):.1f} logins/s")
+
+    modes = ('threaded', 'async') if args.mode == 'both' else (args.mode,)
+    port = args.port
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in modes:
+            for processes in args.processes:
+                for version in args.versions:
+                    users = os.path.join(workdir, 'users.pkl')
+                    if os.path.exists(users):
+                        os.remove(users)
+                    run(mode, processes, version, args, workdir, port)
+                    port += 1
+
+
+if __name__ == "__main__":
+    main()
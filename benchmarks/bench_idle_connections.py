@@ -0,0 +1,157 @@
+"""Idle connection benchmark: server memory and threads as connections pile up.
+
+Starts server.py in a subprocess (threaded or --async), opens connections in
+batches and leaves them idle, sampling the server's resident memory and thread
+count as it goes. By default each connection stops after reading the server's
+DH hello, which already costs the server a keypair and a parked reader; with
+--handshake every connection completes the key exchange (PBKDF2 on both ends,
+so expect roughly 20 ms of CPU per connection on each side).
+
+    python benchmarks/bench_idle_connections.py --connections 10000 --mode async
+    python benchmarks/bench_idle_connections.py --connections 2000 --mode both --handshake
+
+Memory is read from /proc (Linux) or psutil when it is installed.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from headless_client import open_async_client  # noqa: E402
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+
+
+def raise_fd_limit():
+    """Lift the soft open-file limit to the hard limit; the server subprocess inherits it"""
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def process_stats(pid):
+    """(resident memory in bytes, thread count) of a process"""
+    if psutil is not None:
+        process = psutil.Process(pid)
+        return process.memory_info().rss, process.num_threads()
+    rss, threads = 0, 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+    return rss, threads
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, workdir, connections):
+    # Lift the admission cap above the test size, and keep hello-only connections past the handshake deadline
+    args = [sys.executable, '-W', 'ignore', SERVER_SCRIPT, '--host', '127.0.0.1', '--port', str(port),
+            '--max-connections', str(connections + 10), '--connection-timeout', '3600']
+    if mode == 'async':
+        args.append('--async')
+    server = subprocess.Popen(args, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            # Completing the handshake here would leave a session behind; just wait for the listener
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("Server did not start")
+
+
+async def open_connections(port, count, batch, handshake):
+    async def open_one():
+        return await open_async_client('127.0.0.1', port, handshake)
+
+    connections = []
+    while len(connections) < count:
+        size = min(batch, count - len(connections))
+        connections.extend(await asyncio.gather(*(open_one() for _ in range(size))))
+    return connections
+
+
+async def run_mode(mode, args):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(mode, port, workdir, args.connections)
+        try:
+            await asyncio.sleep(0.5)  # let the probe connection be cleaned up
+            base_rss, base_threads = process_stats(server.pid)
+            print(f"\n{mode} server (pid {server.pid}): {base_rss / 2**20:.1f} MB, {base_threads} threads at start")
+            print(f"{'connections':>12} {'RSS MB':>9} {'threads':>8} {'KB/conn':>9} {'open s':>8}")
+
+            connections = []
+            step = max(1, args.connections // args.samples)
+            start = time.perf_counter()
+            while len(connections) < args.connections:
+                target = min(args.connections, len(connections) + step)
+                connections.extend(await open_connections(port, target - len(connections),
+                                                          args.batch, args.handshake))
+                await asyncio.sleep(0.2)  # let the server finish the last batch
+                rss, threads = process_stats(server.pid)
+                per_connection = (rss - base_rss) / len(connections) / 1024
+                print(f"{len(connections):>12} {rss / 2**20:>9.1f} {threads:>8} {per_connection:>9.1f} "
+                      f"{time.perf_counter() - start:>8.1f}")
+
+            await asyncio.sleep(args.hold)
+            rss, threads = process_stats(server.pid)
+            print(f"after {args.hold:.0f} s idle: {rss / 2**20:.1f} MB, {threads} threads, "
+                  f"{(rss - base_rss) / len(connections) / 1024:.1f} KB per connection")
+
+            for _, writer, _ in connections:
+                writer.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, default=10000)
+    parser.add_argument('--mode', default='async', choices=['async', 'threaded', 'both'])
+    parser.add_argument('--handshake', action='store_true', help='complete the key exchange on every connection')
+    parser.add_argument('--batch', type=int, default=200, help='connections opened concurrently')
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--hold', type=float, default=5.0, help='seconds to stay idle before the final sample')
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    if limit is not None and limit < args.connections + 100:
+        print(f"Open file limit is {limit}; fewer than {args.connections} connections will fit")
+
+    modes = ['threaded', 'async'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        asyncio.run(run_mode(mode, args))
+
+
+if __name__ == "__main__":
+    main()
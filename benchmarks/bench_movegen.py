@@ -0,0 +1,101 @@
+"""Move generation benchmark for the 9x9 two-queen variant.
+
+Plays random games to collect positions, checks that ChessGame.get_all_legal_moves
+produces exactly the same move set as the original 81x81 target scan, then times both.
+Also times the end-of-move checkmate/stalemate test with and without the early exit,
+and the shared legal-move cache on games that replay the same openings.
+
+    python benchmarks/bench_movegen.py --positions 300 --seed 1
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import move_cache  # noqa: E402
+from server import ChessGame  # noqa: E402
+from tests.reference import (early_exit_status, full_enumeration_status, legacy_get_all_legal_moves,  # noqa: E402
+                             random_placements, random_positions)
+
+
+def play_openings(games, openings, plies, seed):
+    """Play games whose first plies are drawn from a few fixed openings, as on a busy server"""
+    for index in range(games):
+        game = ChessGame(f'bench_{index}', 'white_player', 'black_player')
+        rng = random.Random(seed + index % openings)
+        for _ in range(plies):
+            moves = sorted(game.get_all_legal_moves(game.current_turn))
+            if not moves or game.game_over:
+                break
+            from_pos, to_pos = rng.choice(moves)
+            player = game.white_player if game.current_turn == 'white' else game.black_player
+            game.make_move(player, list(from_pos), list(to_pos))
+
+
+def time_per_call(func, positions, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for game, color in positions:
+            func(game, color)
+    return (time.perf_counter() - start) / (repeat * len(positions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--positions', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--games', type=int, default=500)
+    parser.add_argument('--openings', type=int, default=20)
+    args = parser.parse_args()
+
+    # Generator timings below are uncached
+    move_cache.max_entries = 0
+    move_cache.clear()
+
+    positions = random_positions(args.positions, args.seed)
+    placements = random_placements(args.positions, args.seed)
+
+    # Differential check against the original scan
+    for index, (game, color) in enumerate(positions + placements):
+        expected = set(legacy_get_all_legal_moves(game, color))
+        actual = game.get_all_legal_moves(color)
+        if len(actual) != len(set(actual)) or set(actual) != expected:
+            print(f"Mismatch in position {index} ({color} to move)")
+            print(f"  missing: {sorted(expected - set(actual))}")
+            print(f"  extra:   {sorted(set(actual) - expected)}")
+            sys.exit(1)
+        if full_enumeration_status(game, color) != early_exit_status(game, color):
+            print(f"Status mismatch in position {index} ({color} to move)")
+            sys.exit(1)
+    print(f"Move sets identical on {len(positions)} played and {len(placements)} random-placement positions")
+
+    legacy = time_per_call(legacy_get_all_legal_moves, positions, args.repeat)
+    current = time_per_call(ChessGame.get_all_legal_moves, positions, args.repeat)
+    print(f"legacy scan:         {legacy * 1000:8.3f} ms/call")
+    print(f"get_all_legal_moves: {current * 1000:8.3f} ms/call  ({legacy / current:.1f}x faster)")
+
+    for label, sample in (('played', positions), ('random placement', placements)):
+        full = time_per_call(full_enumeration_status, sample, args.repeat)
+        early = time_per_call(early_exit_status, sample, args.repeat)
+        print(f"end-of-move status ({label}): full enumeration {full * 1000:.3f} ms, "
+              f"has_legal_move {early * 1000:.3f} ms  ({full / early:.1f}x faster)")
+
+    cached = {}
+    for max_entries in (0, 10000):
+        move_cache.max_entries = max_entries
+        move_cache.clear()
+        start = time.perf_counter()
+        play_openings(args.games, args.openings, 12, args.seed)
+        cached[max_entries] = time.perf_counter() - start
+    stats = move_cache.stats()
+    print(f"{args.games} games over {args.openings} openings, 12 plies: "
+          f"uncached {cached[0]:.2f} s, cached {cached[10000]:.2f} s  "
+          f"(hit rate {stats['hit_rate']:.0%}, {stats['entries']} entries)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Record layer microbenchmark: sealing and opening message frames, CBC against GCM.
+
+Times records.CbcRecords (the original format: a new Cipher, encryptor and
+PKCS7 padder per message) and records.GcmRecords (one AESGCM object per
+session, counter nonces, no padding) on real message shapes: a rejected
+move, a move_response and an opponent_move carrying the whole board, and a
+login_response. Each is JSON-encoded once up front, so only the record layer
+is timed; both directions are checked to round-trip first. A GCM receiver
+opens each record once, in counter order, so opening is timed on a batch of
+records sealed up front, with a fresh receiver for each pass over it.
+
+    python benchmarks/bench_records.py --seconds 2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import CLIENT, RECORD_CBC, RECORD_GCM, SERVER, record_layer  # noqa: E402
+from tests.messages import RECORD_MESSAGES  # noqa: E402
+
+# Records sealed up front for timing open()
+OPEN_BATCH = 10000
+
+
+def rate(function, seconds):
+    """Calls per second of function() over about `seconds`"""
+    calls, start = 0, time.perf_counter()
+    while True:
+        for _ in range(200):
+            function()
+        calls += 200
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def opening(version, key, records):
+    """Generator opening the records in order, pass after pass, each pass with a new receiver"""
+    while True:
+        receiver = record_layer(version, key, CLIENT)
+        for record in records:
+            yield receiver.open(record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=1.0, help='time per measurement')
+    args = parser.parse_args()
+
+    key = os.urandom(32)
+    print(f"{'message':<16}{'bytes':>7}  {'record':<6}{'overhead':>9}{'seal/s':>11}{'open/s':>11}{'seal MB/s':>11}")
+    for name, message in RECORD_MESSAGES.items():
+        plaintext = json.dumps(message).encode()
+        for version in (RECORD_CBC, RECORD_GCM):
+            sender, receiver = record_layer(version, key, SERVER), record_layer(version, key, CLIENT)
+            record = sender.seal(plaintext)
+            assert receiver.open(record) == plaintext
+            assert sender.open(receiver.seal(plaintext)) == plaintext
+
+            seals = rate(lambda: sender.seal(plaintext), args.seconds)
+            passes = opening(version, key, [sender.seal(plaintext) for _ in range(OPEN_BATCH)])
+            opens = rate(lambda: next(passes), args.seconds)
+            label = 'CBC' if version == RECORD_CBC else 'GCM'
+            print(f"{name:<16}{len(plaintext):>7}  {label:<6}{len(record) - len(plaintext):>9}"
+                  f"{seals:>11.0f}{opens:>11.0f}{seals * len(plaintext) / 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Wire format microbenchmark: encoding and decoding messages, JSON against binary and deltas.
+
+Times wire.JsonWire (every message as JSON, the board as 81 piece-name
+strings) and wire.BinaryWire (type byte, square bytes, flags and the 81-byte
+board) on the messages a game sends most: a client's move, the move result
+the mover gets back and the opponent_move the other player gets, plus a
+login_response, which the binary format leaves as JSON. wire.DeltaWire is
+timed on the shapes its sessions get instead: the move result and
+opponent_move without the board, and the board_sync a client asks for when
+its board has drifted. Also shows what the record layer adds to each: the
+size of the sealed GCM frame and how long sealing takes, so encoding and
+encryption can be compared per message. Each message is checked to
+round-trip first.
+
+    python benchmarks/bench_wire.py --seconds 2
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import RECORD_GCM, SERVER, record_layer  # noqa: E402
+from tests.messages import DELTA_MESSAGES, WIRE_MESSAGES  # noqa: E402
+from wire import WIRE_BINARY, WIRE_DELTA, WIRE_JSON, wire_format  # noqa: E402
+
+WIRE_LABELS = {WIRE_JSON: 'json', WIRE_BINARY: 'binary', WIRE_DELTA: 'delta'}
+
+
+def rate(function, seconds):
+    """Calls per second of function() over about `seconds`"""
+    calls, start = 0, time.perf_counter()
+    while True:
+        for _ in range(200):
+            function()
+        calls += 200
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def measure(name, message, version, records, seconds):
+    """Print one row: message size, sealed frame size, and encode, decode and seal rates"""
+    wire = wire_format(version)
+    data = wire.encode(message)
+    assert wire.decode(data) == message, (name, version)
+
+    encodes = rate(lambda: wire.encode(message), seconds)
+    decodes = rate(lambda: wire.decode(data), seconds)
+    seals = rate(lambda: records.seal(data), seconds)
+    print(f"{name:<16}{WIRE_LABELS[version]:<8}{len(data):>7}{len(records.seal(data)):>7}"
+          f"{encodes:>11.0f}{decodes:>11.0f}{seals:>11.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=1.0, help='time per measurement')
+    args = parser.parse_args()
+
+    records = record_layer(RECORD_GCM, os.urandom(32), SERVER)
+    print(f"{'message':<16}{'wire':<8}{'bytes':>7}{'frame':>7}{'encode/s':>11}{'decode/s':>11}{'seal/s':>11}")
+    for name, message in WIRE_MESSAGES.items():
+        for version in (WIRE_JSON, WIRE_BINARY):
+            measure(name, message, version, records, args.seconds)
+    for name, message in DELTA_MESSAGES.items():
+        measure(name, message, WIRE_DELTA, records, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Minimal protocol client for benchmarks and load scripts.
+
+Speaks the same handshake and framing as client.py (the negotiated key
+exchange from handshake.py, messages in the negotiated wire format in 4-byte
+length-prefixed frames sealed by the negotiated record layer) without pygame
+or tkinter, in a blocking and an asyncio flavour. A client can be pinned to
+one handshake, record, wire format and codec version, or resume a session
+with a ticket from an earlier one.
+"""
+import asyncio
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framing import FrameReader, encode_frame  # noqa: E402
+from handshake import client_key_exchange, client_offer  # noqa: E402
+from codec import CODEC_JSON  # noqa: E402
+from wire import WIRE_JSON, wire_format  # noqa: E402
+
+
+def encrypt(message, records, wire=wire_format(WIRE_JSON)):
+    """Encode a message dict in the session's wire format and seal it with its record layer"""
+    return records.seal(wire.encode(message))
+
+
+def decrypt(data, records, wire=wire_format(WIRE_JSON)):
+    """Decrypt one frame payload into a message dict"""
+    return wire.decode(records.open(data))
+
+
+class HeadlessClient:
+    """Blocking client: connect() does the handshake, send()/receive() exchange messages"""
+
+    def __init__(self, host, port, handshake_version=None, record_version=None, ticket=None, wire_version=None,
+                 codec_version=None, offer=True):
+        self.host = host
+        self.port = port
+        self.handshake_version = handshake_version
+        self.record_version = record_version
+        self.ticket = ticket  # (ticket, resumption secret), as handshake.received_ticket returns
+        self.wire_version = wire_version
+        self.codec_version = codec_version
+        self.offer = offer  # False waits for the hello without offering first, as clients before offers did
+        self.sock = None
+        self.frame_reader = None
+        self.records = None
+        self.wire = None
+
+    def recv_frame(self):
+        data = self.frame_reader.read_frame()
+        if data is None:
+            raise ConnectionError("Server closed the connection")
+        return data
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port))
+        self.frame_reader = FrameReader(self.sock)
+        if self.offer:
+            self.sock.sendall(encode_frame(client_offer(self.handshake_version, self.record_version,
+                                                        self.wire_version, self.codec_version)))
+        reply, self.records, self.wire = client_key_exchange(self.recv_frame(), self.handshake_version,
+                                                             self.record_version, self.ticket, self.wire_version,
+                                                             self.codec_version)
+        self.sock.sendall(encode_frame(reply))
+        return self
+
+    def send(self, message):
+        self.sock.sendall(encode_frame(encrypt(message, self.records, self.wire)))
+
+    def receive(self):
+        return decrypt(self.recv_frame(), self.records, self.wire)
+
+    def request(self, message, reply_type=None):
+        """Send a message and return the next reply (of reply_type, if given)"""
+        self.send(message)
+        while True:
+            reply = self.receive()
+            if reply_type is None or reply.get('type') == reply_type:
+                return reply
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+
+
+async def open_async_client(host, port, handshake=True, handshake_version=None):
+    """Open a connection with asyncio; return (reader, writer, record layer or None), speaking WIRE_JSON in JSON.
+
+    With handshake=False the connection stops after reading the server hello,
+    which is enough to hold an idle slot on the server.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_frame(client_offer(handshake_version, None, WIRE_JSON, CODEC_JSON)))
+    server_data = await reader.readexactly(int.from_bytes(await reader.readexactly(4), 'big'))
+    if not handshake:
+        return reader, writer, None
+    reply, records, _ = await asyncio.get_running_loop().run_in_executor(None, client_key_exchange, server_data,
+                                                                         handshake_version, None, None, WIRE_JSON,
+                                                                         CODEC_JSON)
+    writer.write(encode_frame(reply))
+    await writer.drain()
+    return reader, writer, records
@@ -0,0 +1,81 @@
+"""Concurrency stress test for ChessServer's game, client and queue state.
+
+Runs hundreds of games at once inside one process: every player is a thread
+that calls process_message and cleanup_client exactly as a connection thread
+would, against a ChessServer whose send_encrypted_response delivers into an
+in-memory inbox (no sockets or crypto, so the handlers and the game actors
+are what runs concurrently). Players queue up, play random legal moves, and sometimes
+resign or disconnect mid-game, including out of turn, so endings race with
+moves and with each other.
+
+    python benchmarks/stress_games.py --games 300
+    python benchmarks/stress_games.py --games 500 --resign 0.02 --disconnect 0.02 --seed 7
+
+Afterwards it checks that every game ended exactly once (stats balance, each
+survivor got one game_end), that every opponent_move matched the move the
+other player made, and that no game, queue entry or client was left behind.
+Exits non-zero on any failure.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.harness import MESSAGE_TIMEOUT, Player, StressServer, check  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=300)
+    parser.add_argument('--max-moves', type=int, default=40, help='moves per player before resigning')
+    parser.add_argument('--resign', type=float, default=0.01, help='chance per turn of resigning')
+    parser.add_argument('--disconnect', type=float, default=0.01, help='chance per turn of disconnecting')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        server = StressServer()
+        usernames = [f'player{i}' for i in range(2 * args.games)]
+        for username in usernames:
+            server.users[username] = {'games_played': 0, 'wins': 0, 'losses': 0, 'draws': 0}
+
+        players = [Player(server, username, args, args.seed * 100003 + i) for i, username in enumerate(usernames)]
+        start = time.perf_counter()
+        for player in players:
+            player.start()
+        for player in players:
+            player.join(MESSAGE_TIMEOUT * 2)
+        elapsed = time.perf_counter() - start
+
+        hung = [player.connection.username for player in players if player.is_alive()]
+        failures = [f"{len(hung)} players still running: {hung[:5]}"] if hung else []
+
+        # A player's last disconnect may still be in its game's mailbox; let the actors finish first
+        server.game_actors.stop()
+        failures += check(server, players, args.games)
+
+    moves = sum(len(player.moves_made) for player in players)
+    endings = {}
+    for player in players:
+        endings[player.ending] = endings.get(player.ending, 0) + 1
+    print(f"{args.games} concurrent games, {len(players)} player threads: {moves} moves in {elapsed:.2f} s "
+          f"({moves / elapsed:.0f} moves/s)")
+    actors = server.game_actors.stats()
+    print(f"game actors: {actors['workers']} workers, {actors['handled']} messages, mailbox delay "
+          f"p50 {actors['p50']:.2f} ms, p99 {actors['p99']:.2f} ms, max {actors['max']:.2f} ms")
+    print("endings: " + ", ".join(f"{ending} {count}" for ending, count in sorted(endings.items(), key=str)))
+
+    if failures:
+        print(f"FAILED ({len(failures)}):")
+        for failure in failures[:20]:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK: every game ended once, every move was delivered in order, no state left behind")
+
+
+if __name__ == "__main__":
+    main()
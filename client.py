@@ -1,16 +1,12 @@
 import pygame
 import socket
-import json
 import threading
 import os
-from cryptography.hazmat.primitives.asymmetric import dh
-from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat, load_pem_public_key
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding, hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives.asymmetric.dh import DHParameterNumbers, DHPublicNumbers
 import tkinter as tk
 from tkinter import messagebox, simpledialog
+from engine import COLOR_INDEX, legal_destinations, position_from_board, square
+from framing import FrameReader, encode_frame
+from handshake import client_key_exchange, client_offer, received_ticket
 
 
 class ChessClient:
@@ -53,11 +49,17 @@ class ChessClient:
         self.user_stats = {}
         self.in_check = False
         self.in_queue = False
+        self.move_seq = 0  # moves in the game so far, for sessions that get moves as deltas
+        self.syncing = False  # asked the server for the whole board, and waiting for it
 
         # Network
         self.socket = None
         self.connected = False
-        self.aes_key = None
+        self.records = None  # record layer for the session, from the handshake
+        self.wire = None  # wire format for the session (binary moves and boards), from the handshake
+        self.server_address = None
+        self.session_ticket = None  # (ticket, resumption secret) for resuming after a lost connection
+        self.send_lock = threading.Lock()  # records must reach the server in the order they were sealed
 
         # Load pieces
         self.pieces = {}
@@ -139,67 +141,25 @@ class ChessClient:
                 surface.fill(color)
                 self.pieces[piece_name] = surface
 
-    def connect_to_server(self, host='10.100.102.43', port=8888):
-        """Connect to chess server with encryption setup"""
+    def connect_to_server(self, host='10.100.102.43', port=8888, ticket=None):
+        """Connect to chess server with encryption setup (resuming a session if given its ticket)"""
         try:
+            self.server_address = (host, port)
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((host, port))
 
+            # Say what we speak first, so the server can skip generating a DH key for us
+            self.socket.sendall(encode_frame(client_offer()))
+
             # Receive server's public key data
-            server_data_len = int.from_bytes(self.socket.recv(4), 'big')
-            server_data_bytes = b''
-            while len(server_data_bytes) < server_data_len:
-                chunk = self.socket.recv(server_data_len - len(server_data_bytes))
-                if not chunk:
-                    raise ConnectionError("Server disconnected during key exchange")
-                server_data_bytes += chunk
-
-            server_data_json = server_data_bytes.decode('utf-8')
-            server_public_data = json.loads(server_data_json)
-
-            # Create DH parameters from received data
-            param_numbers = DHParameterNumbers(
-                server_public_data['p'],
-                server_public_data['g']
-            )
-            parameters = param_numbers.parameters()
-
-            # Generate client keypair
-            private_key = parameters.generate_private_key()
-            public_key = private_key.public_key()
-
-            # Send client's public key data
-            public_numbers = public_key.public_numbers()
-            client_public_data = {
-                'y': public_numbers.y,
-                'p': public_numbers.parameter_numbers.p,
-                'g': public_numbers.parameter_numbers.g
-            }
-
-            client_data_json = json.dumps(client_public_data)
-            client_data_bytes = client_data_json.encode('utf-8')
-
-            self.socket.send(len(client_data_bytes).to_bytes(4, 'big'))
-            self.socket.send(client_data_bytes)
-
-            # Reconstruct server's public key
-            server_public_numbers = DHPublicNumbers(
-                server_public_data['y'],
-                param_numbers
-            )
-            server_public_key = server_public_numbers.public_key()
-
-            # Calculate shared secret
-            shared_secret = private_key.exchange(server_public_key)
-
-            # Generate AES key
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=b'chess_salt',
-                iterations=100000,
-            )
-            self.aes_key = kdf.derive(shared_secret)
+            self.frame_reader = FrameReader(self.socket)
+            server_data_bytes = self.frame_reader.read_frame()
+            if server_data_bytes is None:
+                raise ConnectionError("Server disconnected during key exchange")
+
+            # Answer with our public key, in the newest handshake version the server offers (or the ticket)
+            client_data_bytes, self.records, self.wire = client_key_exchange(server_data_bytes, ticket=ticket)
+            self.socket.sendall(encode_frame(client_data_bytes))
 
             self.connected = True
 
@@ -214,33 +174,12 @@ class ChessClient:
             return False
 
     def encrypt_message(self, message):
-        """Encrypt message using AES-CBC"""
-        iv = os.urandom(16)
-        cipher = Cipher(algorithms.AES(self.aes_key), modes.CBC(iv))
-        encryptor = cipher.encryptor()
-
-        # Pad message
-        padder = padding.PKCS7(128).padder()
-        padded_data = padder.update(message.encode()) + padder.finalize()
-
-        encrypted = encryptor.update(padded_data) + encryptor.finalize()
-        return iv + encrypted
+        """Encrypt an encoded message with the session's record layer"""
+        return self.records.seal(message)
 
     def decrypt_message(self, encrypted_data):
-        """Decrypt message using AES-CBC"""
-        iv = encrypted_data[:16]
-        encrypted = encrypted_data[16:]
-
-        cipher = Cipher(algorithms.AES(self.aes_key), modes.CBC(iv))
-        decryptor = cipher.decryptor()
-
-        padded_data = decryptor.update(encrypted) + decryptor.finalize()
-
-        # Unpad message
-        unpadder = padding.PKCS7(128).unpadder()
-        data = unpadder.update(padded_data) + unpadder.finalize()
-
-        return data.decode()
+        """Decrypt (and, for GCM records, authenticate) a message from the server"""
+        return self.records.open(encrypted_data)
 
     def send_message(self, message):
         """Send encrypted message to server"""
@@ -248,9 +187,10 @@ class ChessClient:
             return False
 
         try:
-            encrypted_message = self.encrypt_message(json.dumps(message))
-            self.socket.send(len(encrypted_message).to_bytes(4, 'big'))
-            self.socket.send(encrypted_message)
+            # The receive thread sends too (board sync requests)
+            with self.send_lock:
+                encrypted_message = self.encrypt_message(self.wire.encode(message))
+                self.socket.sendall(encode_frame(encrypted_message))
             return True
         except Exception as e:
             return False
@@ -259,19 +199,26 @@ class ChessClient:
         """Receive messages from server"""
         while self.connected:
             try:
-                msg_len = int.from_bytes(self.socket.recv(4), 'big')
-                if msg_len == 0:
+                encrypted_data = self.frame_reader.read_frame()
+                if not encrypted_data:
                     break
 
-                encrypted_data = self.socket.recv(msg_len)
+                # JSON, or for binary sessions the move and board messages as bytes; the same dict either way
                 decrypted_msg = self.decrypt_message(encrypted_data)
-                message = json.loads(decrypted_msg)
+                message = self.wire.decode(decrypted_msg)
 
                 self.handle_server_message(message)
 
             except Exception as e:
                 break
 
+        # Lost the connection without logging out: resume on a new one, once per ticket
+        if self.connected and self.session_ticket:
+            ticket, self.session_ticket = self.session_ticket, None
+            self.socket.close()
+            if self.connect_to_server(*self.server_address, ticket=ticket):
+                return
+
         self.connected = False
 
     def handle_server_message(self, message):
@@ -282,10 +229,33 @@ class ChessClient:
             if message.get('success'):
                 self.username = message['username']
                 self.user_stats = message['stats']
+                self.session_ticket = received_ticket(message)
                 self.game_state = 'lobby'
             else:
                 messagebox.showerror("Login Failed", message.get('message', 'Login failed'))
 
+        elif msg_type == 'session_resumed':
+            # Reconnected with a session ticket: logged in again, and back in the game if it's still on
+            self.username = message['username']
+            self.user_stats = message['stats']
+            self.session_ticket = received_ticket(message)
+            if message.get('game_id'):
+                self.player_color = message['color']
+                self.opponent_name = message['opponent']
+                self.board = message['board']
+                self.current_turn = message['turn']
+                self.in_check = message.get('in_check', False)
+                self.move_seq = message.get('seq', 0)
+                self.syncing = False
+                self.selected_square = None
+                self.valid_moves = []
+                self.game_state = 'playing'
+            else:
+                if self.game_state == 'playing':
+                    self.reset_game_state()
+                self.game_state = 'lobby'
+            self.in_queue = False
+
         elif msg_type == 'register_response':
             if message.get('success'):
                 messagebox.showinfo("Registration", "Registration successful! Please login.")
@@ -317,11 +287,16 @@ class ChessClient:
             self.game_state = 'playing'
             self.current_turn = 'white'
             self.in_queue = False
+            self.session_ticket = received_ticket(message) or self.session_ticket
+            self.move_seq = 0
+            self.syncing = False
             self.initialize_board()
 
         elif msg_type == 'opponent_move':
-            # Update board with opponent's move
-            if 'board' in message:
+            # Update board with opponent's move: the whole board, or (delta sessions) the move to make here
+            if 'seq' in message:
+                self.apply_move_delta(message, (message['from'], message['to']))
+            elif 'board' in message:
                 self.board = message['board']
 
             # Update turn
@@ -337,8 +312,10 @@ class ChessClient:
                 if message.get('game_over'):
                     return
 
-                # Update board state from server
-                if 'board' in message:
+                # Update board state from server (delta sessions made the move in make_move already)
+                if 'seq' in message:
+                    self.apply_move_delta(message)
+                elif 'board' in message:
                     self.board = message['board']
 
                 # Update turn
@@ -356,6 +333,17 @@ class ChessClient:
                 # Clear selection on invalid move
                 self.selected_square = None
                 self.valid_moves = []
+                # Nothing else will undo the move make_move made locally
+                if self.wire.deltas and self.game_state == 'playing':
+                    self.request_board_sync()
+
+        elif msg_type == 'board_sync':
+            if message.get('success', True):
+                self.board = message['board']
+                self.current_turn = message['turn']
+                self.in_check = message.get('in_check', False)
+                self.move_seq = message['seq']
+            self.syncing = False
 
         elif msg_type == 'game_end':
             result = message['result']
@@ -378,6 +366,8 @@ class ChessClient:
             elif result == 'draw':
                 if reason == 'stalemate':
                     messagebox.showinfo("Draw", "Game drawn by stalemate!")
+                elif reason == 'repetition':
+                    messagebox.showinfo("Draw", "Game drawn by threefold repetition!")
                 else:
                     messagebox.showinfo("Draw", f"Game drawn! ({reason})")
 
@@ -412,7 +402,8 @@ class ChessClient:
         self.send_message({
             'type': 'login',
             'username': username,
-            'password': password
+            'password': password,
+            'session_ticket': True
         })
 
     def show_register_dialog(self):
@@ -583,7 +574,7 @@ class ChessClient:
                     self.valid_moves = []
 
     def calculate_valid_moves(self, from_square):
-        """Calculate valid moves for selected piece (client-side preview)"""
+        """Calculate legal moves for selected piece (client-side preview, check and pin aware)"""
         self.valid_moves = []
         row, col = from_square
         piece = self.board[row][col]
@@ -591,115 +582,9 @@ class ChessClient:
         if not piece:
             return
 
-        piece_type = piece.split('_')[1]
         piece_color = piece.split('_')[0]
-
-        # Generate moves based on piece type (simplified client-side validation)
-        if piece_type == 'pawn':
-            self.calculate_pawn_moves(from_square, piece_color)
-        elif piece_type == 'rook':
-            self.calculate_rook_moves(from_square, piece_color)
-        elif piece_type == 'knight':
-            self.calculate_knight_moves(from_square, piece_color)
-        elif piece_type == 'bishop':
-            self.calculate_bishop_moves(from_square, piece_color)
-        elif piece_type == 'queen':
-            self.calculate_queen_moves(from_square, piece_color)
-        elif piece_type == 'king':
-            self.calculate_king_moves(from_square, piece_color)
-
-    def calculate_pawn_moves(self, from_square, color):
-        """Calculate pawn moves"""
-        row, col = from_square
-        direction = -1 if color == 'white' else 1
-
-        # Forward move
-        new_row = row + direction
-        if 0 <= new_row < 9 and self.board[new_row][col] is None:
-            self.valid_moves.append((new_row, col))
-
-            # Double move from starting position
-            if ((color == 'white' and row == 7) or (color == 'black' and row == 1)):
-                new_row = row + 2 * direction
-                if 0 <= new_row < 9 and self.board[new_row][col] is None:
-                    self.valid_moves.append((new_row, col))
-
-        # Diagonal captures
-        for dc in [-1, 1]:
-            new_row, new_col = row + direction, col + dc
-            if (0 <= new_row < 9 and 0 <= new_col < 9):
-                target = self.board[new_row][new_col]
-                if target and not target.startswith(color):
-                    self.valid_moves.append((new_row, new_col))
-
-    def calculate_rook_moves(self, from_square, color):
-        """Calculate rook moves"""
-        row, col = from_square
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-
-        for dr, dc in directions:
-            for i in range(1, 9):
-                new_row, new_col = row + i * dr, col + i * dc
-                if not (0 <= new_row < 9 and 0 <= new_col < 9):
-                    break
-
-                target = self.board[new_row][new_col]
-                if target is None:
-                    self.valid_moves.append((new_row, new_col))
-                elif not target.startswith(color):
-                    self.valid_moves.append((new_row, new_col))
-                    break
-                else:
-                    break
-
-    def calculate_knight_moves(self, from_square, color):
-        """Calculate knight moves"""
-        row, col = from_square
-        moves = [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)]
-
-        for dr, dc in moves:
-            new_row, new_col = row + dr, col + dc
-            if (0 <= new_row < 9 and 0 <= new_col < 9):
-                target = self.board[new_row][new_col]
-                if target is None or not target.startswith(color):
-                    self.valid_moves.append((new_row, new_col))
-
-    def calculate_bishop_moves(self, from_square, color):
-        """Calculate bishop moves"""
-        row, col = from_square
-        directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-
-        for dr, dc in directions:
-            for i in range(1, 9):
-                new_row, new_col = row + i * dr, col + i * dc
-                if not (0 <= new_row < 9 and 0 <= new_col < 9):
-                    break
-
-                target = self.board[new_row][new_col]
-                if target is None:
-                    self.valid_moves.append((new_row, new_col))
-                elif not target.startswith(color):
-                    self.valid_moves.append((new_row, new_col))
-                    break
-                else:
-                    break
-
-    def calculate_queen_moves(self, from_square, color):
-        """Calculate queen moves (combination of rook and bishop)"""
-        self.calculate_rook_moves(from_square, color)
-        self.calculate_bishop_moves(from_square, color)
-
-    def calculate_king_moves(self, from_square, color):
-        """Calculate king moves"""
-        row, col = from_square
-        moves = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
-
-        for dr, dc in moves:
-            new_row, new_col = row + dr, col + dc
-            if (0 <= new_row < 9 and 0 <= new_col < 9):
-                target = self.board[new_row][new_col]
-                if target is None or not target.startswith(color):
-                    self.valid_moves.append((new_row, new_col))
+        position = position_from_board(self.board, COLOR_INDEX[piece_color])
+        self.valid_moves = legal_destinations(position, square(row, col))
 
     def make_move(self, from_square, to_square):
         """Send move to server and update local board optimistically"""
@@ -729,6 +614,29 @@ class ChessClient:
             self.board[from_row][from_col] = moving_piece
             self.board[to_row][to_col] = captured_piece
 
+    def apply_move_delta(self, message, move=None):
+        """Bring the board up to a move delta; ask for the whole board on a missed move or a hash mismatch"""
+        if self.syncing:
+            return  # the board_sync on its way is newer than this
+        if 'board' in message:
+            self.board = message['board']
+        elif message['seq'] != self.move_seq + 1:
+            self.request_board_sync()
+            return
+        elif move:
+            (from_row, from_col), (to_row, to_col) = move
+            self.board[to_row][to_col] = self.board[from_row][from_col]
+            self.board[from_row][from_col] = None
+        self.move_seq = message['seq']
+
+        if position_from_board(self.board, COLOR_INDEX[message['turn']]).key != message['hash']:
+            self.request_board_sync()
+
+    def request_board_sync(self):
+        """Ask the server for the whole position, ignoring move deltas until it comes"""
+        self.syncing = True
+        self.send_message({'type': 'sync'})
+
     def join_queue(self):
         """Join matchmaking queue"""
         self.send_message({'type': 'join_queue'})
@@ -756,6 +664,7 @@ class ChessClient:
         self.username = ""
         self.user_stats = {}
         self.in_queue = False
+        self.session_ticket = None
         if self.connected:
             self.socket.close()
             self.connected = False
@@ -1049,8 +958,9 @@ class ChessClient:
             pygame.display.flip()
             self.clock.tick(60)
 
-        # Cleanup
+        # Cleanup (not connected first, so the receive thread doesn't try to resume)
         if self.connected:
+            self.connected = False
             self.socket.close()
         pygame.quit()
 
@@ -0,0 +1,538 @@
+"""Multi-process chess server: several workers share one port, a matchmaker pairs their players.
+
+    python server.py --workers 4 [--async]
+
+A supervisor forks one matchmaker process and N worker processes, and
+restarts any of them that exits. Each worker is a normal ChessServer (or
+AsyncChessServer) whose listening socket is bound with SO_REUSEPORT, so the
+kernel spreads new connections across workers and no process accepts on
+behalf of another.
+
+Players on different workers still meet through one queue. When a worker
+answers join_queue it stops reading that connection and sends the socket
+itself, with the session state (AES key, username, unread bytes), to the
+matchmaker over a Unix socketpair (SCM_RIGHTS). The matchmaker holds the
+queued sockets; once two are waiting it passes both to one worker
+(round-robin), which adopts them without a new handshake and starts the game
+there, so a game's moves never cross a process boundary. A queued socket that
+becomes readable (leave_queue, or a disconnect) is handed back to a worker as
+a lone player, or closed on EOF.
+
+Workers share users.pkl: account messages and game starts reload it under a
+file lock, and saves write back only the accounts this worker changed.
+
+Workers also share one session ticket key, so a client can resume its
+session on whichever worker the kernel picks, and one directory of spent
+tickets (an empty file per ticket used, created exclusively), so a ticket
+resumes one connection on one worker only. Game ids start with the index of
+the worker running the game; a connection that resumes into a game on
+another worker is passed, through the matchmaker, to that worker.
+
+Needs fork, SO_REUSEPORT and socket.send_fds (Linux or BSD, Python 3.9+).
+"""
+import asyncio
+import base64
+import copy
+import fcntl
+import json
+import multiprocessing
+import hashlib
+import os
+import select
+import selectors
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from config import CONNECTION_TIMEOUT, MAX_CONNECTIONS
+from framing import FrameReader, OutboundQueue
+from handshake import SUPPORTED_HANDSHAKES, HandshakePool, SessionTickets, TicketError
+from records import SERVER, record_layer
+from wire import wire_format
+from server import ChessServer, AsyncChessServer
+
+# Payload bytes per datagram on a matchmaker link; a longer message (a session state carries
+# the client's unread bytes, up to a whole frame) continues in follow-up datagrams
+IPC_CHUNK_SIZE = 64 * 1024
+
+# First byte of each datagram: another part of the same message follows, or this is the last
+MORE_PARTS = b'+'
+LAST_PART = b'.'
+
+# Sockets carried by one matchmaker message (a matched pair)
+MAX_FDS_PER_MESSAGE = 2
+
+# Messages that read or change accounts; workers reload users.pkl before handling them
+ACCOUNT_MESSAGES = ('register', 'login', 'request_reset', 'reset_password')
+
+# Seconds between the supervisor's checks for exited processes
+RESTART_CHECK_INTERVAL = 1.0
+
+
+def cluster_supported():
+    return hasattr(socket, 'SO_REUSEPORT') and hasattr(socket, 'send_fds') and hasattr(socket, 'AF_UNIX')
+
+
+def send_message(link, message, sockets=()):
+    """Send a JSON message, and the given sockets' descriptors, as one or more datagrams.
+
+    The parts of one message must not interleave with another's, so a link
+    written from several threads needs a lock around this.
+    """
+    data = json.dumps(message).encode('utf-8')
+    fds = [sock.fileno() for sock in sockets]
+    for start in range(0, max(len(data), 1), IPC_CHUNK_SIZE):
+        end = start + IPC_CHUNK_SIZE
+        marker = MORE_PARTS if end < len(data) else LAST_PART
+        while True:
+            try:
+                # The descriptors ride on the first part
+                socket.send_fds(link, [marker, data[start:end]], fds if start == 0 else [])
+                break
+            except BlockingIOError:
+                select.select([], [link], [])  # a non-blocking link whose reader is behind
+
+
+class MessageReader:
+    """Reassembles the messages send_message writes to one link"""
+
+    def __init__(self, link):
+        self.link = link
+        self.parts = []
+        self.sockets = []
+
+    def receive(self):
+        """(message, [sockets]) once a whole message is in; None if a non-blocking link has no more yet"""
+        while True:
+            try:
+                data, fds, flags, _ = socket.recv_fds(self.link, IPC_CHUNK_SIZE + 1, MAX_FDS_PER_MESSAGE)
+            except BlockingIOError:
+                return None
+            self.sockets += [socket.socket(fileno=fd) for fd in fds]
+            if flags & (socket.MSG_TRUNC | socket.MSG_CTRUNC) or data[:1] not in (MORE_PARTS, LAST_PART):
+                self.discard()
+                raise ValueError("Malformed matchmaker message")
+            self.parts.append(data[1:])
+            if data[:1] == LAST_PART:
+                message, sockets = json.loads(b''.join(self.parts)), self.sockets
+                self.parts, self.sockets = [], []
+                return message, sockets
+
+    def discard(self):
+        """Drop a partly received message, closing the descriptors it carried"""
+        for sock in self.sockets:
+            sock.close()
+        self.parts, self.sockets = [], []
+
+
+def export_client(client_info, unread):
+    """Session state that lets another process carry on a client's connection"""
+    return {
+        'address': list(client_info['address']),
+        'aes_key': client_info['records'].key.hex(),
+        'record': client_info['records'].version,
+        'record_state': client_info['records'].export(),
+        'wire': client_info['wire'].version,
+        'codec': client_info['wire'].codec.version,
+        'username': client_info['username'],
+        'resumable': client_info.get('resumable', False),
+        'unread': base64.b64encode(unread).decode('ascii')
+    }
+
+
+def import_client(state):
+    """(client info, unread bytes) from an exported session state"""
+    client_info = {
+        'address': tuple(state['address']),
+        'records': record_layer(state['record'], bytes.fromhex(state['aes_key']), SERVER, state['record_state']),
+        'wire': wire_format(state['wire'], state['codec']),
+        'username': state['username'],
+        'resumable': state['resumable'],
+        'game_id': None
+    }
+    return client_info, base64.b64decode(state['unread'])
+
+
+class SharedSessionTickets(SessionTickets):
+    """Session tickets whose spent list is a directory shared by every worker process"""
+
+    def __init__(self, key, spent_dir):
+        super().__init__(key)
+        self.spent_dir = spent_dir
+
+    def marker(self, ticket, expires):
+        """Spent-ticket file, in a directory per lifetime's worth of expiry times"""
+        bucket = os.path.join(self.spent_dir, str(int(expires // self.lifetime)))
+        return bucket, os.path.join(bucket, hashlib.sha256(ticket.encode('ascii')).hexdigest())
+
+    def is_spent(self, ticket, expires):
+        return os.path.exists(self.marker(ticket, expires)[1])
+
+    def spend(self, ticket, expires):
+        bucket, marker = self.marker(ticket, expires)
+        os.makedirs(bucket, exist_ok=True)
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            raise TicketError("Session ticket already used") from None
+
+        # Buckets whose tickets have all expired are refused anyway; forget them
+        current = int(time.time() // self.lifetime)
+        for name in os.listdir(self.spent_dir):
+            if int(name) < current:
+                shutil.rmtree(os.path.join(self.spent_dir, name), ignore_errors=True)
+
+
+class Matchmaker:
+    """Queue of players handed in by the workers; pairs go back to one worker"""
+
+    def __init__(self, worker_links):
+        self.worker_links = worker_links
+        self.readers = {link: MessageReader(link) for link in worker_links}
+        self.next_worker = 0
+        self.waiting = {}  # client socket: session state, in queue order
+        self.selector = selectors.DefaultSelector()
+
+    def run(self):
+        for link in self.worker_links:
+            self.selector.register(link, selectors.EVENT_READ)
+        print(f"Matchmaker serving {len(self.worker_links)} workers")
+
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj in self.waiting:
+                    self.handle_queued_client(key.fileobj)
+                else:
+                    self.handle_worker_message(key.fileobj)
+
+    def handle_worker_message(self, link):
+        try:
+            received = self.readers[link].receive()
+        except ValueError as e:
+            print(f"Matchmaker: {e}")
+            return
+        if received is None:
+            return
+        message, sockets = received
+        if message.get('op') not in ('enqueue', 'resume') or len(sockets) != 1:
+            print(f"Matchmaker: unexpected message {message.get('op')!r}")
+            for sock in sockets:
+                sock.close()
+            return
+
+        if message['op'] == 'resume':
+            # A session resumed on one worker into a game running on another
+            worker = message['worker']
+            if not 0 <= worker < len(self.worker_links):
+                print(f"Matchmaker: no worker {worker} for game {message['game_id']}")
+                sockets[0].close()
+                return
+            self.hand_over(worker, {'op': 'adopt', 'match': False, 'clients': [message['client']],
+                                    'resume': message['game_id']}, sockets)
+            return
+
+        client_socket = sockets[0]
+        self.waiting[client_socket] = message['client']
+        self.selector.register(client_socket, selectors.EVENT_READ)
+        print(f"{message['client']['username']} queued ({len(self.waiting)} waiting)")
+
+        if len(self.waiting) >= 2:
+            player1, player2 = list(self.waiting)[:2]
+            self.dispatch([player1, player2], match=True)
+
+    def handle_queued_client(self, client_socket):
+        """A queued client sent something or hung up"""
+        try:
+            peek = client_socket.recv(1, socket.MSG_PEEK)
+        except OSError:
+            peek = b''
+        if peek:
+            # Most likely leave_queue; a worker processes it like any other message
+            self.dispatch([client_socket], match=False)
+            return
+
+        state = self.remove(client_socket)
+        print(f"{state['username']} disconnected while queued")
+        client_socket.close()
+
+    def remove(self, client_socket):
+        self.selector.unregister(client_socket)
+        return self.waiting.pop(client_socket)
+
+    def dispatch(self, sockets, match):
+        """Hand clients (a matched pair, or one returning player) to the next worker"""
+        states = [self.remove(client_socket) for client_socket in sockets]
+        worker = self.next_worker
+        self.next_worker = (self.next_worker + 1) % len(self.worker_links)
+        self.hand_over(worker, {'op': 'adopt', 'match': match, 'clients': states}, sockets)
+
+    def hand_over(self, worker, message, sockets):
+        """Send clients to one worker, which adopts them"""
+        try:
+            send_message(self.worker_links[worker], message, sockets)
+        except OSError as e:
+            print(f"Matchmaker: could not reach worker: {e}")
+        finally:
+            # The worker has its own copies of the descriptors now
+            for client_socket in sockets:
+                client_socket.close()
+
+
+class ClusterWorker:
+    """Mixin for a ChessServer running as one worker process of the cluster"""
+
+    def __init__(self, host, port, matchmaker_link, worker_index=0):
+        super().__init__(host, port)
+        self.worker_index = worker_index
+        self.matchmaker = matchmaker_link
+        self.matchmaker_reader = MessageReader(matchmaker_link)
+        self.matchmaker_lock = threading.Lock()  # connection threads hand off players concurrently
+        self.users_snapshot = copy.deepcopy(self.users)  # users.pkl as of the last sync
+
+    @contextmanager
+    def user_db_lock(self):
+        """Exclusive lock on users.pkl shared by all worker processes (and threads)"""
+        with open(self.db_file + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def sync_users(self, write=False):
+        """Merge accounts changed in this worker into the current file, optionally writing it back"""
+        with self.users_lock, self.user_db_lock():
+            users = ChessServer.load_users(self)
+            for username, user_data in list(self.users.items()):
+                if user_data != self.users_snapshot.get(username):
+                    users[username] = user_data
+            self.users = users
+            if write:
+                ChessServer.save_users(self)
+            self.users_snapshot = copy.deepcopy(users)
+
+    def save_users(self):
+        self.sync_users(write=True)
+
+    def process_message(self, client_socket, message):
+        if message.get('type') in ACCOUNT_MESSAGES:
+            self.sync_users()
+        return super().process_message(client_socket, message)
+
+    def start_match(self, player1, player2):
+        # Stats are updated in this process for the rest of the game; start from the file
+        self.sync_users()
+        return super().start_match(player1, player2)
+
+    def new_game_id(self):
+        # Lets any worker tell which one runs the game a session ticket resumes into
+        return f"{self.worker_index}-{super().new_game_id()}"
+
+    def game_worker(self, game_id):
+        """Index of the worker running a game"""
+        return int(game_id.split('-', 1)[0])
+
+    def resume_session(self, client_socket, session):
+        if session['game_id'] and self.game_worker(session['game_id']) != self.worker_index:
+            # after_response passes the connection on to the game's worker, which answers it
+            self.clients[client_socket].update(username=session['username'], resumable=True, handoff=True,
+                                               resume_game=session['game_id'])
+            return
+        # The resumed client is sent its stats, which another worker may have changed
+        self.sync_users()
+        return super().resume_session(client_socket, session)
+
+    def adopt_resumed(self, client_socket, game_id):
+        """Back into its game, a session that was resumed on another worker"""
+        self.resume_session(client_socket, {'username': self.clients[client_socket]['username'], 'game_id': game_id})
+
+    def hand_off(self, client_info, unread, client_socket):
+        """Send a client's connection and session state to the matchmaker, to queue it or route its resume"""
+        message = {'op': 'enqueue', 'client': export_client(client_info, unread)}
+        if client_info.get('resume_game'):
+            message.update(op='resume', worker=self.game_worker(client_info['resume_game']),
+                           game_id=client_info['resume_game'])
+        with self.matchmaker_lock:
+            send_message(self.matchmaker, message, [client_socket])
+
+
+class ThreadedWorker(ClusterWorker, ChessServer):
+    """ChessServer worker: a thread per connection, plus one reading the matchmaker link"""
+
+    def __init__(self, host, port, matchmaker_link, worker_index=0):
+        super().__init__(host, port, matchmaker_link, worker_index)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    def start_server(self):
+        threading.Thread(target=self.receive_from_matchmaker, daemon=True).start()
+        super().start_server()
+
+    def receive_from_matchmaker(self):
+        while True:
+            try:
+                message, sockets = self.matchmaker_reader.receive()
+                self.adopt_clients(message, sockets)
+            except Exception as e:
+                print(f"Error adopting clients: {e}")
+
+    def adopt_clients(self, message, sockets):
+        """Take over connections sent by the matchmaker and start their game if they were matched"""
+        players = []
+        for state, client_socket in zip(message['clients'], sockets):
+            client_info, unread = import_client(state)
+            client_info['outbound'] = OutboundQueue(client_socket, client_info['records'].seal)
+            self.clients[client_socket] = client_info
+            frame_reader = FrameReader(client_socket)
+            frame_reader.feed(unread)
+            players.append((client_socket, frame_reader))
+
+        if message['match']:
+            self.start_match(players[0][0], players[1][0])
+        elif message.get('resume'):
+            self.adopt_resumed(players[0][0], message['resume'])
+
+        for client_socket, frame_reader in players:
+            client_thread = threading.Thread(
+                target=self.serve_client,
+                args=(client_socket, self.clients[client_socket]['address'], frame_reader)
+            )
+            client_thread.daemon = True
+            client_thread.start()
+
+    def after_response(self, client_socket, frame_reader):
+        # A player who just joined the queue, or resumed into another worker's game, goes to the matchmaker
+        if not self.clients[client_socket].get('handoff'):
+            return False
+        client_info = self.clients.pop(client_socket)
+        outbound = client_info.pop('outbound')
+        # 'Joined queue' must reach the client before another process writes to it
+        flushed = outbound.flush()
+        outbound.close()
+        if flushed:
+            self.hand_off(client_info, frame_reader.take_pending(), client_socket)
+        return True
+
+
+class AsyncWorker(ClusterWorker, AsyncChessServer):
+    """AsyncChessServer worker; the matchmaker link is read from the event loop"""
+
+    async def serve(self):
+        self.matchmaker.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.matchmaker, self.receive_from_matchmaker)
+        await super().serve(reuse_port=True)
+
+    def receive_from_matchmaker(self):
+        try:
+            received = self.matchmaker_reader.receive()
+        except ValueError as e:
+            print(f"Error adopting clients: {e}")
+            return
+        if received is not None:
+            self.loop.create_task(self.adopt_connections(*received))
+
+    async def adopt_connections(self, message, sockets):
+        """Take over connections sent by the matchmaker and start their game if they were matched"""
+        players = []
+        for state, client_socket in zip(message['clients'], sockets):
+            reader, writer = await asyncio.open_connection(sock=client_socket)
+            client_info, unread = import_client(state)
+            self.clients[writer] = client_info
+            frame_reader = FrameReader()
+            frame_reader.feed(unread)
+            players.append((reader, writer, frame_reader))
+
+        if message['match']:
+            self.start_match(players[0][1], players[1][1])
+        elif message.get('resume'):
+            self.adopt_resumed(players[0][1], message['resume'])
+
+        for reader, writer, frame_reader in players:
+            self.loop.create_task(self.serve_connection(reader, writer, frame_reader))
+
+    async def after_response(self, writer, frame_reader):
+        # A player who just joined the queue, or resumed into another worker's game, goes to the matchmaker
+        if not self.clients[writer].get('handoff'):
+            return False
+        transport = writer.transport
+        # Nothing more may be read here; 'Joined queue' must be fully sent before another process writes
+        transport.pause_reading()
+        transport.set_write_buffer_limits(0)
+        await writer.drain()
+        client_info = self.clients.pop(writer)
+        if not transport.is_closing():
+            self.hand_off(client_info, frame_reader.take_pending(), writer.get_extra_info('socket'))
+        return True
+
+
+def run_matchmaker(worker_links):
+    try:
+        Matchmaker(worker_links).run()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_worker(worker_class, index, host, port, matchmaker_link, max_connections, connection_timeout, handshakes,
+               ticket_key, spent_dir):
+    try:
+        worker = worker_class(host, port, matchmaker_link, index)
+        worker.max_connections = max_connections
+        worker.connection_timeout = connection_timeout
+        worker.handshakes = handshakes
+        worker.session_tickets = SharedSessionTickets(ticket_key, spent_dir)
+        # Worker processes are daemonic and can't start a handshake pool of their own;
+        # the cluster already spreads handshakes over one process per worker
+        worker.handshake_pool = HandshakePool(0)
+        worker.start_server()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_cluster(host, port, workers, use_asyncio=False, max_connections=MAX_CONNECTIONS,
+                connection_timeout=CONNECTION_TIMEOUT, handshakes=SUPPORTED_HANDSHAKES):
+    """Supervise a matchmaker and `workers` server processes until interrupted"""
+    if not cluster_supported():
+        raise SystemExit("Cluster mode needs SO_REUSEPORT and Unix socket descriptor passing")
+
+    context = multiprocessing.get_context('fork')
+    worker_class = AsyncWorker if use_asyncio else ThreadedWorker
+
+    # One datagram socketpair per worker. The supervisor keeps both ends open, so a
+    # restarted process inherits its link and messages sent meanwhile are not lost.
+    links = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(workers)]
+
+    # Tickets issued by any worker (or one since restarted) open on every worker, and only once
+    ticket_key = os.urandom(32)
+    spent_dir = tempfile.mkdtemp(prefix='chess2-spent-tickets-')
+
+    def spawn(name):
+        if name == 'matchmaker':
+            target, args = run_matchmaker, ([matchmaker_end for matchmaker_end, _ in links],)
+        else:
+            index = int(name.split('-')[1])
+            target, args = run_worker, (worker_class, index, host, port, links[index][1], max_connections,
+                                   connection_timeout, handshakes, ticket_key, spent_dir)
+        process = context.Process(target=target, args=args, name=name, daemon=True)
+        process.start()
+        return process
+
+    processes = {name: spawn(name) for name in ['matchmaker'] + [f'worker-{i}' for i in range(workers)]}
+    print(f"Cluster supervisor: {workers} workers on {host}:{port}")
+
+    try:
+        while True:
+            time.sleep(RESTART_CHECK_INTERVAL)
+            for name, process in processes.items():
+                if not process.is_alive():
+                    print(f"{name} (pid {process.pid}) exited with code {process.exitcode}; restarting")
+                    processes[name] = spawn(name)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+        shutil.rmtree(spent_dir, ignore_errors=True)
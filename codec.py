@@ -0,0 +1,76 @@
+"""Message codecs: how a message the wire format has no binary layout for becomes bytes.
+
+CODEC_JSON uses orjson when it is installed; CODEC_MSGPACK needs msgpack at both ends.
+"""
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Codecs, oldest first
+CODEC_JSON = 1
+CODEC_MSGPACK = 2
+
+if msgpack is None:
+    SUPPORTED_CODECS = (CODEC_JSON,)
+elif orjson is None:
+    SUPPORTED_CODECS = (CODEC_MSGPACK, CODEC_JSON)
+else:
+    SUPPORTED_CODECS = (CODEC_JSON, CODEC_MSGPACK)
+
+# A run of digits this long may be an integer beyond 64 bits, which orjson reads back as a float
+LONG_NUMBER = re.compile(rb'\d{19}')
+
+
+class JsonCodec:
+    """JSON, through orjson where it's installed"""
+
+    version = CODEC_JSON
+
+    def encode(self, message):
+        if orjson is not None:
+            try:
+                return orjson.dumps(message)
+            except TypeError:
+                pass
+        return json.dumps(message).encode('utf-8')
+
+    def decode(self, data):
+        if orjson is not None and not LONG_NUMBER.search(data):
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    """MessagePack, for sessions where both ends have msgpack"""
+
+    version = CODEC_MSGPACK
+
+    def encode(self, message):
+        return msgpack.packb(message)
+
+    def decode(self, data):
+        return msgpack.unpackb(data)
+
+
+CODECS = {CODEC_JSON: JsonCodec(), CODEC_MSGPACK: MsgpackCodec()}
+
+
+def message_codec(version):
+    """Codec for a version this process supports (they hold no state, so sessions share them)"""
+    if version not in SUPPORTED_CODECS:
+        raise ValueError(f"Unsupported codec {version!r}")
+    return CODECS[version]
+
+
+def choose_codec(offered, supported=SUPPORTED_CODECS):
+    """First codec in the server's offer (its order of preference) that this end has too"""
+    return next((codec for codec in offered if codec in supported), CODEC_JSON)
@@ -19,6 +19,7 @@ USER_DATABASE_FILE = "users.pkl"
 # Game Configuration
 BOARD_SIZE = 9  # 9x9 board
 QUEENS_PER_SIDE = 2
+FULL_BOARD_INTERVAL = 16  # moves between the move deltas that also carry the whole board
 
 # Client Configuration
 WINDOW_WIDTH = 1000
@@ -54,5 +55,9 @@ HASH_ITERATIONS = 10000
 
 # Timeouts and Limits
 CONNECTION_TIMEOUT = 30  # seconds
+IDLE_TIMEOUT = 600  # seconds a connection may sit idle outside a game or the queue
 RESET_CODE_EXPIRY = 600  # 10 minutes in seconds
-MAX_CONNECTIONS = 100
\ No newline at end of file
+SESSION_TICKET_LIFETIME = 3600  # seconds a session ticket can resume a login
+RESUME_GRACE_PERIOD = 30  # seconds a disconnected player's game waits for them to resume
+MAX_CONNECTIONS = 100
+CLIENT_OFFER_WAIT = 0.25  # seconds the server waits for a client to say what it speaks before sending the full hello
\ No newline at end of file
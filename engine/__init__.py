@@ -0,0 +1,15 @@
+"""Rules engine for the 9x9 two-queen chess variant"""
+from .pieces import (
+    Piece,
+    WHITE, BLACK, COLOR_NAMES, COLOR_INDEX,
+    PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+    PIECE_TYPE_NAMES, PIECE_TYPE_INDEX, PIECE_NAMES, PIECE_CODES, COLOR_SHIFT,
+    make_piece, piece_color, piece_type, encode_board, decode_board,
+)
+from .bitboard import BitboardPosition, square, square_to_pos, iter_bits
+from .zobrist import PIECE_SQUARE_KEYS, SIDE_TO_MOVE_KEY, HAS_MOVED_KEYS, hash_squares
+from .movecache import LegalMoveCache, move_cache
+from .notation import (
+    START_POSITION, parse_position, format_position, square_name, parse_square, move_name,
+)
+from .rules import position_from_board, position_from_piece_dicts, legal_moves, legal_destinations
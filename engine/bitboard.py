@@ -0,0 +1,409 @@
+"""Bitboard position for the 9x9 two-queen variant.
+
+Squares are numbered row * 9 + col (row 0 is black's back rank), so the whole
+board fits in an 81-bit Python int. Attack sets come from precomputed tables:
+knight, king and pawn attacks directly, sliding pieces from ray masks cut at
+the first blocker.
+"""
+
+from .pieces import (
+    WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+    COLOR_SHIFT, TYPE_MASK, EMPTY, encode_board, decode_board
+)
+from .zobrist import PIECE_SQUARE_KEYS, SIDE_TO_MOVE_KEY
+
+BOARD_SIZE = 9
+NUM_SQUARES = BOARD_SIZE * BOARD_SIZE
+FULL_BOARD = (1 << NUM_SQUARES) - 1
+
+PAWN_DIRECTION = (-1, 1)  # row step for white, black
+PAWN_START_ROW = (7, 1)
+
+# Ray directions as (row, col) steps. The first four increase the square index,
+# so the nearest blocker on those rays is the lowest set bit; on the other four
+# it is the highest.
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1), (0, -1), (-1, 0), (-1, -1), (-1, 1))
+ROOK_RAYS = (0, 1, 4, 5)
+BISHOP_RAYS = (2, 3, 6, 7)
+
+KNIGHT_OFFSETS = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+KING_OFFSETS = DIRECTIONS
+
+
+def square(row, col):
+    """Square index for a (row, col) pair"""
+    return row * BOARD_SIZE + col
+
+
+def square_to_pos(sq):
+    """(row, col) pair for a square index"""
+    return divmod(sq, BOARD_SIZE)
+
+
+def iter_bits(bb):
+    """Yield the square index of every set bit"""
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def _offset_table(offsets):
+    table = []
+    for sq in range(NUM_SQUARES):
+        row, col = square_to_pos(sq)
+        mask = 0
+        for dr, dc in offsets:
+            r, c = row + dr, col + dc
+            if 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE:
+                mask |= 1 << square(r, c)
+        table.append(mask)
+    return tuple(table)
+
+
+def _ray_table():
+    rays = []
+    for dr, dc in DIRECTIONS:
+        table = []
+        for sq in range(NUM_SQUARES):
+            row, col = square_to_pos(sq)
+            mask = 0
+            r, c = row + dr, col + dc
+            while 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE:
+                mask |= 1 << square(r, c)
+                r += dr
+                c += dc
+            table.append(mask)
+        rays.append(tuple(table))
+    return tuple(rays)
+
+
+KNIGHT_ATTACKS = _offset_table(KNIGHT_OFFSETS)
+KING_ATTACKS = _offset_table(KING_OFFSETS)
+PAWN_ATTACKS = (
+    _offset_table(((-1, -1), (-1, 1))),  # squares a white pawn attacks
+    _offset_table(((1, -1), (1, 1)))     # squares a black pawn attacks
+)
+RAYS = _ray_table()
+
+
+def _between_table():
+    """BETWEEN[a][b]: squares strictly between two squares on a shared ray (0 if not aligned)"""
+    table = [[0] * NUM_SQUARES for _ in range(NUM_SQUARES)]
+    for rays in RAYS:
+        for a in range(NUM_SQUARES):
+            for b in iter_bits(rays[a]):
+                table[a][b] = rays[a] ^ rays[b] ^ (1 << b)
+    return tuple(tuple(row) for row in table)
+
+
+BETWEEN = _between_table()
+
+
+def ray_attacks(sq, occupied, directions):
+    """Squares reached from sq along the given rays, stopping at (and including) the first blocker"""
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][sq]
+        blockers = ray & occupied
+        if blockers:
+            if direction < 4:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    return ray_attacks(sq, occupied, ROOK_RAYS)
+
+
+def bishop_attacks(sq, occupied):
+    return ray_attacks(sq, occupied, BISHOP_RAYS)
+
+
+class BitboardPosition:
+    """Piece placement held as per-color, per-type occupancy masks plus a piece-code mailbox"""
+
+    def __init__(self):
+        self.pieces = [[0] * 6, [0] * 6]  # pieces[color][piece_type] -> mask
+        self.occupied = [0, 0]            # occupied[color] -> mask
+        self.squares = bytearray(NUM_SQUARES)  # square -> piece code (0 for empty)
+        self.piece_squares = [set(), set()]  # piece_squares[color] -> occupied squares
+        self.king_squares = [None, None]     # king_squares[color] -> square or None
+        self.check_cache = None  # [white_in_check, black_in_check], cleared on any change
+        self.turn = WHITE
+        self.key = 0  # Zobrist key, updated incrementally
+
+    @classmethod
+    def from_squares(cls, squares, turn=WHITE):
+        """Build a position from 81 piece codes"""
+        position = cls()
+        for sq, piece in enumerate(squares):
+            if piece:
+                position.put_piece(sq, piece)
+        if turn != WHITE:
+            position.turn = turn
+            position.key ^= SIDE_TO_MOVE_KEY
+        return position
+
+    @classmethod
+    def from_board(cls, board, turn=WHITE):
+        """Build a position from a 9x9 list of 'color_type' strings (None for empty)"""
+        return cls.from_squares(encode_board(board), turn)
+
+    def to_board(self):
+        """9x9 list of 'color_type' strings for the wire format"""
+        return decode_board(self.squares)
+
+    def put_piece(self, sq, piece):
+        """Place a piece code on an empty square"""
+        bit = 1 << sq
+        color = piece >> COLOR_SHIFT
+        piece_type = (piece & TYPE_MASK) - 1
+        self.pieces[color][piece_type] |= bit
+        self.occupied[color] |= bit
+        self.squares[sq] = piece
+        self.key ^= PIECE_SQUARE_KEYS[piece][sq]
+        self.piece_squares[color].add(sq)
+        if piece_type == KING:
+            self.king_squares[color] = sq
+        self.check_cache = None
+
+    def remove_piece(self, sq):
+        """Remove and return the piece code on sq"""
+        piece = self.squares[sq]
+        bit = 1 << sq
+        color = piece >> COLOR_SHIFT
+        piece_type = (piece & TYPE_MASK) - 1
+        self.pieces[color][piece_type] ^= bit
+        self.occupied[color] ^= bit
+        self.squares[sq] = EMPTY
+        self.key ^= PIECE_SQUARE_KEYS[piece][sq]
+        self.piece_squares[color].discard(sq)
+        if piece_type == KING and self.king_squares[color] == sq:
+            self.king_squares[color] = None
+        self.check_cache = None
+        return piece
+
+    def king_square(self, color):
+        """Square of the king of the given color, or None"""
+        return self.king_squares[color]
+
+    def attackers_to(self, sq, by_color, occupied=None):
+        """Mask of by_color pieces attacking sq"""
+        if occupied is None:
+            occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        pieces = self.pieces[by_color]
+        queens = pieces[QUEEN]
+        return ((PAWN_ATTACKS[1 - by_color][sq] & pieces[PAWN]) |
+                (KNIGHT_ATTACKS[sq] & pieces[KNIGHT]) |
+                (KING_ATTACKS[sq] & pieces[KING]) |
+                (rook_attacks(sq, occupied) & (pieces[ROOK] | queens)) |
+                (bishop_attacks(sq, occupied) & (pieces[BISHOP] | queens)))
+
+    def is_square_attacked(self, sq, by_color):
+        """Check if a square is attacked by pieces of the given color"""
+        pieces = self.pieces[by_color]
+        if (PAWN_ATTACKS[1 - by_color][sq] & pieces[PAWN] or
+                KNIGHT_ATTACKS[sq] & pieces[KNIGHT] or
+                KING_ATTACKS[sq] & pieces[KING]):
+            return True
+
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        queens = pieces[QUEEN]
+        return bool(rook_attacks(sq, occupied) & (pieces[ROOK] | queens) or
+                    bishop_attacks(sq, occupied) & (pieces[BISHOP] | queens))
+
+    def is_in_check(self, color):
+        """Check if the king of the given color is attacked (cached until the position changes)"""
+        cache = self.check_cache
+        if cache is None:
+            cache = self.check_cache = [None, None]
+        in_check = cache[color]
+        if in_check is None:
+            king_sq = self.king_squares[color]
+            in_check = king_sq is not None and self.is_square_attacked(king_sq, 1 - color)
+            cache[color] = in_check
+        return in_check
+
+    def pawn_targets(self, from_sq, color, occupied):
+        """Mask of pushes and captures for a pawn of color on from_sq"""
+        targets = PAWN_ATTACKS[color][from_sq] & self.occupied[1 - color]
+        to_sq = from_sq + PAWN_DIRECTION[color] * BOARD_SIZE
+        if 0 <= to_sq < NUM_SQUARES and not occupied >> to_sq & 1:
+            targets |= 1 << to_sq
+            if from_sq // BOARD_SIZE == PAWN_START_ROW[color]:
+                to_sq += PAWN_DIRECTION[color] * BOARD_SIZE
+                if not occupied >> to_sq & 1:
+                    targets |= 1 << to_sq
+        return targets
+
+    def piece_targets(self, from_sq, piece, own, occupied):
+        """Mask of pseudo-legal destinations for piece on from_sq given both occupancy masks"""
+        piece_type = (piece & TYPE_MASK) - 1
+        if piece_type == PAWN:
+            return self.pawn_targets(from_sq, piece >> COLOR_SHIFT, occupied)
+        elif piece_type == KNIGHT:
+            attacks = KNIGHT_ATTACKS[from_sq]
+        elif piece_type == BISHOP:
+            attacks = bishop_attacks(from_sq, occupied)
+        elif piece_type == ROOK:
+            attacks = rook_attacks(from_sq, occupied)
+        elif piece_type == QUEEN:
+            attacks = rook_attacks(from_sq, occupied) | bishop_attacks(from_sq, occupied)
+        else:
+            attacks = KING_ATTACKS[from_sq]
+        return attacks & ~own
+
+    def move_targets(self, from_sq):
+        """Mask of pseudo-legal destinations for the piece on from_sq"""
+        piece = self.squares[from_sq]
+        if not piece:
+            return 0
+        own = self.occupied[piece >> COLOR_SHIFT]
+        return self.piece_targets(from_sq, piece, own, self.occupied[WHITE] | self.occupied[BLACK])
+
+    def pseudo_legal_moves(self, color):
+        """Yield (from_sq, to_sq) for every move that follows piece rules, ignoring check"""
+        squares = self.squares
+        own = self.occupied[color]
+        occupied = own | self.occupied[1 - color]
+
+        # Walk the piece list rather than every square; copy it since callers
+        # make and unmake moves while consuming the generator
+        for from_sq in tuple(self.piece_squares[color]):
+            for to_sq in iter_bits(self.piece_targets(from_sq, squares[from_sq], own, occupied)):
+                yield from_sq, to_sq
+
+    def make_move(self, from_sq, to_sq):
+        """Move a piece and pass the turn, returning the captured piece code (0 if none)"""
+        captured = self.squares[to_sq]
+        if captured:
+            self.remove_piece(to_sq)
+        self.put_piece(to_sq, self.remove_piece(from_sq))
+        self.turn ^= 1
+        self.key ^= SIDE_TO_MOVE_KEY
+        return captured
+
+    def unmake_move(self, from_sq, to_sq, captured):
+        """Undo make_move given the piece code it returned"""
+        self.put_piece(from_sq, self.remove_piece(to_sq))
+        if captured:
+            self.put_piece(to_sq, captured)
+        self.turn ^= 1
+        self.key ^= SIDE_TO_MOVE_KEY
+
+    def is_legal_move(self, from_sq, to_sq, color):
+        """Check that a pseudo-legal move does not leave the mover's king in check"""
+        captured = self.make_move(from_sq, to_sq)
+        in_check = self.is_in_check(color)
+        self.unmake_move(from_sq, to_sq, captured)
+        return not in_check
+
+    def checkers_and_pins(self, color):
+        """Return (checkers, pins) for color's king.
+
+        checkers is the mask of enemy pieces giving check. pins maps the square
+        of each absolutely pinned friendly piece to the mask it may still move
+        within: the squares between king and pinner, plus the pinner itself.
+        """
+        king_sq = self.king_squares[color]
+        enemy_color = 1 - color
+        own = self.occupied[color]
+        occupied = own | self.occupied[enemy_color]
+        checkers = self.attackers_to(king_sq, enemy_color, occupied)
+
+        enemy = self.pieces[enemy_color]
+        straight = enemy[ROOK] | enemy[QUEEN]
+        diagonal = enemy[BISHOP] | enemy[QUEEN]
+        pins = {}
+        for direction, sliders in ((0, straight), (1, straight), (4, straight), (5, straight),
+                                   (2, diagonal), (3, diagonal), (6, diagonal), (7, diagonal)):
+            ray = RAYS[direction][king_sq]
+            if not ray & sliders:
+                continue
+            blockers = ray & occupied
+            if direction < 4:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            if not own >> first & 1:
+                continue
+            beyond = RAYS[direction][first] & occupied
+            if not beyond:
+                continue
+            if direction < 4:
+                pinner = (beyond & -beyond).bit_length() - 1
+            else:
+                pinner = beyond.bit_length() - 1
+            if sliders >> pinner & 1:
+                pins[first] = BETWEEN[king_sq][pinner] | (1 << pinner)
+
+        return checkers, pins
+
+    def generate_legal_moves(self, color, captures_first=False):
+        """Yield every legal (from_sq, to_sq) move for color without trying them on the board.
+
+        King moves always come first. With captures_first, captures by the other
+        pieces are yielded before any of their quiet moves.
+        """
+        king_sq = self.king_squares[color]
+        if king_sq is None:
+            yield from self.pseudo_legal_moves(color)
+            return
+
+        squares = self.squares
+        enemy_color = 1 - color
+        own = self.occupied[color]
+        occupied = own | self.occupied[enemy_color]
+        checkers, pins = self.checkers_and_pins(color)
+        if self.check_cache is None:
+            self.check_cache = [None, None]
+        self.check_cache[color] = bool(checkers)
+
+        # King moves: the destination must not be attacked once the king has left
+        # its square, so sliders checking along the line see through it
+        without_king = occupied ^ (1 << king_sq)
+        for to_sq in iter_bits(KING_ATTACKS[king_sq] & ~own):
+            if not self.attackers_to(to_sq, enemy_color, without_king):
+                yield king_sq, to_sq
+
+        if checkers & (checkers - 1):
+            return  # double check: only the king can move
+
+        if checkers:
+            checker_sq = checkers.bit_length() - 1
+            evasion_mask = checkers | BETWEEN[king_sq][checker_sq]
+        else:
+            evasion_mask = FULL_BOARD
+
+        enemy = self.occupied[enemy_color] if captures_first else 0
+        quiet_moves = []
+        for from_sq in tuple(self.piece_squares[color]):
+            if from_sq == king_sq:
+                continue
+            targets = self.piece_targets(from_sq, squares[from_sq], own, occupied) & evasion_mask
+            if from_sq in pins:
+                targets &= pins[from_sq]
+            if enemy:
+                quiet_moves.append((from_sq, targets & ~enemy))
+                targets &= enemy
+            for to_sq in iter_bits(targets):
+                yield from_sq, to_sq
+
+        for from_sq, targets in quiet_moves:
+            for to_sq in iter_bits(targets):
+                yield from_sq, to_sq
+
+    def legal_moves(self, color):
+        """List every legal (from_sq, to_sq) move for color"""
+        return list(self.generate_legal_moves(color))
+
+    def has_legal_move(self, color):
+        """Check if color has at least one legal move, stopping at the first one found"""
+        for _ in self.generate_legal_moves(color, captures_first=True):
+            return True
+        return False
@@ -0,0 +1,73 @@
+"""Process-wide LRU cache of legal move sets keyed by Zobrist position key.
+
+Openings repeat heavily across games, so the first plies of most games hit
+entries another game already computed. Values are frozensets of
+(from_sq, to_sq) pairs; keys are (position key, color to move).
+"""
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class LegalMoveCache:
+    """Bounded, thread-safe LRU map with hit/miss counters"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached move set for key, or None"""
+        with self._lock:
+            moves = self._entries.get(key)
+            if moves is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return moves
+
+    def put(self, key, moves):
+        """Store a move set, evicting the least recently used entry when full"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = moves
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached move set for key, calling compute() and caching the result on a miss"""
+        moves = self.get(key)
+        if moves is None:
+            moves = frozenset(compute())
+            self.put(key, moves)
+        return moves
+
+    def clear(self):
+        """Drop every entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Snapshot of size and hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+# Shared by every game in the process
+move_cache = LegalMoveCache()
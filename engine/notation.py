@@ -0,0 +1,86 @@
+"""Text notation for 9x9 positions and squares.
+
+Positions use a FEN-like string: nine ranks from black's back rank (row 0) down
+to white's (row 8) separated by '/', white pieces in upper case (PNBRQK), black
+in lower case, digits for runs of empty squares, then 'w' or 'b' for the side
+to move. Files are 'a'..'i' from column 0 and ranks '1'..'9' from row 8, so
+white's king starts on e1.
+"""
+from .pieces import WHITE, BLACK, PIECE_TYPE_NAMES, COLOR_SHIFT, TYPE_MASK, make_piece
+
+BOARD_SIZE = 9
+FILES = 'abcdefghi'
+TYPE_LETTERS = 'pnbrqk'
+
+START_POSITION = 'rnbqkqbnr/ppppppppp/9/9/9/9/9/PPPPPPPPP/RNBQKQBNR w'
+
+
+def piece_letter(piece):
+    """FEN letter for a non-empty piece code"""
+    letter = TYPE_LETTERS[(piece & TYPE_MASK) - 1]
+    return letter if piece >> COLOR_SHIFT else letter.upper()
+
+
+def parse_position(text):
+    """Parse a position string into (bytearray(81) of piece codes, color to move)"""
+    fields = text.split()
+    if not fields or len(fields) > 2:
+        raise ValueError(f"Bad position: {text!r}")
+    ranks = fields[0].split('/')
+    if len(ranks) != BOARD_SIZE:
+        raise ValueError(f"Expected {BOARD_SIZE} ranks, got {len(ranks)}")
+
+    squares = bytearray()
+    for rank in ranks:
+        start = len(squares)
+        for char in rank:
+            if char.isdigit():
+                squares.extend(bytes(int(char)))
+            elif char.lower() in TYPE_LETTERS:
+                color = BLACK if char.islower() else WHITE
+                squares.append(make_piece(color, TYPE_LETTERS.index(char.lower())))
+            else:
+                raise ValueError(f"Bad piece letter {char!r}")
+        if len(squares) - start != BOARD_SIZE:
+            raise ValueError(f"Rank {rank!r} is not {BOARD_SIZE} squares wide")
+
+    side = fields[1] if len(fields) > 1 else 'w'
+    if side not in ('w', 'b'):
+        raise ValueError(f"Bad side to move {side!r}")
+    return squares, WHITE if side == 'w' else BLACK
+
+
+def format_position(squares, turn=WHITE):
+    """Position string for 81 piece codes and the color to move"""
+    ranks = []
+    for row in range(BOARD_SIZE):
+        rank, empty = '', 0
+        for piece in squares[row * BOARD_SIZE:(row + 1) * BOARD_SIZE]:
+            if piece:
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece_letter(piece)
+            else:
+                empty += 1
+        ranks.append(rank + (str(empty) if empty else ''))
+    return '/'.join(ranks) + (' w' if turn == WHITE else ' b')
+
+
+def square_name(sq):
+    """Algebraic name of a square index, e.g. 76 -> 'e1'"""
+    row, col = divmod(sq, BOARD_SIZE)
+    return f'{FILES[col]}{BOARD_SIZE - row}'
+
+
+def parse_square(name):
+    """Square index for an algebraic name"""
+    if len(name) != 2 or name[0] not in FILES or not '1' <= name[1] <= '9':
+        raise ValueError(f"Bad square {name!r}")
+    return (BOARD_SIZE - int(name[1])) * BOARD_SIZE + FILES.index(name[0])
+
+
+def move_name(from_sq, to_sq, promotion=None):
+    """Coordinate notation for a move, e.g. 'e2e4' or 'a8a9q'"""
+    suffix = TYPE_LETTERS[PIECE_TYPE_NAMES.index(promotion)] if promotion else ''
+    return square_name(from_sq) + square_name(to_sq) + suffix
@@ -0,0 +1,71 @@
+"""Compact piece codes for the engine.
+
+A piece is a small int: bit 3 holds the color and the low three bits hold the
+piece type plus one, so 0 means an empty square and a whole board fits in a
+bytearray(81). The 'white_queen' style strings used by clients are only built
+at the network boundary with decode_board.
+"""
+from enum import IntEnum
+
+WHITE, BLACK = 0, 1
+COLOR_NAMES = ('white', 'black')
+COLOR_INDEX = {'white': WHITE, 'black': BLACK}
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+PIECE_TYPE_NAMES = ('pawn', 'knight', 'bishop', 'rook', 'queen', 'king')
+PIECE_TYPE_INDEX = {name: index for index, name in enumerate(PIECE_TYPE_NAMES)}
+
+COLOR_SHIFT = 3
+TYPE_MASK = 7
+EMPTY = 0
+
+
+class Piece(IntEnum):
+    EMPTY = 0
+    WHITE_PAWN = 1
+    WHITE_KNIGHT = 2
+    WHITE_BISHOP = 3
+    WHITE_ROOK = 4
+    WHITE_QUEEN = 5
+    WHITE_KING = 6
+    BLACK_PAWN = 9
+    BLACK_KNIGHT = 10
+    BLACK_BISHOP = 11
+    BLACK_ROOK = 12
+    BLACK_QUEEN = 13
+    BLACK_KING = 14
+
+
+def make_piece(color, piece_type):
+    """Piece code for a color and piece type"""
+    return (color << COLOR_SHIFT) | (piece_type + 1)
+
+
+def piece_color(piece):
+    """Color index of a non-empty piece code"""
+    return piece >> COLOR_SHIFT
+
+
+def piece_type(piece):
+    """Piece type index of a non-empty piece code"""
+    return (piece & TYPE_MASK) - 1
+
+
+# Wire names indexed by piece code, and the reverse lookup
+PIECE_NAMES = [None] * 16
+for _color, _color_name in enumerate(COLOR_NAMES):
+    for _type, _type_name in enumerate(PIECE_TYPE_NAMES):
+        PIECE_NAMES[make_piece(_color, _type)] = f'{_color_name}_{_type_name}'
+PIECE_NAMES = tuple(PIECE_NAMES)
+PIECE_CODES = {name: code for code, name in enumerate(PIECE_NAMES) if name}
+
+
+def encode_board(board):
+    """Pack a 9x9 list of piece name strings (None for empty) into a bytearray(81)"""
+    return bytearray(PIECE_CODES[piece] if piece else EMPTY for row in board for piece in row)
+
+
+def decode_board(squares):
+    """Unpack a bytearray(81) into the 9x9 list of piece name strings clients expect"""
+    names = [PIECE_NAMES[piece] for piece in squares]
+    return [names[row:row + 9] for row in range(0, 81, 9)]
@@ -0,0 +1,37 @@
+"""Rules entry points for the servers and clients.
+
+Every consumer (server.py, client.py, v1 server and client) asks for legal
+moves through these functions, so they all share the bitboard generator and
+the process-wide move cache. The helpers accept the board shapes each side
+already holds: 'color_type' strings (server.py and client.py) or v1's
+{'type': ..., 'color': ...} dicts.
+"""
+from .bitboard import BitboardPosition, square_to_pos
+from .movecache import move_cache
+from .pieces import PIECE_CODES, COLOR_SHIFT, EMPTY
+
+
+def position_from_board(board, turn):
+    """Position for a 9x9 list of 'color_type' strings (None for empty)"""
+    return BitboardPosition.from_board(board, turn)
+
+
+def position_from_piece_dicts(board, turn):
+    """Position for v1's 9x9 list of piece dicts (None for empty)"""
+    squares = bytearray(PIECE_CODES[f"{piece['color']}_{piece['type']}"] if piece else EMPTY
+                        for row in board for piece in row)
+    return BitboardPosition.from_squares(squares, turn)
+
+
+def legal_moves(position, color):
+    """Frozenset of legal (from_sq, to_sq) moves for color, through the shared move cache"""
+    return move_cache.get_or_compute((position.key, color), lambda: position.generate_legal_moves(color))
+
+
+def legal_destinations(position, from_sq):
+    """(row, col) squares the piece on from_sq may legally move to, accounting for checks and pins"""
+    piece = position.squares[from_sq]
+    if not piece:
+        return []
+    return sorted(square_to_pos(to_sq) for move_from, to_sq in legal_moves(position, piece >> COLOR_SHIFT)
+                  if move_from == from_sq)
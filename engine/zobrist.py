@@ -0,0 +1,28 @@
+"""Zobrist keys for 9x9 positions.
+
+A position's key is the XOR of one random 64-bit number per (piece, square),
+plus SIDE_TO_MOVE_KEY when black is to move. Making a move only XORs the
+changed terms in and out. The generator is seeded with a constant so every
+process (server workers, clients) derives the same keys for the same position.
+"""
+import random
+
+NUM_SQUARES = 81
+
+_rng = random.Random(0x9C4E5A2D)
+
+# PIECE_SQUARE_KEYS[piece_code][square]; codes 0, 7, 8 and 15 are never used
+PIECE_SQUARE_KEYS = tuple(tuple(_rng.getrandbits(64) for _ in range(NUM_SQUARES)) for _ in range(16))
+SIDE_TO_MOVE_KEY = _rng.getrandbits(64)
+
+# v1 tracks has_moved per piece; HAS_MOVED_KEYS[square] is XORed in while the piece there has moved
+HAS_MOVED_KEYS = tuple(_rng.getrandbits(64) for _ in range(NUM_SQUARES))
+
+
+def hash_squares(squares, side_to_move=0):
+    """Compute the key for 81 piece codes from scratch"""
+    key = SIDE_TO_MOVE_KEY if side_to_move else 0
+    for sq, piece in enumerate(squares):
+        if piece:
+            key ^= PIECE_SQUARE_KEYS[piece][sq]
+    return key
@@ -0,0 +1,340 @@
+"""Length-prefixed framing shared by the server and client.
+
+Every message on the wire is a 4-byte big-endian length followed by that many
+bytes. FrameReader keeps one buffer per connection, fills it with recv_into
+(or feed() for asyncio transports) and hands out complete frames as
+memoryview slices of that buffer, so a burst of small frames costs one
+syscall and no copies. Outgoing frames are built in one buffer by
+encode_frame and, on the threaded server, sealed and sent by OutboundQueue.
+"""
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+HEADER_SIZE = 4
+
+# Largest frame a peer may announce; anything bigger is treated as a broken stream
+MAX_FRAME_SIZE = 1024 * 1024
+
+# Unsent bytes a connection may accumulate before it is dropped as a slow consumer
+MAX_OUTBOUND_BYTES = 512 * 1024
+
+# Seconds a connection may go without accepting any queued bytes before it is dropped
+STALL_TIMEOUT = 10
+
+# Buffer size on first use; it grows (up to HEADER_SIZE + max_frame_size) only for larger frames
+DEFAULT_BUFFER_SIZE = 4096
+
+
+class FrameTooLarge(ConnectionError):
+    """A peer announced a frame above the reader's limit"""
+
+
+class FrameReader:
+    """Buffered reader that splits a byte stream into length-prefixed frames.
+
+    Frames returned by next_frame() and read_frame() are memoryviews into the
+    reader's buffer and stay valid only until the next call that reads more
+    data; decode or copy them before that. The buffer is allocated on first
+    use, so a reader parked on an idle connection costs almost nothing.
+    """
+
+    def __init__(self, sock=None, buffer_size=DEFAULT_BUFFER_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first unconsumed byte
+        self.end = 0    # one past the last received byte
+        self.last_fill = None     # monotonic time data last arrived
+        self.partial_since = None  # when the incomplete frame in the buffer started arriving
+
+    def pending(self):
+        """Number of buffered bytes not yet returned as frames"""
+        return self.end - self.start
+
+    def _make_room(self, needed):
+        """Ensure needed bytes fit after self.start, compacting or growing the buffer"""
+        pending = self.end - self.start
+        if self.start and len(self.buffer) - self.start < needed:
+            # Move the partial frame to the front; only leftovers are copied
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        if len(self.buffer) < needed:
+            size = len(self.buffer) or self.buffer_size
+            while size < needed:
+                size *= 2
+            # Frames handed out earlier keep the old buffer alive, so allocate a new one
+            buffer = bytearray(size)
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+            self.start, self.end = 0, pending
+
+    def next_frame(self):
+        """Return the next complete frame from the buffer, or None if more data is needed"""
+        pending = self.end - self.start
+        if pending < HEADER_SIZE:
+            return None
+        length = int.from_bytes(self.view[self.start:self.start + HEADER_SIZE], 'big')
+        if length > self.max_frame_size:
+            raise FrameTooLarge(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+        if pending < HEADER_SIZE + length:
+            self._make_room(HEADER_SIZE + length)
+            return None
+        begin = self.start + HEADER_SIZE
+        frame = self.view[begin:begin + length]
+        self.start = begin + length
+        if self.start == self.end:
+            self.start = self.end = 0  # buffer drained: next recv_into starts at the front
+            self.partial_since = None
+        else:
+            self.partial_since = self.last_fill
+        return frame
+
+    def take_pending(self):
+        """Remove and return the buffered bytes not yet returned as frames (e.g. to pass the stream on)"""
+        data = bytes(self.view[self.start:self.end])
+        self.start = self.end = 0
+        self.partial_since = None
+        return data
+
+    def feed(self, data):
+        """Append bytes received some other way (e.g. an asyncio transport)"""
+        self._make_room(self.end - self.start + len(data))
+        if data:
+            self._mark_arrival()
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def _mark_arrival(self):
+        self.last_fill = time.monotonic()
+        if self.start == self.end:
+            self.partial_since = self.last_fill
+
+    def fill(self):
+        """Receive into the free part of the buffer with one recv_into; return the byte count (0 on EOF)"""
+        if self.end == len(self.buffer):
+            self._make_room(self.end - self.start + 1)
+        received = self.sock.recv_into(self.view[self.end:])
+        if received:
+            self._mark_arrival()
+        self.end += received
+        return received
+
+    def read_frame(self):
+        """Block until a complete frame is available and return it; None on a clean EOF"""
+        while True:
+            frame = self.next_frame()
+            if frame is not None:
+                return frame
+            if not self.fill():
+                if self.end - self.start:
+                    raise ConnectionError("Connection closed in the middle of a frame")
+                return None
+
+
+def encode_frame(payload):
+    """Length prefix and payload joined into one buffer, so a frame goes out in one send"""
+    return len(payload).to_bytes(HEADER_SIZE, 'big') + payload
+
+
+class OutboundQueue:
+    """Per-connection send queue: written on the sending thread, finished by the shared flusher.
+
+    put() never blocks: it seals a message into a frame and sends what the
+    socket takes without waiting (MSG_DONTWAIT), so a thread handling one
+    player's move does not wait on the opponent's TCP window. Whatever is
+    left over is queued and handed to the process's one OutboundFlusher
+    thread, which sends it once the socket is writable; later frames queue
+    behind it. Sealing and sending happen under the queue's lock, so frames
+    go out in the order their record counters were taken. A peer that lets
+    more than max_bytes pile up, or makes no progress for stall_timeout
+    seconds while frames are waiting, is cut off: the socket is shut down,
+    which also ends the blocked recv in that connection's reader. put()
+    notices a stall when the next frame is queued; for a queue that gets no
+    more frames, the server's timer wheel watches stalled_since().
+    """
+
+    def __init__(self, sock, seal, max_bytes=MAX_OUTBOUND_BYTES, stall_timeout=STALL_TIMEOUT):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.seal = seal  # the session's record layer seal(): message bytes to a record
+        self.max_bytes = max_bytes
+        self.stall_timeout = stall_timeout
+        self.frames = deque()  # unsent frames; the first may be partly sent
+        self.queued_bytes = 0
+        self.last_progress = time.monotonic()
+        self.closed = False
+        self.dropped = False  # True once cut off as a slow consumer
+        self.flushing = False  # True while the flusher is sending the leftovers
+        self.condition = threading.Condition()
+
+    def put(self, message):
+        """Seal and send (or queue) one encoded message; False if the connection is closed or was just dropped"""
+        with self.condition:
+            if self.closed:
+                return False
+            frame = encode_frame(self.seal(message))
+            now = time.monotonic()
+            if self.frames and now - self.last_progress > self.stall_timeout:
+                reason = f"no progress for {now - self.last_progress:.0f} s"
+            elif self.queued_bytes + len(frame) > self.max_bytes:
+                reason = f"{self.queued_bytes + len(frame)} bytes queued"
+            else:
+                if not self.frames:
+                    self.last_progress = now
+                self.frames.append(frame)
+                self.queued_bytes += len(frame)
+                if self.flushing:
+                    return True
+                try:
+                    self._send()
+                except OSError:
+                    self._close()
+                    return False
+                if self.frames:
+                    self.flushing = True
+                    shared_flusher().watch(self)
+                return True
+        self.abort(f"slow consumer ({reason})")
+        return False
+
+    def stalled_since(self):
+        """When the peer last accepted bytes, if frames are waiting; None when there is nothing to send"""
+        with self.condition:
+            return self.last_progress if self.frames else None
+
+    def flush(self, timeout=STALL_TIMEOUT):
+        """Wait until every queued frame has been sent; False on timeout or if the queue closed first"""
+        with self.condition:
+            self.condition.wait_for(lambda: not self.frames or self.closed, timeout)
+            return not self.frames and not self.closed
+
+    def close(self):
+        """Stop sending; frames not yet sent are discarded"""
+        with self.condition:
+            self._close()
+
+    def abort(self, reason):
+        """Drop the connection: stop writing and shut the socket down in both directions"""
+        print(f"Dropping connection: {reason}")
+        self.dropped = True
+        self.close()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _close(self):
+        self.closed = True
+        self.frames.clear()
+        self.queued_bytes = 0
+        self.condition.notify_all()
+        if self.flushing:
+            self.flushing = False
+            shared_flusher().watch(self)  # so the flusher lets go of the socket
+
+    def _send(self):
+        """Send queued frames until the socket would block (lock held); OSError if the connection broke"""
+        while self.frames:
+            frame = self.frames[0]
+            try:
+                sent = self.sock.send(frame, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.queued_bytes -= sent
+            self.last_progress = time.monotonic()
+            if sent < len(frame):
+                self.frames[0] = frame[sent:]
+                return
+            self.frames.popleft()
+
+    def writable(self):
+        """Called by the flusher when the socket can take more; True while frames are still waiting"""
+        with self.condition:
+            if self.closed:
+                return False
+            try:
+                self._send()
+            except OSError:
+                self._close()
+                return False
+            if self.frames:
+                return True
+            self.flushing = False
+            self.condition.notify_all()  # wake flush()
+            return False
+
+
+class OutboundFlusher:
+    """One thread per process that finishes the sends OutboundQueue.put() could not complete.
+
+    It waits on a selector for the sockets of queues with leftover frames and
+    calls their writable() until each has drained, so a connection costs a
+    thread here only while its peer is behind, and then none of its own.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        # poll() keeps no kernel-side registrations, so a socket closed (or passed to another
+        # process) while still watched can't leave a stale one behind, unlike epoll
+        self.selector = getattr(selectors, 'PollSelector', selectors.SelectSelector)()
+        self.lock = threading.Lock()
+        self.changed = []  # queues to start or stop watching, applied on the flusher thread
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def watch(self, queue):
+        """Start sending queue's leftovers, or let go of its socket if it has nothing left or closed"""
+        with self.lock:
+            self.changed.append(queue)
+        try:
+            self.wake_writer.send(b'\0')
+        except BlockingIOError:
+            pass  # a wake-up is already pending
+
+    def _run(self):
+        watched = {}  # fd: queue
+        while True:
+            with self.lock:
+                changed, self.changed = self.changed, []
+            for queue in changed:
+                # A closed socket's fd may already belong to a newer connection
+                if queue.fd in watched:
+                    self.selector.unregister(queue.fd)
+                    del watched[queue.fd]
+                if queue.flushing and not queue.closed:
+                    self.selector.register(queue.fd, selectors.EVENT_WRITE, queue)
+                    watched[queue.fd] = queue
+
+            for key, _ in self.selector.select():
+                if key.fileobj is self.wake_reader:
+                    try:
+                        while self.wake_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif not key.data.writable() and watched.get(key.fd) is key.data:
+                    self.selector.unregister(key.fd)
+                    del watched[key.fd]
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def shared_flusher():
+    """This process's OutboundFlusher, started on first use (again in a forked child)"""
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None or _flusher.pid != os.getpid():
+            _flusher = OutboundFlusher()
+        return _flusher
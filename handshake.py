@@ -0,0 +1,455 @@
+"""Handshake crypto and version negotiation, with DH work run in a dedicated process pool.
+
+The server hello offers versions; the client's reply picks the handshake, record layer, wire format and codec.
+"""
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric.dh import DHParameterNumbers, DHPrivateNumbers, DHPublicNumbers
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from config import SESSION_TICKET_LIFETIME
+from records import CLIENT, RECORD_CBC, RECORD_GCM, SUPPORTED_RECORDS, RecordError, choose_record, record_layer
+from codec import CODEC_JSON, SUPPORTED_CODECS, choose_codec
+from wire import SUPPORTED_WIRE_FORMATS, WIRE_JSON, choose_wire_format, wire_format
+
+# Worker processes; one core is left for gameplay where there is more than one
+DEFAULT_PROCESSES = max(1, (os.cpu_count() or 1) - 1)
+
+# Jobs allowed to wait for a process before new handshakes are refused
+MAX_PENDING_HANDSHAKES = 256
+
+# Recent handshake timings kept for percentiles
+LATENCY_SAMPLES = 10000
+
+# DH group: RFC 3526 group 14 (2048-bit MODP)
+DH_PRIME = int(
+    "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD1"
+    "29024E088A67CC74020BBEA63B139B22514A08798E3404DD"
+    "EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245"
+    "E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+    "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3D"
+    "C2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F"
+    "83655D23DCA3AD961C62F356208552BB9ED529077096966D"
+    "670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+    "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9"
+    "DE2BCBF6955817183995497CEA956AE515D2261898FA0510"
+    "15728E5A8AACAA68FFFFFFFFFFFFFFFF", 16)
+DH_GENERATOR = 2
+
+# Session key derivation shared with the clients
+KDF_SALT = b'chess_salt'
+KDF_ITERATIONS = 100000
+HKDF_INFO = b'chess2 session key'
+RESUME_INFO = b'chess2 resumed session key'
+
+# Handshake versions, oldest first
+HANDSHAKE_LEGACY = 1  # DH, PBKDF2 session key
+HANDSHAKE_HKDF = 2    # DH, HKDF session key
+HANDSHAKE_X25519 = 3  # X25519 with raw public keys, HKDF session key
+HANDSHAKE_RESUME = 4  # session ticket from an earlier connection, HKDF session key, no key exchange
+SUPPORTED_HANDSHAKES = (HANDSHAKE_LEGACY, HANDSHAKE_HKDF, HANDSHAKE_X25519, HANDSHAKE_RESUME)
+DH_HANDSHAKES = (HANDSHAKE_LEGACY, HANDSHAKE_HKDF)
+
+# Bytes in a raw X25519 public key
+X25519_KEY_SIZE = 32
+
+# What the bytes that may follow the key in a bare X25519 message default to: record version, wire format, codec
+X25519_TRAILER_DEFAULTS = (RECORD_CBC, WIRE_JSON, CODEC_JSON)
+
+# Session tickets: associated data they are sealed with, and the client nonce sent with one
+TICKET_AAD = b'chess2 session ticket'
+RESUME_NONCE_SIZE = 16
+
+# Plaintext of the record a resuming client seals to show it holds the ticket's secret
+RESUME_PROOF = b'chess2 resume'
+
+_parameters = {}  # (p, g): DHParameters, per process
+
+
+class HandshakeOverloaded(ConnectionError):
+    """Too many handshakes are already running or waiting"""
+
+
+class TicketError(ValueError):
+    """A session ticket that is forged, expired or already used, or presented without proof of its secret"""
+
+
+def dh_parameters(p, g):
+    parameters = _parameters.get((p, g))
+    if parameters is None:
+        parameters = _parameters[(p, g)] = DHParameterNumbers(p, g).parameters()
+    return parameters
+
+
+def derive_aes_key(shared_secret, version=HANDSHAKE_LEGACY):
+    """Session AES key from a DH shared secret: PBKDF2-SHA256 for the legacy handshake, else HKDF-SHA256"""
+    if version == HANDSHAKE_LEGACY:
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=KDF_SALT, iterations=KDF_ITERATIONS)
+    else:
+        kdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=KDF_SALT, info=HKDF_INFO)
+    return kdf.derive(shared_secret)
+
+
+def choose_handshake(server_hello, supported=SUPPORTED_HANDSHAKES):
+    """Client side: newest version both ends speak, from the server hello's 'versions'"""
+    common = set(server_hello.get('versions', (HANDSHAKE_LEGACY,))) & set(supported)
+    if 'x25519' not in server_hello:
+        common.discard(HANDSHAKE_X25519)
+    common.discard(HANDSHAKE_RESUME)  # needs a ticket; see client_key_exchange
+    return max(common) if common else HANDSHAKE_LEGACY
+
+
+def x25519_public_bytes(private_key):
+    return private_key.public_key().public_bytes_raw()
+
+
+def derive_x25519_session_key(private_key, peer_public_bytes):
+    """AES key for an X25519 private key and the peer's raw public key"""
+    shared_secret = private_key.exchange(X25519PublicKey.from_public_bytes(bytes(peer_public_bytes)))
+    return derive_aes_key(shared_secret, HANDSHAKE_X25519)
+
+
+def is_x25519_message(data):
+    """True for a bare X25519 hello or reply: the key, maybe followed by record, wire format and codec bytes"""
+    return X25519_KEY_SIZE <= len(data) <= X25519_KEY_SIZE + len(X25519_TRAILER_DEFAULTS)
+
+
+def x25519_message(private_key, record=RECORD_CBC, wire=WIRE_JSON, codec=CODEC_JSON):
+    """Raw public key, followed by the record version, wire format and codec as far as they aren't the defaults"""
+    trailer = [record, wire, codec]
+    while trailer and trailer[-1] == X25519_TRAILER_DEFAULTS[len(trailer) - 1]:
+        trailer.pop()
+    return x25519_public_bytes(private_key) + bytes(trailer)
+
+
+def parse_x25519_message(data):
+    """(raw public key, record version, wire format, codec) from a bare X25519 message"""
+    trailer = bytes(data[X25519_KEY_SIZE:]) + bytes(X25519_TRAILER_DEFAULTS[len(data) - X25519_KEY_SIZE:])
+    return (bytes(data[:X25519_KEY_SIZE]), *trailer)
+
+
+def client_offer(version=None, record=None, wire=None, codec=None):
+    """Client side: what this end speaks, sent before the server hello; a server that sees X25519 skips DH"""
+    offer = {
+        'offer': [version] if version else list(SUPPORTED_HANDSHAKES),
+        'records': [record] if record else list(SUPPORTED_RECORDS),
+        'wire': [wire] if wire else list(SUPPORTED_WIRE_FORMATS),
+        'codecs': [codec] if codec else list(SUPPORTED_CODECS)
+    }
+    return json.dumps(offer).encode('utf-8')
+
+
+def parse_client_offer(data):
+    """Server side: the client's offer as a dict, or None for a frame that isn't one"""
+    if is_x25519_message(data) or bytes(data[:1]) != b'{':
+        return None
+    try:
+        message = json.loads(bytes(data))
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) and 'offer' in message else None
+
+
+def derive_resumed_session_key(secret, server_hello, client_nonce):
+    """AES key for a resumed session: HKDF over the ticket's secret, salted with this connection's hello and nonce"""
+    kdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=bytes(server_hello) + bytes(client_nonce), info=RESUME_INFO)
+    return kdf.derive(secret)
+
+
+def resumption_reply(server_hello, ticket, record=RECORD_CBC, wire=WIRE_JSON, codec=CODEC_JSON):
+    """Client side: (reply presenting a (ticket, resumption secret) pair, record layer, wire format)"""
+    if record != RECORD_GCM:
+        raise ValueError("Session resumption needs GCM records")
+    ticket, secret = ticket
+    client_nonce = os.urandom(RESUME_NONCE_SIZE)
+    records = record_layer(record, derive_resumed_session_key(secret, server_hello, client_nonce), CLIENT)
+    reply = {
+        'ticket': ticket,
+        'nonce': base64.b64encode(client_nonce).decode('ascii'),
+        'proof': base64.b64encode(records.seal(RESUME_PROOF)).decode('ascii'),
+        'record': record
+    }
+    if wire != WIRE_JSON:
+        reply['wire'] = wire
+    if codec != CODEC_JSON:
+        reply['codec'] = codec
+    return json.dumps(reply).encode('utf-8'), records, wire_format(wire, codec)
+
+
+def confirm_resumption(records, proof):
+    """Server side: open a resumption reply's proof, the client's first record; TicketError unless it's RESUME_PROOF"""
+    try:
+        confirmed = records.open(base64.b64decode(proof, validate=True)) == RESUME_PROOF
+    except (TypeError, ValueError, RecordError):
+        confirmed = False
+    if not confirmed:
+        raise TicketError("Resumption without the ticket's secret")
+
+
+def received_ticket(message):
+    """(ticket, resumption secret) from a server message that carries one, else None"""
+    if 'ticket' not in message:
+        return None
+    return message['ticket'], base64.b64decode(message['resumption_secret'])
+
+
+class SessionTickets:
+    """Seals and opens session tickets under one key (shared by all the workers of a cluster)"""
+
+    def __init__(self, key=None, lifetime=SESSION_TICKET_LIFETIME):
+        self.key = key or AESGCM.generate_key(256)
+        self.aead = AESGCM(self.key)
+        self.lifetime = lifetime
+        self.spent = {}  # ticket: expiry, for tickets that have resumed a connection, oldest first
+        self.lock = threading.Lock()
+
+    def issue(self, username, game_id=None):
+        """(ticket string, resumption secret) for a logged-in session"""
+        secret = os.urandom(32)
+        session = {
+            'username': username,
+            'game_id': game_id,
+            'secret': base64.b64encode(secret).decode('ascii'),
+            'expires': time.time() + self.lifetime
+        }
+        nonce = os.urandom(12)
+        sealed = nonce + self.aead.encrypt(nonce, json.dumps(session).encode('utf-8'), TICKET_AAD)
+        return base64.b64encode(sealed).decode('ascii'), secret
+
+    def open(self, ticket):
+        """The session a ticket was issued for, its secret as bytes; TicketError if forged, expired or used"""
+        try:
+            sealed = base64.b64decode(ticket, validate=True)
+            session = json.loads(self.aead.decrypt(sealed[:12], sealed[12:], TICKET_AAD))
+        except (TypeError, ValueError, InvalidTag):
+            raise TicketError("Session ticket not issued by this server") from None
+        if session['expires'] < time.time():
+            raise TicketError("Session ticket expired")
+        if self.is_spent(ticket, session['expires']):
+            raise TicketError("Session ticket already used")
+        session['secret'] = base64.b64decode(session['secret'])
+        return session
+
+    def is_spent(self, ticket, expires):
+        return ticket in self.spent
+
+    def spend(self, ticket, expires):
+        """Mark a ticket used once its proof has opened; TicketError if another connection got there first"""
+        with self.lock:
+            if ticket in self.spent:
+                raise TicketError("Session ticket already used")
+            self.spent[ticket] = expires
+            # Expired tickets are refused anyway; forget them
+            now = time.time()
+            while self.spent and next(iter(self.spent.values())) < now:
+                del self.spent[next(iter(self.spent))]
+
+
+def client_key_exchange(server_data_bytes, version=None, record=None, ticket=None, wire=None, codec=None):
+    """Client side: answer the server hello; return (reply bytes, record layer, wire format for the session).
+
+    version, record, wire and codec pin the handshake, record, wire format
+    and codec versions; by default the newest ones the server offers (and
+    for the codec, the server's favourite of those this end has). The
+    legacy versions are spoken without 'version', 'record', 'wire' and
+    'codec' fields, the way clients from before the negotiation did. A
+    (ticket, resumption secret) pair from an earlier session is presented
+    instead of a key exchange where the server may accept it over GCM records.
+    """
+    if is_x25519_message(server_data_bytes):
+        # Server that only speaks X25519 (and maybe resumption)
+        server_key, newest_record, newest_wire, server_codec = parse_x25519_message(server_data_bytes)
+        if record is None:
+            record = choose_record(range(RECORD_CBC, newest_record + 1))
+        if wire is None:
+            wire = choose_wire_format(range(WIRE_JSON, newest_wire + 1))
+        if codec is None:
+            codec = choose_codec((server_codec,))
+        if ticket is not None and record == RECORD_GCM:
+            return resumption_reply(server_data_bytes, ticket, record, wire, codec)
+        private_key = X25519PrivateKey.generate()
+        aes_key = derive_x25519_session_key(private_key, server_key)
+        return (x25519_message(private_key, record, wire, codec), record_layer(record, aes_key, CLIENT),
+                wire_format(wire, codec))
+
+    server_public_data = json.loads(str(server_data_bytes, 'utf-8'))
+    if record is None:
+        record = choose_record(server_public_data.get('records', (RECORD_CBC,)))
+    if version is None:
+        if (ticket is not None and HANDSHAKE_RESUME in server_public_data.get('versions', ())
+                and record == RECORD_GCM):
+            version = HANDSHAKE_RESUME
+        else:
+            version = choose_handshake(server_public_data)
+    if wire is None:
+        wire = choose_wire_format(server_public_data.get('wire', (WIRE_JSON,)))
+    if codec is None:
+        codec = choose_codec(server_public_data.get('codecs', (CODEC_JSON,)))
+    if version == HANDSHAKE_RESUME:
+        return resumption_reply(server_data_bytes, ticket, record, wire, codec)
+    if version == HANDSHAKE_X25519:
+        private_key = X25519PrivateKey.generate()
+        aes_key = derive_x25519_session_key(private_key, base64.b64decode(server_public_data['x25519']))
+        return (x25519_message(private_key, record, wire, codec), record_layer(record, aes_key, CLIENT),
+                wire_format(wire, codec))
+
+    param_numbers = DHParameterNumbers(server_public_data['p'], server_public_data['g'])
+    private_key = param_numbers.parameters().generate_private_key()
+    public_numbers = private_key.public_key().public_numbers()
+    client_public_data = {
+        'y': public_numbers.y,
+        'p': public_numbers.parameter_numbers.p,
+        'g': public_numbers.parameter_numbers.g
+    }
+    if version != HANDSHAKE_LEGACY:
+        client_public_data['version'] = version
+    if record != RECORD_CBC:
+        client_public_data['record'] = record
+    if wire != WIRE_JSON:
+        client_public_data['wire'] = wire
+    if codec != CODEC_JSON:
+        client_public_data['codec'] = codec
+    reply = json.dumps(client_public_data).encode('utf-8')
+
+    shared_secret = private_key.exchange(DHPublicNumbers(server_public_data['y'], param_numbers).public_key())
+    return reply, record_layer(record, derive_aes_key(shared_secret, version), CLIENT), wire_format(wire, codec)
+
+
+def generate_dh_keypair(p, g):
+    """(private value x, public value y) for a fresh DH key in group (p, g)"""
+    private_key = dh_parameters(p, g).generate_private_key()
+    return private_key.private_numbers().x, private_key.public_key().public_numbers().y
+
+
+def derive_dh_session_key(p, g, x, y, peer_y, version=HANDSHAKE_LEGACY):
+    """AES key for the server keypair (x, y) and the peer's public value"""
+    parameter_numbers = DHParameterNumbers(p, g)
+    private_key = DHPrivateNumbers(x, DHPublicNumbers(y, parameter_numbers)).private_key()
+    peer_key = DHPublicNumbers(peer_y, parameter_numbers).public_key()
+    return derive_aes_key(private_key.exchange(peer_key), version)
+
+
+def _exit_with_parent():
+    """Worker initializer: exit when the server process does, however it died"""
+    def wait():
+        multiprocessing.parent_process().join()
+        os._exit(0)
+
+    threading.Thread(target=wait, daemon=True).start()
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def latency_percentiles(samples):
+    """p50/p95/p99/max (ms) of durations in seconds"""
+    samples = sorted(samples)
+    percentiles = {}
+    for label, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0)):
+        percentiles[label] = samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000 if samples else 0.0
+    return percentiles
+
+
+class HandshakePool:
+    """Runs handshake jobs in worker processes with a bound on queued work.
+
+    With processes=0 jobs run inline on the calling thread (no pool), which
+    keeps the old behaviour available for comparison.
+    """
+
+    def __init__(self, processes=DEFAULT_PROCESSES, max_pending=MAX_PENDING_HANDSHAKES):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.executor = None
+        self.slots = threading.BoundedSemaphore(processes + max_pending) if processes else None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.overloaded = 0
+        self.job_latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def start(self):
+        """Start the worker processes now rather than on the first handshake"""
+        with self.lock:
+            # Checked and set under the lock, so racing callers can't start two executors
+            if not self.processes or self.executor is not None:
+                return self
+            # spawn: the servers have threads running, which fork would copy in a broken state
+            self.executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_exit_with_parent)
+            warm_up = [self.executor.submit(_warm_up) for _ in range(self.processes)]
+        for future in warm_up:
+            future.result()
+        return self
+
+    def submit(self, function, *args):
+        """Queue a job; a Future for its result. Raises HandshakeOverloaded when the queue is full"""
+        if not self.processes:
+            future = Future()
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.overloaded += 1
+            raise HandshakeOverloaded(f"{self.processes + self.max_pending} handshake jobs already queued")
+        if self.executor is None:
+            self.start()
+
+        started = time.perf_counter()
+        with self.lock:
+            self.in_flight += 1
+
+        def done(_):
+            self.slots.release()
+            with self.lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.job_latencies.append(time.perf_counter() - started)
+
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(done)
+        return future
+
+    def run(self, function, *args):
+        """Run a job and wait for its result"""
+        return self.submit(function, *args).result()
+
+    async def run_async(self, function, *args):
+        """Run a job without blocking the event loop"""
+        if not self.processes:
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+        return await asyncio.wrap_future(self.submit(function, *args))
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                'processes': self.processes,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'overloaded': self.overloaded
+            }
+            samples = list(self.job_latencies)
+        stats.update({f'job_{name}': value for name, value in latency_percentiles(samples).items()})
+        return stats
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,348 @@
+"""Perft: count leaf nodes of the legal move tree for the 9x9 two-queen variant.
+
+Counts every legal move sequence of a given length from a position and reports
+nodes per second. Divide mode prints the count below each root move, which is
+the quickest way to find where two move generators disagree.
+
+    python perft.py --depth 4
+    python perft.py --backend v1 --depth 2 --divide
+    python perft.py --fen "4k4/9/9/9/9/9/9/9/4K4 w" --depth 3
+    python perft.py --check --backend all
+
+Backends:
+    engine  BitboardPosition straight from the engine package
+    server  server.py ChessGame (legal moves through the shared move cache)
+    v1      v1/chess_server.py ChessGame (ChessPiece board kept in step with its
+            engine position the way make_move does, without the status scan)
+
+A backend is a class with moves(), push(move), pop(move) and name(move); register
+new ones in BACKENDS. Counts in REFERENCE_COUNTS are the oracle for --check.
+The server rules have no promotion, v1 promotes to any of four pieces, so the
+two rule sets can disagree once a pawn reaches the last rank.
+
+Every run appends its timing to benchmarks/perft_results.json (see --results)
+so nodes per second can be tracked across commits.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from engine import (  # noqa: E402
+    BitboardPosition, COLOR_NAMES, PIECE_NAMES, START_POSITION,
+    parse_position, move_name, square, square_to_pos,
+)
+
+DEFAULT_RESULTS = os.path.join(ROOT, 'benchmarks', 'perft_results.json')
+
+# Test positions, named so results and reference counts can refer to them
+POSITIONS = {
+    'start': START_POSITION,
+    # Both sides developed, queens out, pieces hanging on both wings
+    'midgame': 'r1b1kqb1r/pp1p1ppp1/2n1p1n2/2p4qp/3P5/2N1PQ1N1/PPP2PPPP/9/R1B1KQB1R w',
+    # Three white pieces pinned to the king: on the file and on both diagonals
+    'pins': '4r4/1q7/9/2q3b2/3NRB3/4K4/9/9/8k w',
+    # White in check from a knight and a rook at once
+    'double_check': '4k4/9/9/9/4r4/9/3n5/9/4K4 w',
+    # Pawns one step from promotion on both sides
+    'promotion': '1r2k4/P7P/9/9/9/9/9/p5p2/4K1R2 w',
+}
+
+# REFERENCE_COUNTS[position][rules] -> leaf counts for depth 1, 2, ...
+# The two rule sets only differ where a pawn can reach the last rank.
+REFERENCE_COUNTS = {
+    'start': {
+        'server': [22, 484, 12140, 303821, 8686242],
+        'v1': [22, 484, 12140, 303821, 8686242],
+    },
+    'midgame': {
+        'server': [53, 2342, 124716, 5428220],
+        'v1': [53, 2342, 124716, 5428220],
+    },
+    'pins': {
+        'server': [10, 631, 12085, 714852],
+        'v1': [10, 631, 12085, 714852],
+    },
+    'double_check': {
+        'server': [3, 81, 245, 6536],
+        'v1': [3, 81, 245, 6536],
+    },
+    'promotion': {
+        'server': [11, 179, 2580, 48816],
+        'v1': [20, 311, 6026],
+    },
+}
+
+PROMOTION_PIECES = ('queen', 'rook', 'bishop', 'knight')
+
+
+class EngineBackend:
+    """BitboardPosition with direct make/unmake"""
+    rules = 'server'
+
+    def __init__(self, squares, turn):
+        self.position = BitboardPosition.from_squares(squares, turn)
+        self.history = []
+
+    def moves(self):
+        return self.position.legal_moves(self.position.turn)
+
+    def push(self, move):
+        self.history.append(self.position.make_move(*move))
+
+    def pop(self, move):
+        self.position.unmake_move(move[0], move[1], self.history.pop())
+
+    def name(self, move):
+        return move_name(*move)
+
+
+class ServerBackend:
+    """server.py ChessGame: legal moves as make_move validates them, moves made on its position"""
+    rules = 'server'
+
+    def __init__(self, squares, turn):
+        from server import ChessGame
+        self.game = ChessGame('perft', 'white_player', 'black_player')
+        self.game.position = BitboardPosition.from_squares(squares, turn)
+        self.game.current_turn = COLOR_NAMES[turn]
+        self.game.position_counts = {self.game.position.key: 1}
+        self.history = []
+
+    def moves(self):
+        return self.game.get_all_legal_moves(self.game.current_turn)
+
+    def push(self, move):
+        (from_row, from_col), (to_row, to_col) = move
+        self.history.append(self.game.position.make_move(square(from_row, from_col), square(to_row, to_col)))
+        self.game.current_turn = 'black' if self.game.current_turn == 'white' else 'white'
+
+    def pop(self, move):
+        (from_row, from_col), (to_row, to_col) = move
+        self.game.position.unmake_move(square(from_row, from_col), square(to_row, to_col), self.history.pop())
+        self.game.current_turn = 'black' if self.game.current_turn == 'white' else 'white'
+
+    def name(self, move):
+        return move_name(square(*move[0]), square(*move[1]))
+
+
+class V1Backend:
+    """v1/chess_server.py ChessGame: ChessPiece objects, has_moved double pushes and promotion"""
+    rules = 'v1'
+
+    def __init__(self, squares, turn):
+        sys.path.insert(0, os.path.join(ROOT, 'v1'))
+        import chess_server as v1
+        self.v1 = v1
+        self.game = v1.ChessGame('perft')
+        self.game.board = [[None] * 9 for _ in range(9)]
+        for sq, piece in enumerate(squares):
+            if piece:
+                row, col = square_to_pos(sq)
+                color_name, type_name = PIECE_NAMES[piece].split('_')
+                v1_piece = v1.ChessPiece(v1.PieceType(type_name), v1.PieceColor(color_name), row, col)
+                # Only pawns on their start row may still double push
+                start_row = 7 if color_name == 'white' else 1
+                v1_piece.has_moved = type_name != 'pawn' or row != start_row
+                self.game.board[row][col] = v1_piece
+        self.game.current_player = v1.PieceColor(COLOR_NAMES[turn])
+        self.game.position = self.game.build_position()
+        self.history = []
+
+    def moves(self):
+        # v1 logs every move list and check it finds
+        with contextlib.redirect_stdout(io.StringIO()):
+            legal_moves = self.game.get_legal_moves(self.game.current_player)
+        moves = []
+        for from_row, from_col, to_row, to_col in legal_moves:
+            piece = self.game.board[from_row][from_col]
+            if piece.type == self.v1.PieceType.PAWN and to_row in (0, 8):
+                moves.extend((from_row, from_col, to_row, to_col, promotion) for promotion in PROMOTION_PIECES)
+            else:
+                moves.append((from_row, from_col, to_row, to_col, None))
+        return moves
+
+    def push(self, move):
+        from_row, from_col, to_row, to_col, promotion = move
+        board = self.game.board
+        piece = board[from_row][from_col]
+        captured = board[to_row][to_col]
+        self.history.append((captured, piece.type, piece.has_moved))
+        board[to_row][to_col] = piece
+        board[from_row][from_col] = None
+        piece.row, piece.col = to_row, to_col
+        piece.has_moved = True
+        to_sq = square(to_row, to_col)
+        self.game.position.make_move(square(from_row, from_col), to_sq)
+        if promotion:
+            piece.type = self.v1.PieceType(promotion)
+            self.game.position.remove_piece(to_sq)
+            self.game.position.put_piece(to_sq, self.game.piece_code(piece))
+        self.switch_player()
+
+    def pop(self, move):
+        from_row, from_col, to_row, to_col, promotion = move
+        board = self.game.board
+        piece = board[to_row][to_col]
+        captured, piece.type, piece.has_moved = self.history.pop()
+        board[from_row][from_col] = piece
+        board[to_row][to_col] = captured
+        piece.row, piece.col = from_row, from_col
+        to_sq = square(to_row, to_col)
+        if promotion:
+            self.game.position.remove_piece(to_sq)
+            self.game.position.put_piece(to_sq, self.game.piece_code(piece))
+        self.game.position.unmake_move(square(from_row, from_col), to_sq,
+                                       self.game.piece_code(captured) if captured else 0)
+        self.switch_player()
+
+    def switch_player(self):
+        PieceColor = self.v1.PieceColor
+        self.game.current_player = PieceColor.BLACK if self.game.current_player == PieceColor.WHITE else PieceColor.WHITE
+
+    def name(self, move):
+        from_row, from_col, to_row, to_col, promotion = move
+        return move_name(square(from_row, from_col), square(to_row, to_col), promotion)
+
+
+BACKENDS = {
+    'engine': EngineBackend,
+    'server': ServerBackend,
+    'v1': V1Backend,
+}
+
+
+def perft(backend, depth):
+    """Number of leaf nodes depth plies below the backend's current position"""
+    if depth == 0:
+        return 1
+    moves = backend.moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        backend.push(move)
+        nodes += perft(backend, depth - 1)
+        backend.pop(move)
+    return nodes
+
+
+def divide(backend, depth):
+    """Leaf counts below each root move, as {move name: nodes}"""
+    counts = {}
+    for move in backend.moves():
+        backend.push(move)
+        counts[backend.name(move)] = perft(backend, depth - 1)
+        backend.pop(move)
+    return dict(sorted(counts.items()))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_result(path, result):
+    """Append one timing record to the JSON results file"""
+    results = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            results = json.load(f)
+    results.append(result)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+
+
+def run(backend_name, position_name, fen, depth, show_divide=False):
+    """Run one perft, print it and return the timing record"""
+    squares, turn = parse_position(fen)
+    backend = BACKENDS[backend_name](squares, turn)
+
+    start = time.perf_counter()
+    if show_divide and depth > 0:
+        counts = divide(backend, depth)
+        nodes = sum(counts.values())
+    else:
+        counts = None
+        nodes = perft(backend, depth)
+    seconds = time.perf_counter() - start
+
+    if counts is not None:
+        for name, count in counts.items():
+            print(f"  {name}: {count}")
+        print(f"  {len(counts)} moves")
+    nps = nodes / seconds if seconds > 0 else 0.0
+    print(f"{backend_name:>7} {position_name:>12} depth {depth}: {nodes:>10} nodes "
+          f"in {seconds:8.3f} s  ({nps:,.0f} nps)")
+
+    return {
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'backend': backend_name,
+        'position': position_name,
+        'depth': depth,
+        'nodes': nodes,
+        'seconds': round(seconds, 6),
+        'nps': round(nps, 1)
+    }
+
+
+def check(backend_names, max_depth):
+    """Compare every stored reference count up to max_depth; return the number of mismatches"""
+    failures = 0
+    for backend_name in backend_names:
+        rules = BACKENDS[backend_name].rules
+        for position_name, references in REFERENCE_COUNTS.items():
+            squares, turn = parse_position(POSITIONS[position_name])
+            for depth, expected in enumerate(references.get(rules, [])[:max_depth], start=1):
+                nodes = perft(BACKENDS[backend_name](squares, turn), depth)
+                status = 'ok' if nodes == expected else f'FAIL (expected {expected})'
+                failures += nodes != expected
+                print(f"{backend_name:>7} {position_name:>12} depth {depth}: {nodes:>10}  {status}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', default='engine', choices=sorted(BACKENDS) + ['all'])
+    parser.add_argument('--position', default='start', choices=sorted(POSITIONS))
+    parser.add_argument('--fen', help='position string instead of a named position')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--divide', action='store_true', help='print leaf counts per root move')
+    parser.add_argument('--check', action='store_true',
+                        help='verify the reference counts up to --depth and exit')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='JSON file timings are appended to')
+    parser.add_argument('--no-save', action='store_true', help="don't record this run")
+    args = parser.parse_args()
+
+    backend_names = sorted(BACKENDS) if args.backend == 'all' else [args.backend]
+
+    if args.check:
+        failures = check(backend_names, args.depth)
+        print(f"{failures} mismatches" if failures else "All reference counts match")
+        sys.exit(1 if failures else 0)
+
+    position_name = 'custom' if args.fen else args.position
+    fen = args.fen or POSITIONS[args.position]
+    for backend_name in backend_names:
+        result = run(backend_name, position_name, fen, args.depth, args.divide)
+        if not args.no_save:
+            save_result(args.results, result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Record layer: how each message frame is encrypted once a session key exists.
+
+The version is picked during the handshake; leaving it out means RECORD_CBC.
+"""
+import itertools
+import os
+import struct
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Record versions, oldest first. CBC is 16-byte IV | AES-CBC(PKCS7(message)), unauthenticated;
+# GCM is version byte | 12-byte nonce | AES-GCM ciphertext and tag, with the version byte as associated data
+RECORD_CBC = 1
+RECORD_GCM = 2
+SUPPORTED_RECORDS = (RECORD_CBC, RECORD_GCM)
+
+# Sender ids in GCM nonces, which are sender id (4 bytes) | per-session counter (8 bytes)
+CLIENT = 0
+SERVER = 1
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+
+class RecordError(ValueError):
+    """A frame that doesn't decrypt (or authenticate) under the session's record layer"""
+
+
+class CbcRecords:
+    """Original record format: random IV, AES-CBC, PKCS7 padding, no authentication"""
+
+    version = RECORD_CBC
+
+    def __init__(self, key):
+        self.key = key
+        self.algorithm = algorithms.AES(key)
+
+    def seal(self, plaintext):
+        iv = os.urandom(16)
+        padder = padding.PKCS7(128).padder()
+        padded_data = padder.update(plaintext) + padder.finalize()
+        encryptor = Cipher(self.algorithm, modes.CBC(iv)).encryptor()
+        return iv + encryptor.update(padded_data) + encryptor.finalize()
+
+    def open(self, record):
+        if len(record) < 32 or len(record) % 16:
+            raise RecordError(f"{len(record)}-byte CBC record")
+        decryptor = Cipher(self.algorithm, modes.CBC(bytes(record[:16]))).decryptor()
+        padded_data = decryptor.update(record[16:]) + decryptor.finalize()
+        try:
+            unpadder = padding.PKCS7(128).unpadder()
+            return unpadder.update(padded_data) + unpadder.finalize()
+        except ValueError:
+            raise RecordError("Bad padding in CBC record") from None
+
+    def export(self):
+        return {}
+
+
+class GcmRecords:
+    """Authenticated records: AES-GCM with a counter nonce, one AESGCM object per session"""
+
+    version = RECORD_GCM
+    header = bytes([RECORD_GCM])
+
+    def __init__(self, key, sender, counter=0, peer_counter=-1):
+        self.key = key
+        self.aead = AESGCM(key)
+        self.sender = sender
+        self.prefix = struct.pack('>I', sender)
+        self.peer_prefix = struct.pack('>I', 1 - sender)
+        self.counter = itertools.count(counter)  # next() is atomic, so seal() is safe from any thread
+        self.peer_counter = peer_counter  # counter of the last record opened; open() runs on one thread
+
+    def seal(self, plaintext):
+        nonce = self.prefix + next(self.counter).to_bytes(8, 'big')
+        return self.header + nonce + self.aead.encrypt(nonce, plaintext, self.header)
+
+    def open(self, record):
+        if len(record) < 1 + NONCE_SIZE + TAG_SIZE or record[0] != RECORD_GCM:
+            raise RecordError("Not a GCM record")
+        nonce = record[1:1 + NONCE_SIZE]
+        if nonce[:4] != self.peer_prefix:
+            raise RecordError("GCM record from the wrong sender")
+        counter = int.from_bytes(nonce[4:], 'big')
+        if counter <= self.peer_counter:
+            raise RecordError("GCM record replayed or out of order")
+        try:
+            plaintext = self.aead.decrypt(nonce, record[1 + NONCE_SIZE:], self.header)
+        except InvalidTag:
+            raise RecordError("GCM record failed authentication") from None
+        self.peer_counter = counter
+        return plaintext
+
+    def export(self):
+        """State for carrying on the session in another process; this object must not seal or open again"""
+        return {'counter': next(self.counter), 'peer_counter': self.peer_counter}
+
+
+def record_layer(version, key, sender, state=None):
+    """Record layer for a session key; state is what export() returned in the process that had it"""
+    if version == RECORD_CBC:
+        return CbcRecords(key)
+    if version == RECORD_GCM:
+        return GcmRecords(key, sender, **(state or {}))
+    raise ValueError(f"Unsupported record version {version!r}")
+
+
+def choose_record(offered, supported=SUPPORTED_RECORDS):
+    """Newest record version in both lists"""
+    common = set(offered) & set(supported)
+    return max(common) if common else RECORD_CBC
@@ -1,3 +1,6 @@
+import argparse
+import asyncio
+import base64
 import socket
 import threading
 import json
@@ -7,15 +10,48 @@ import secrets
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding, hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives.asymmetric import dh
-from cryptography.hazmat.primitives.asymmetric.dh import DHParameterNumbers, DHParameters, DHPublicNumbers
-from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
-import os
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+import struct
 import time
 import random
+from engine import BitboardPosition, COLOR_INDEX, COLOR_SHIFT, PIECE_NAMES, legal_moves, square, square_to_pos
+from engine.movecache import move_cache
+from actors import ActorPool
+from config import (CLIENT_OFFER_WAIT, CONNECTION_TIMEOUT, FULL_BOARD_INTERVAL, IDLE_TIMEOUT, MAX_CONNECTIONS,
+                    RESUME_GRACE_PERIOD)
+from framing import FrameReader, OutboundQueue, encode_frame, MAX_OUTBOUND_BYTES
+from handshake import (DEFAULT_PROCESSES, DH_GENERATOR, DH_HANDSHAKES, DH_PRIME, HANDSHAKE_LEGACY, HANDSHAKE_RESUME,
+                       HANDSHAKE_X25519, LATENCY_SAMPLES, RESUME_NONCE_SIZE, SUPPORTED_HANDSHAKES, HandshakeOverloaded,
+                       HandshakePool, SessionTickets, TicketError, confirm_resumption, derive_aes_key,
+                       derive_dh_session_key, derive_resumed_session_key, derive_x25519_session_key,
+                       generate_dh_keypair, is_x25519_message, latency_percentiles, parse_client_offer,
+                       parse_x25519_message, x25519_message, x25519_public_bytes)
+from records import RECORD_CBC, RECORD_GCM, SERVER, SUPPORTED_RECORDS, RecordError, choose_record, record_layer
+from timerwheel import TimerWheel
+from codec import CODEC_JSON, SUPPORTED_CODECS, choose_codec
+from wire import SUPPORTED_WIRE_FORMATS, WIRE_JSON, choose_wire_format, wire_format
+from collections import deque
+
+# A game is drawn once the same position (including side to move) occurs this many times
+REPETITION_LIMIT = 3
+
+# Pending connections the kernel queues before accept(); bursts of players overflowed 5
+LISTEN_BACKLOG = 1024
+
+# Most bytes the asyncio server asks its stream for per read; several frames may arrive at once
+READ_CHUNK_SIZE = 65536
+
+# Messages whose handlers hash passwords; the asyncio server runs them in an executor
+CPU_BOUND_MESSAGES = ('register', 'login', 'reset_password')
+
+# Seconds between connection counter log lines (only printed when something changed)
+STATS_LOG_INTERVAL = 60
+
+
+def is_square(pos):
+    """True for a [row, col] pair of integers, the shape ChessGame.make_move unpacks"""
+    return (isinstance(pos, (list, tuple)) and len(pos) == 2
+            and all(isinstance(n, int) and not isinstance(n, bool) for n in pos))
 
 
 class ChessServer:
@@ -29,6 +65,57 @@ class ChessServer:
         self.games = {}  # game_id: Game object
         self.waiting_players = []  # List of waiting players
         self.clients = {}  # client_socket: player_info
+        self.matchmaker = None  # Unix socket to the matchmaker when running as a cluster worker
+
+        # Each game's moves, resignations and disconnects go to its actor and are handled
+        # one at a time by this fixed pool, so game state needs no lock and games never
+        # wait on each other. self.lock guards which games exist, each client's game_id
+        # and the waiting queue; users_lock guards accounts.
+        self.game_actors = ActorPool()
+        self.lock = threading.RLock()
+        self.users_lock = threading.RLock()
+
+        # Admission control: at most max_connections open at once (new ones are closed
+        # straight away), CONNECTION_TIMEOUT to finish the handshake or any started frame,
+        # IDLE_TIMEOUT for a connection that is neither in a game nor queued, and the
+        # outbound queue's stall timeout for replies the peer stops reading. One timer
+        # wheel checks every connection's deadlines.
+        self.max_connections = MAX_CONNECTIONS
+        self.connection_timeout = CONNECTION_TIMEOUT
+        self.idle_timeout = IDLE_TIMEOUT
+        self.timers = TimerWheel()
+        self.connection_watches = {}  # connection: watch dict checked by the timer wheel
+        self.connection_stats = {
+            'accepted': 0,
+            'rejected': 0,
+            'handshake_timeouts': 0,
+            'read_timeouts': 0,
+            'write_timeouts': 0,
+            'idle_timeouts': 0,
+            'handshake_overloads': 0,
+            'rejected_tickets': 0
+        }
+        self.handshakes = SUPPORTED_HANDSHAKES  # versions accepted; without the DH ones the hello is a bare X25519 key
+        self.client_offer_wait = CLIENT_OFFER_WAIT  # clients that offer X25519 first get a bare X25519 hello
+        self.handshake_versions = {version: 0 for version in SUPPORTED_HANDSHAKES}  # completed, by version
+        self.record_versions = {record: 0 for record in SUPPORTED_RECORDS}  # sessions, by record version
+        self.wire_versions = {wire: 0 for wire in SUPPORTED_WIRE_FORMATS}  # sessions, by wire format
+        self.codec_versions = {codec: 0 for codec in SUPPORTED_CODECS}  # sessions, by codec
+        self.logged_stats = None
+
+        # DH key generation, the key exchange and the KDF run in worker processes so a burst
+        # of connections doesn't hold the GIL against gameplay; handshake_latencies holds
+        # accept-to-established times for recent connections
+        self.handshake_pool = HandshakePool()
+        self.handshake_latencies = deque(maxlen=LATENCY_SAMPLES)
+
+        # Session resumption: clients that ask get a ticket at login and game start, and
+        # can reconnect with it instead of a key exchange and a login. A disconnected
+        # player who holds one keeps their seat for resume_grace_period; suspended maps
+        # (username, game_id) to the timer that then ends the game as a disconnect.
+        self.session_tickets = SessionTickets()
+        self.resume_grace_period = RESUME_GRACE_PERIOD
+        self.suspended = {}
 
         # Database
         self.db_file = 'users.pkl'
@@ -51,23 +138,11 @@ class ChessServer:
     def _initialize_dh_params(self):
         """Initialize DH parameters using RFC 3526 Group 14 (2048-bit)"""
         # Using well-known safe prime from RFC 3526
-        p = int(
-            "FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD1"
-            "29024E088A67CC74020BBEA63B139B22514A08798E3404DD"
-            "EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245"
-            "E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
-            "EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3D"
-            "C2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F"
-            "83655D23DCA3AD961C62F356208552BB9ED529077096966D"
-            "670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
-            "E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9"
-            "DE2BCBF6955817183995497CEA956AE515D2261898FA0510"
-            "15728E5A8AACAA68FFFFFFFFFFFFFFFF", 16
-        )
-        g = 2
-
-        param_numbers = DHParameterNumbers(p, g)
-        self.dh_params = param_numbers.parameters()
+        p = DH_PRIME
+        g = DH_GENERATOR
+
+        # The parameters object is built in whichever process first makes a DH key (handshake.dh_parameters)
+        self.dh_numbers = (p, g)
 
     def load_users(self):
         """Load user database from pickle file"""
@@ -79,8 +154,22 @@ class ChessServer:
 
     def save_users(self):
         """Save user database to pickle file"""
-        with open(self.db_file, 'wb') as f:
-            pickle.dump(self.users, f)
+        with self.users_lock:
+            with open(self.db_file, 'wb') as f:
+                pickle.dump(self.users, f)
+
+    def record_result(self, winner, loser, draw=False):
+        """Add a finished game to both players' stats (winner/loser are just the two players for a draw)"""
+        with self.users_lock:
+            if draw:
+                self.users[winner]['draws'] += 1
+                self.users[loser]['draws'] += 1
+            else:
+                self.users[winner]['wins'] += 1
+                self.users[loser]['losses'] += 1
+            self.users[winner]['games_played'] += 1
+            self.users[loser]['games_played'] += 1
+            self.save_users()
 
     def hash_password(self, password, salt):
         """Hash password with salt and pepper"""
@@ -113,56 +202,174 @@ class ChessServer:
             print(f"Email error: {e}")
             return False
 
-    def generate_aes_key(self, shared_secret):
+    def generate_aes_key(self, shared_secret, version=HANDSHAKE_LEGACY):
         """Generate AES key from DH shared secret"""
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=b'chess_salt',
-            iterations=100000,
-        )
-        return kdf.derive(shared_secret)
-
-    def encrypt_message(self, message, key):
-        """Encrypt message using AES-CBC"""
-        iv = os.urandom(16)
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
-        encryptor = cipher.encryptor()
-
-        # Pad message
-        padder = padding.PKCS7(128).padder()
-        padded_data = padder.update(message.encode()) + padder.finalize()
+        return derive_aes_key(shared_secret, version)
 
-        encrypted = encryptor.update(padded_data) + encryptor.finalize()
-        return iv + encrypted
+    def encrypt_message(self, message, records):
+        """Encrypt an encoded message with the client's record layer"""
+        return records.seal(message)
 
-    def decrypt_message(self, encrypted_data, key):
-        """Decrypt message using AES-CBC"""
-        iv = encrypted_data[:16]
-        encrypted = encrypted_data[16:]
+    def decrypt_message(self, encrypted_data, records):
+        """Decrypt (and, for GCM records, authenticate) a message; RecordError if it doesn't"""
+        return records.open(encrypted_data)
 
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
-        decryptor = cipher.decryptor()
-
-        padded_data = decryptor.update(encrypted) + decryptor.finalize()
-
-        # Unpad message
-        unpadder = padding.PKCS7(128).unpadder()
-        data = unpadder.update(padded_data) + unpadder.finalize()
+    def read_client_offer(self, client_socket, frame_reader):
+        """The client's offer, if it sends one within client_offer_wait; None for clients that wait for the hello"""
+        if self.client_offer_wait <= 0:
+            return None
+        client_socket.settimeout(self.client_offer_wait)
+        try:
+            frame = frame_reader.read_frame()
+        except socket.timeout:
+            return None
+        finally:
+            client_socket.settimeout(None)
+        if frame is None:
+            raise ConnectionError("Client disconnected during key exchange")
+        offer = parse_client_offer(frame)
+        if offer is None:
+            raise ValueError("Expected a client offer before the server hello")
+        return offer
+
+    def create_server_hello(self, offer=None):
+        """Generate the server's keys (DH in the handshake pool) and the hello message carrying their public halves"""
+        dh_keypair = self.handshake_pool.run(generate_dh_keypair, *self.dh_numbers) if self.offers_dh(offer) else None
+        keys = (dh_keypair, self.new_x25519_key())
+        return keys, self.server_hello(keys, offer)
+
+    def offers_dh(self, offer=None):
+        """Whether the hello needs a DH key: DH is on offer and the client hasn't said it speaks X25519"""
+        if offer is not None and HANDSHAKE_X25519 in self.handshakes and HANDSHAKE_X25519 in offer['offer']:
+            return False
+        return any(version in DH_HANDSHAKES for version in self.handshakes)
+
+    def new_x25519_key(self):
+        return X25519PrivateKey.generate() if HANDSHAKE_X25519 in self.handshakes else None
+
+    def server_hello(self, keys, offer=None):
+        """Hello message for the server's (DH keypair (x, y), X25519 private key); either may be None"""
+        dh_keypair, x25519_key = keys
+        if dh_keypair is None:
+            # X25519 only: the hello is the bare public key, the newest record version and wire format
+            # and the preferred codec (of those the client offered, if it did)
+            if offer is None:
+                return x25519_message(x25519_key, max(SUPPORTED_RECORDS), max(SUPPORTED_WIRE_FORMATS),
+                                      SUPPORTED_CODECS[0])
+            return x25519_message(x25519_key, choose_record(offer['records']), choose_wire_format(offer['wire']),
+                                  choose_codec(SUPPORTED_CODECS, offer['codecs']))
+        p, g = self.dh_numbers
+
+        # Send server's public key as raw numbers, with the handshake, record, wire and codec versions on offer
+        server_public_data = {
+            'y': dh_keypair[1],
+            'p': p,
+            'g': g,
+            'versions': list(self.handshakes),
+            'records': list(SUPPORTED_RECORDS),
+            'wire': list(SUPPORTED_WIRE_FORMATS),
+            'codecs': list(SUPPORTED_CODECS)
+        }
+        if x25519_key is not None:
+            server_public_data['x25519'] = base64.b64encode(x25519_public_bytes(x25519_key)).decode('ascii')
+
+        server_data_json = json.dumps(server_public_data)
+        return server_data_json.encode('utf-8')
+
+    def parse_client_hello(self, client_data_bytes):
+        """(peer public key, handshake, record, wire format and codec versions) from the client's key exchange"""
+        if is_x25519_message(client_data_bytes):
+            # A raw X25519 key; DH replies are JSON and far longer
+            peer_key, record, wire, codec = parse_x25519_message(client_data_bytes)
+            version = HANDSHAKE_X25519
+        else:
+            client_data_json = str(client_data_bytes, 'utf-8')
+            client_public_data = json.loads(client_data_json)
 
-        return data.decode()
+            if 'ticket' in client_public_data:
+                # Resumption: the ticket and the client's nonce stand in for a public key
+                peer_key = client_public_data
+                version = HANDSHAKE_RESUME
+            else:
+                # The client echoes the group it was sent; anything else can't produce a shared key
+                if (client_public_data['p'], client_public_data['g']) != self.dh_numbers:
+                    raise ValueError("Client used a different DH group")
+
+                # Clients from before version negotiation send neither
+                peer_key = client_public_data['y']
+                version = client_public_data.get('version', HANDSHAKE_LEGACY)
+            record = client_public_data.get('record', RECORD_CBC)
+            wire = client_public_data.get('wire', WIRE_JSON)
+            codec = client_public_data.get('codec', CODEC_JSON)
+
+        if version not in self.handshakes:
+            raise ValueError(f"Unsupported handshake version {version!r}")
+        if record not in SUPPORTED_RECORDS:
+            raise ValueError(f"Unsupported record version {record!r}")
+        if wire not in SUPPORTED_WIRE_FORMATS:
+            raise ValueError(f"Unsupported wire format {wire!r}")
+        if codec not in SUPPORTED_CODECS:
+            raise ValueError(f"Unsupported codec {codec!r}")
+        if version == HANDSHAKE_RESUME and record != RECORD_GCM:
+            # CBC records can't authenticate the client's proof that it holds the ticket's secret
+            raise ValueError("Session resumption needs GCM records")
+        return peer_key, version, record, wire, codec
+
+    def complete_key_exchange(self, keys, server_hello, client_data_bytes):
+        """(record layer, wire format, resumed session or None) from the reply to server_hello (DH in the pool)"""
+        peer_key, version, record, wire, codec = self.parse_client_hello(client_data_bytes)
+        session = None
+        if version == HANDSHAKE_RESUME:
+            session, aes_key = self.resumed_session_key(server_hello, peer_key)
+        elif version == HANDSHAKE_X25519:
+            aes_key = derive_x25519_session_key(keys[1], peer_key)
+        else:
+            aes_key = self.handshake_pool.run(derive_dh_session_key, *self.dh_numbers, *keys[0], peer_key, version)
+        return (*self.open_session(version, record, wire, codec, aes_key, (peer_key, session)), session)
+
+    def resumed_session_key(self, server_hello, client_public_data):
+        """(session from the client's ticket, AES key from its secret); TicketError for a forged or expired ticket"""
+        session = self.session_tickets.open(client_public_data['ticket'])
+        client_nonce = base64.b64decode(client_public_data['nonce'])
+        if len(client_nonce) != RESUME_NONCE_SIZE:
+            raise ValueError(f"{len(client_nonce)}-byte resumption nonce")
+        return session, derive_resumed_session_key(session['secret'], server_hello, client_nonce)
+
+    def open_session(self, version, record, wire, codec, aes_key, resumption=None):
+        """Count a completed handshake; (record layer, wire format) for the session.
+
+        resumption is (the client's reply, its ticket's session) for HANDSHAKE_RESUME: the
+        reply's proof must open under the session key before the ticket is spent and counted.
+        """
+        records = record_layer(record, aes_key, SERVER)
+        if version == HANDSHAKE_RESUME:
+            client_public_data, session = resumption
+            confirm_resumption(records, client_public_data.get('proof'))
+            self.session_tickets.spend(client_public_data['ticket'], session['expires'])
+        self.handshake_versions[version] += 1
+        self.record_versions[record] += 1
+        self.wire_versions[wire] += 1
+        self.codec_versions[codec] += 1
+        return records, wire_format(wire, codec)
 
     def start_server(self):
         """Start the chess server"""
         self.socket.bind((self.host, self.port))
-        self.socket.listen(5)
+        self.socket.listen(LISTEN_BACKLOG)
         print(f"Chess server listening on {self.host}:{self.port}")
         print("Features: User accounts, email reset, encryption, full chess rules")
+        self.timers.start()
+        self.schedule_stats_log()
+        self.handshake_pool.start()
 
         while True:
             try:
                 client_socket, address = self.socket.accept()
+                if not self.admit_connection(client_socket):
+                    self.reject_connection(client_socket)
+                    continue
                 print(f"Connection from {address}")
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 
                 client_thread = threading.Thread(
                     target=self.handle_client,
@@ -178,79 +385,80 @@ class ChessServer:
         try:
             print(f"Starting key exchange with {address}")
 
-            # Generate server keypair
-            private_key = self.dh_params.generate_private_key()
-            public_key = private_key.public_key()
+            frame_reader = FrameReader(client_socket)
+            self.connection_watches[client_socket]['frame_reader'] = frame_reader
 
-            # Get public key numbers for transmission
-            public_numbers = public_key.public_numbers()
+            # Generate server keys and send their public halves, tailored to what the client offered
+            offer = self.read_client_offer(client_socket, frame_reader)
+            keys, server_data_bytes = self.create_server_hello(offer)
 
-            # Send server's public key as raw numbers
-            server_public_data = {
-                'y': public_numbers.y,
-                'p': public_numbers.parameter_numbers.p,
-                'g': public_numbers.parameter_numbers.g
-            }
-
-            server_data_json = json.dumps(server_public_data)
-            server_data_bytes = server_data_json.encode('utf-8')
-
-            client_socket.send(len(server_data_bytes).to_bytes(4, 'big'))
-            client_socket.send(server_data_bytes)
+            client_socket.sendall(encode_frame(server_data_bytes))
 
-            # Receive client's public key
-            client_data_len = int.from_bytes(client_socket.recv(4), 'big')
-            client_data_bytes = b''
-            while len(client_data_bytes) < client_data_len:
-                chunk = client_socket.recv(client_data_len - len(client_data_bytes))
-                if not chunk:
-                    raise ConnectionError("Client disconnected during key exchange")
-                client_data_bytes += chunk
-
-            client_data_json = client_data_bytes.decode('utf-8')
-            client_public_data = json.loads(client_data_json)
+            # Receive client's public key (after an offer that came too late for the hello)
+            client_data_bytes = frame_reader.read_frame()
+            if client_data_bytes is not None and offer is None and parse_client_offer(client_data_bytes):
+                client_data_bytes = frame_reader.read_frame()
+            if client_data_bytes is None:
+                raise ConnectionError("Client disconnected during key exchange")
 
-            # Reconstruct client's public key
-            client_param_numbers = DHParameterNumbers(
-                client_public_data['p'],
-                client_public_data['g']
-            )
-            client_public_numbers = DHPublicNumbers(
-                client_public_data['y'],
-                client_param_numbers
-            )
-            client_public_key = client_public_numbers.public_key()
-
-            # Calculate shared secret
-            shared_secret = private_key.exchange(client_public_key)
+            records, wire, session = self.complete_key_exchange(keys, server_data_bytes, client_data_bytes)
             print(f"Key exchange successful with {address}")
 
-            # Generate AES key
-            aes_key = self.generate_aes_key(shared_secret)
-
-            # Store client info
+            # Store client info; everything sent to this client goes through its outbound queue
             self.clients[client_socket] = {
                 'address': address,
-                'aes_key': aes_key,
+                'records': records,
+                'wire': wire,
+                'outbound': OutboundQueue(client_socket, records.seal),
                 'username': None,
                 'game_id': None
             }
+            self.mark_established(client_socket)
+            if session is not None:
+                self.resume_session(client_socket, session)
+                # A cluster worker passes a session resumed into another worker's game on to that worker
+                if self.after_response(client_socket, frame_reader):
+                    self.cleanup_client(client_socket)
+                    return
+        except Exception as e:
+            if isinstance(e, HandshakeOverloaded):
+                self.connection_stats['handshake_overloads'] += 1
+            elif isinstance(e, TicketError):
+                self.connection_stats['rejected_tickets'] += 1
+            print(f"Key exchange with {address} failed: {e}")
+            self.cleanup_client(client_socket)
+            return
 
+        self.serve_client(client_socket, address, frame_reader)
+
+    def serve_client(self, client_socket, address, frame_reader):
+        """Read and dispatch messages from a client whose session key is in self.clients"""
+        records = self.clients[client_socket]['records']
+        wire = self.clients[client_socket]['wire']
+        watch = self.connection_watches.get(client_socket) or self.watch_connection(client_socket, frame_reader)
+        try:
             while True:
-                # Receive encrypted message
-                msg_len = int.from_bytes(client_socket.recv(4), 'big')
-                if msg_len == 0:
+                # Receive encrypted message (None or an empty frame ends the session)
+                encrypted_data = frame_reader.read_frame()
+                if not encrypted_data:
                     break
+                watch['last_activity'] = time.monotonic()
 
-                encrypted_data = client_socket.recv(msg_len)
-                decrypted_msg = self.decrypt_message(encrypted_data, aes_key)
+                decrypted_msg = self.decrypt_message(encrypted_data, records)
 
-                message = json.loads(decrypted_msg)
+                message = wire.decode(decrypted_msg)
                 response = self.process_message(client_socket, message)
 
                 if response:
                     self.send_encrypted_response(client_socket, response)
 
+                if self.after_response(client_socket, frame_reader):
+                    break
+
+        except ConnectionError as e:
+            print(f"Connection with {address} closed: {e}")
+        except RecordError as e:
+            print(f"Dropping {address}: {e}")
         except Exception as e:
             print(f"Error handling client {address}: {e}")
             import traceback
@@ -258,19 +466,145 @@ class ChessServer:
         finally:
             self.cleanup_client(client_socket)
 
+    # Admission control and connection deadlines
+
+    def admit_connection(self, connection):
+        """Start watching a new connection; False (and counted) if the server is already full"""
+        with self.lock:
+            if len(self.connection_watches) >= self.max_connections:
+                self.connection_stats['rejected'] += 1
+                return False
+            self.connection_stats['accepted'] += 1
+            self.watch_connection(connection, established=False)
+        return True
+
+    def reject_connection(self, client_socket):
+        """Fast reject: reset the connection without a thread, a handshake or a buffer"""
+        try:
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        except OSError:
+            pass
+        client_socket.close()
+
+    def watch_connection(self, connection, frame_reader=None, established=True):
+        """Put a connection's deadlines on the timer wheel (adopted connections skip admission)"""
+        now = time.monotonic()
+        watch = {
+            'connection': connection,
+            'frame_reader': frame_reader,
+            'opened': now,
+            'last_activity': now,
+            'established': established,
+            'closed': False
+        }
+        self.connection_watches[connection] = watch
+        self.timers.schedule(self.connection_timeout, lambda: self.check_connection(watch))
+        return watch
+
+    def mark_established(self, connection):
+        """Handshake done: the handshake deadline gives way to read and idle timeouts"""
+        watch = self.connection_watches.get(connection)
+        if watch:
+            watch['established'] = True
+            watch['last_activity'] = time.monotonic()
+            self.handshake_latencies.append(watch['last_activity'] - watch['opened'])
+
+    def check_connection(self, watch):
+        """Timer wheel callback: drop a connection past one of its deadlines, else check again later"""
+        if watch['closed']:
+            return
+        now = time.monotonic()
+        connection = watch['connection']
+
+        if not watch['established']:
+            deadline = watch['opened'] + self.connection_timeout
+            if now >= deadline:
+                return self.expire_connection(watch, 'handshake_timeouts', "handshake not completed in time")
+            self.timers.schedule(deadline - now, lambda: self.check_connection(watch))
+            return
+
+        # Look again within one connection timeout, so a frame started meanwhile is seen in time
+        next_check = now + self.connection_timeout
+
+        frame_reader = watch['frame_reader']
+        if frame_reader and frame_reader.pending() and frame_reader.partial_since is not None:
+            deadline = frame_reader.partial_since + self.connection_timeout
+            if now >= deadline:
+                return self.expire_connection(watch, 'read_timeouts', "frame not completed in time")
+            next_check = min(next_check, deadline)
+
+        client_info = self.clients.get(connection)
+        outbound = client_info.get('outbound') if client_info else None
+        stalled_since = outbound.stalled_since() if outbound else None
+        if stalled_since is not None:
+            # The peer stopped reading: queued replies are making no progress
+            deadline = stalled_since + outbound.stall_timeout
+            if now >= deadline:
+                return self.expire_connection(watch, 'write_timeouts', "replies not read in time")
+            next_check = min(next_check, deadline)
+
+        if not (client_info and client_info['game_id']) and connection not in self.waiting_players:
+            deadline = watch['last_activity'] + self.idle_timeout
+            if now >= deadline:
+                return self.expire_connection(watch, 'idle_timeouts', "idle too long")
+            next_check = min(next_check, deadline)
+
+        self.timers.schedule(next_check - now, lambda: self.check_connection(watch))
+
+    def expire_connection(self, watch, counter, reason):
+        self.connection_stats[counter] += 1
+        watch['closed'] = True
+        client_info = self.clients.get(watch['connection'])
+        address = f" {client_info['address']}" if client_info else ""
+        print(f"Dropping connection{address}: {reason}")
+        self.drop_connection(watch['connection'])
+
+    def drop_connection(self, client_socket):
+        """Close a connection from outside its thread; the blocked recv returns and cleanup runs there"""
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def get_connection_stats(self):
+        """Connection counters plus the number currently open"""
+        return dict(self.connection_stats, active=len(self.connection_watches))
+
+    def get_handshake_stats(self):
+        """Accept-to-established latency percentiles (ms), handshakes by version and handshake pool counters"""
+        return {**latency_percentiles(self.handshake_latencies), 'versions': dict(self.handshake_versions),
+                'records': dict(self.record_versions), 'wire': dict(self.wire_versions),
+                'codecs': dict(self.codec_versions), 'pool': self.handshake_pool.stats()}
+
+    def schedule_stats_log(self):
+        """Print the connection counters every STATS_LOG_INTERVAL seconds when they change"""
+        def log():
+            stats = self.get_connection_stats()
+            if stats != self.logged_stats:
+                print("Connections: " + ", ".join(f"{name} {count}" for name, count in stats.items()))
+                handshakes = self.get_handshake_stats()
+                print(f"Handshakes: p50 {handshakes['p50']:.1f} ms, p95 {handshakes['p95']:.1f} ms, "
+                      f"p99 {handshakes['p99']:.1f} ms, max {handshakes['max']:.1f} ms, "
+                      f"{handshakes['pool']['in_flight']} in flight, by version "
+                      + ", ".join(f"v{version} {count}" for version, count in handshakes['versions'].items())
+                      + ", records " + ", ".join(f"v{record} {count}" for record, count in handshakes['records'].items())
+                      + ", wire " + ", ".join(f"v{wire} {count}" for wire, count in handshakes['wire'].items())
+                      + ", codecs " + ", ".join(f"v{codec} {count}" for codec, count in handshakes['codecs'].items()))
+                self.logged_stats = stats
+            self.timers.schedule(STATS_LOG_INTERVAL, log)
+
+        self.timers.schedule(STATS_LOG_INTERVAL, log)
+
     def send_encrypted_response(self, client_socket, response):
         """Send encrypted response to client"""
         try:
-            if client_socket not in self.clients:
+            client_info = self.clients.get(client_socket)
+            if client_info is None:
                 print(f"Error: Client socket not in clients list!")
                 return False
 
-            aes_key = self.clients[client_socket]['aes_key']
-            encrypted_response = self.encrypt_message(json.dumps(response), aes_key)
-
-            client_socket.send(len(encrypted_response).to_bytes(4, 'big'))
-            client_socket.send(encrypted_response)
-            return True
+            # Sealed and sent without waiting; the shared flusher finishes what a slow peer leaves
+            return client_info['outbound'].put(client_info['wire'].encode(response))
         except Exception as e:
             print(f"Error sending response: {e}")
             return False
@@ -295,6 +629,8 @@ class ChessServer:
             return self.handle_move(client_socket, message)
         elif msg_type == 'resign':
             return self.handle_resign(client_socket)
+        elif msg_type == 'sync':
+            return self.handle_sync(client_socket)
         else:
             return {'type': 'error', 'message': 'Unknown message type'}
 
@@ -314,20 +650,24 @@ class ChessServer:
         salt = secrets.token_bytes(32)
         password_hash = self.hash_password(password, salt)
 
-        # Store user
-        self.users[username] = {
-            'password_hash': password_hash,
-            'salt': salt,
-            'email': email,
-            'games_played': 0,
-            'wins': 0,
-            'losses': 0,
-            'draws': 0,
-            'rating': 1200,
-            'created_at': time.time()
-        }
+        # Store user; check again, another connection may have taken the name while hashing
+        with self.users_lock:
+            if username in self.users:
+                return {'type': 'register_response', 'success': False, 'message': 'Username already exists'}
+
+            self.users[username] = {
+                'password_hash': password_hash,
+                'salt': salt,
+                'email': email,
+                'games_played': 0,
+                'wins': 0,
+                'losses': 0,
+                'draws': 0,
+                'rating': 1200,
+                'created_at': time.time()
+            }
 
-        self.save_users()
+            self.save_users()
         print(f"New user registered: {username}")
         return {'type': 'register_response', 'success': True, 'message': 'Registration successful'}
 
@@ -348,33 +688,78 @@ class ChessServer:
         if password_hash != user_data['password_hash']:
             return {'type': 'login_response', 'success': False, 'message': 'Invalid credentials'}
 
-        # Update client info
+        # Update client info; clients that ask for session tickets can resume this login later
         self.clients[client_socket]['username'] = username
+        self.clients[client_socket]['resumable'] = bool(message.get('session_ticket'))
 
         print(f"User logged in: {username}")
         return {
             'type': 'login_response',
             'success': True,
             'username': username,
-            'stats': {
-                'games_played': user_data['games_played'],
-                'wins': user_data['wins'],
-                'losses': user_data['losses'],
-                'draws': user_data['draws'],
-                'rating': user_data['rating']
-            }
+            'stats': self.user_stats(user_data),
+            **self.session_ticket(client_socket)
+        }
+
+    def user_stats(self, user_data):
+        """The stats part of an account, as sent to its client"""
+        return {
+            'games_played': user_data['games_played'],
+            'wins': user_data['wins'],
+            'losses': user_data['losses'],
+            'draws': user_data['draws'],
+            'rating': user_data['rating']
         }
 
+    def session_ticket(self, client_socket):
+        """Ticket fields for a message to a client that asked for session tickets, else none"""
+        client_info = self.clients[client_socket]
+        if not client_info.get('resumable'):
+            return {}
+        ticket, secret = self.session_tickets.issue(client_info['username'], client_info['game_id'])
+        return {'ticket': ticket, 'resumption_secret': base64.b64encode(secret).decode('ascii')}
+
+    def resume_session(self, client_socket, session):
+        """Log a resumed connection back in, and back into its game if that is still on"""
+        client_info = self.clients[client_socket]
+        client_info['username'] = session['username']
+        client_info['resumable'] = True
+        print(f"Session resumed: {session['username']}")
+
+        game = self.games.get(session['game_id']) if session['game_id'] else None
+        if game is not None:
+            # The game's actor hands over the seat, after whatever it already has queued
+            game.actor.post(('resume', session['username'], client_socket))
+        else:
+            self.send_encrypted_response(client_socket, self.session_resumed(client_socket))
+
+    def session_resumed(self, client_socket, game=None):
+        """Tell a resumed client who it is and, if it is back in a game, the whole position"""
+        username = self.clients[client_socket]['username']
+        user_data = self.users.get(username)
+        message = {
+            'type': 'session_resumed',
+            'username': username,
+            'stats': self.user_stats(user_data) if user_data else {},
+            'game_id': None
+        }
+        if game is not None:
+            message.update({
+                'game_id': game.game_id,
+                'color': 'white' if client_socket == game.white_player else 'black',
+                'opponent': game.usernames[game.get_opponent(client_socket)],
+                **self.position_state(game)
+            })
+        message.update(self.session_ticket(client_socket))
+        return message
+
     def handle_request_reset(self, message):
         """Handle password reset request"""
         email = message.get('email')
 
         # Find user by email
-        user_found = False
-        for username, user_data in self.users.items():
-            if user_data['email'] == email:
-                user_found = True
-                break
+        with self.users_lock:
+            user_found = any(user_data['email'] == email for user_data in self.users.values())
 
         if not user_found:
             return {'type': 'reset_response', 'success': False, 'message': 'Email not found'}
@@ -409,17 +794,18 @@ class ChessServer:
             return {'type': 'reset_password_response', 'success': False, 'message': 'Invalid reset code'}
 
         # Find and update user password
-        for username, user_data in self.users.items():
-            if user_data['email'] == email:
-                salt = secrets.token_bytes(32)
-                password_hash = self.hash_password(new_password, salt)
-                user_data['password_hash'] = password_hash
-                user_data['salt'] = salt
-                break
-
-        # Clean up reset code
-        del self.reset_codes[email]
-        self.save_users()
+        salt = secrets.token_bytes(32)
+        password_hash = self.hash_password(new_password, salt)
+        with self.users_lock:
+            for username, user_data in self.users.items():
+                if user_data['email'] == email:
+                    user_data['password_hash'] = password_hash
+                    user_data['salt'] = salt
+                    break
+
+            # Clean up reset code
+            self.reset_codes.pop(email, None)
+            self.save_users()
 
         print(f"Password reset successful for {email}")
         return {'type': 'reset_password_response', 'success': True, 'message': 'Password reset successful'}
@@ -431,63 +817,130 @@ class ChessServer:
         if not username:
             return {'type': 'queue_response', 'success': False, 'message': 'Not logged in'}
 
-        if client_socket not in self.waiting_players:
-            self.waiting_players.append(client_socket)
+        if self.matchmaker is not None:
+            # Cluster worker: the connection moves to the matchmaker once this reply is sent
+            self.clients[client_socket]['handoff'] = True
             print(f"{username} joined queue")
+            return {'type': 'queue_response', 'success': True, 'message': 'Joined queue'}
+
+        # Queueing and pairing are one step, so a popped player can't disconnect before its game exists
+        with self.lock:
+            if client_socket not in self.waiting_players:
+                self.waiting_players.append(client_socket)
+                print(f"{username} joined queue")
 
-        # Try to match players
-        if len(self.waiting_players) >= 2:
-            player1 = self.waiting_players.pop(0)
-            player2 = self.waiting_players.pop(0)
+            # Try to match players
+            if len(self.waiting_players) >= 2:
+                player1 = self.waiting_players.pop(0)
+                player2 = self.waiting_players.pop(0)
+                self.start_match(player1, player2)
+
+        return {'type': 'queue_response', 'success': True, 'message': 'Joined queue'}
 
+    def start_match(self, player1, player2):
+        """Create a game for two players and tell each of them; player1 plays white"""
+        with self.lock:
             game_id = self.create_game(player1, player2)
 
-            # Notify both players
-            self.send_encrypted_response(player1, {
-                'type': 'game_start',
-                'game_id': game_id,
-                'color': 'white',
-                'opponent': self.clients[player2]['username']
-            })
+        # Notify both players, with tickets that can resume into this game
+        self.send_encrypted_response(player1, {
+            'type': 'game_start',
+            'game_id': game_id,
+            'color': 'white',
+            'opponent': self.clients[player2]['username'],
+            **self.session_ticket(player1)
+        })
 
-            self.send_encrypted_response(player2, {
-                'type': 'game_start',
-                'game_id': game_id,
-                'color': 'black',
-                'opponent': self.clients[player1]['username']
-            })
+        self.send_encrypted_response(player2, {
+            'type': 'game_start',
+            'game_id': game_id,
+            'color': 'black',
+            'opponent': self.clients[player1]['username'],
+            **self.session_ticket(player2)
+        })
+        return game_id
 
-        return {'type': 'queue_response', 'success': True, 'message': 'Joined queue'}
+    def after_response(self, client_socket, frame_reader):
+        """Hook run after each message is answered; True stops serving the connection in this thread.
+
+        Cluster workers use it to pass queued players, and sessions resumed into
+        another worker's game, on to the matchmaker process.
+        """
+        return False
 
     def handle_leave_queue(self, client_socket):
         """Handle player leaving matchmaking queue"""
-        if client_socket in self.waiting_players:
-            self.waiting_players.remove(client_socket)
-            username = self.clients[client_socket]['username']
-            print(f"{username} left queue")
+        with self.lock:
+            if client_socket in self.waiting_players:
+                self.waiting_players.remove(client_socket)
+                username = self.clients[client_socket]['username']
+                print(f"{username} left queue")
 
         return {'type': 'queue_response', 'success': True, 'message': 'Left queue'}
 
     def create_game(self, player1, player2):
-        """Create a new chess game"""
-        game_id = secrets.token_hex(8)
+        """Create a new chess game (caller holds self.lock)"""
+        game_id = self.new_game_id()
         game = ChessGame(game_id, player1, player2)
+        game.usernames = {player1: self.clients[player1]['username'], player2: self.clients[player2]['username']}
+        game.actor = self.game_actors.actor(lambda message: self.handle_game_message(game, message), game_id)
 
         self.games[game_id] = game
         self.clients[player1]['game_id'] = game_id
         self.clients[player2]['game_id'] = game_id
 
-        print(f"Game {game_id} created: {self.clients[player1]['username']} vs {self.clients[player2]['username']}")
+        print(f"Game {game_id} created: {game.usernames[player1]} vs {game.usernames[player2]}")
         return game_id
 
+    def new_game_id(self):
+        """Random id for a new game"""
+        return secrets.token_hex(8)
+
+    def get_game(self, client_socket):
+        """The client's active game, or None"""
+        client_info = self.clients.get(client_socket)
+        return self.games.get(client_info['game_id']) if client_info else None
+
+    def remove_game(self, game):
+        """Forget a finished game and clear its players' game_id"""
+        with self.lock:
+            self.games.pop(game.game_id, None)
+            for player in (game.white_player, game.black_player):
+                client_info = self.clients.get(player)
+                if client_info and client_info['game_id'] == game.game_id:
+                    client_info['game_id'] = None
+
     def handle_move(self, client_socket, message):
         """Handle chess move"""
-        game_id = self.clients[client_socket]['game_id']
+        game = self.get_game(client_socket)
 
-        if not game_id or game_id not in self.games:
+        if game is None:
             return {'type': 'move_response', 'success': False, 'message': 'No active game'}
 
-        game = self.games[game_id]
+        # A malformed move would fail inside the game's actor, where no reply gets sent
+        if not (is_square(message.get('from')) and is_square(message.get('to'))):
+            return {'type': 'move_response', 'success': False, 'message': 'Invalid move'}
+
+        # The game's actor validates it and replies to both players
+        game.actor.post(('move', client_socket, message))
+        return None
+
+    def handle_game_message(self, game, message):
+        """Run one move, resignation, disconnect, resumption or sync from a game's mailbox (on an actor pool worker)"""
+        action, player = message[0], message[1]
+        if action == 'move':
+            self.apply_move(game, player, message[2])
+        elif action == 'resign':
+            self.apply_resign(game, player)
+        elif action == 'disconnect':
+            self.apply_disconnect(game, player)
+        elif action == 'resume':
+            self.apply_resume(game, player, message[2])
+        elif action == 'sync':
+            self.send_encrypted_response(player, self.board_sync(game))
+
+    def apply_move(self, game, client_socket, message):
+        """Make a move and send the result to the mover and the opponent"""
         from_pos = message.get('from')
         to_pos = message.get('to')
 
@@ -497,34 +950,87 @@ class ChessServer:
             game_status = result.get('game_status', 'continue')
 
             # Handle game end conditions
-            if game_status in ['checkmate', 'stalemate']:
-                self.handle_game_end(client_socket, game_id, game_status)
-                return {'type': 'move_response', 'success': True, 'game_over': True, 'reason': game_status}
+            if game_status in ['checkmate', 'stalemate', 'repetition']:
+                self.handle_game_end(client_socket, game.game_id, game_status)
+                result = {'type': 'move_response', 'success': True, 'game_over': True, 'reason': game_status}
             else:
                 # Normal move, notify opponent
                 opponent = game.get_opponent(client_socket)
                 if opponent:
-                    opponent_message = {
-                        'type': 'opponent_move',
-                        'from': from_pos,
-                        'to': to_pos,
-                        'board': game.get_board_state(),
-                        'turn': result['turn'],
-                        'in_check': result.get('in_check', False)
-                    }
-
-                    self.send_encrypted_response(opponent, opponent_message)
+                    self.send_encrypted_response(opponent, self.opponent_move(game, opponent, from_pos, to_pos, result))
 
+        # The mover may have disconnected since posting the move
+        if client_socket in self.clients:
+            self.send_encrypted_response(client_socket, self.move_result(game, client_socket, result))
+
+    def takes_deltas(self, client_socket):
+        """Whether a client's wire format has it apply moves to its own board"""
+        client_info = self.clients.get(client_socket)
+        return bool(client_info and client_info.get('wire') and client_info['wire'].deltas)
+
+    def with_keyframe(self, game, message):
+        """A delta move message, with the whole board added every FULL_BOARD_INTERVAL moves"""
+        if message['seq'] % FULL_BOARD_INTERVAL == 0:
+            message['board'] = game.get_board_state()
+        return message
+
+    def opponent_move(self, game, opponent, from_pos, to_pos, result):
+        """The opponent_move for the player who didn't move: the move and position key, or the whole board"""
+        message = {'type': 'opponent_move', 'from': from_pos, 'to': to_pos}
+        if self.takes_deltas(opponent):
+            message.update({key: result[key] for key in ('captured', 'turn', 'in_check', 'seq', 'hash')})
+            return self.with_keyframe(game, message)
+        message.update({
+            'board': game.get_board_state(),
+            'turn': result['turn'],
+            'in_check': result.get('in_check', False)
+        })
+        return message
+
+    def move_result(self, game, client_socket, result):
+        """The reply to a move as its sender's wire format has it"""
+        if self.takes_deltas(client_socket):
+            message = {'type': 'move_response', **result}
+            return self.with_keyframe(game, message) if 'seq' in message else message
+        if 'seq' in result:
+            # Clients from before deltas take the board instead of the move count and position key
+            result = {key: value for key, value in result.items() if key not in ('seq', 'hash')}
+            result['board'] = game.get_board_state()
         return result
 
+    def handle_sync(self, client_socket):
+        """Handle a request for the whole position, from a client whose board no longer matches the game's"""
+        game = self.get_game(client_socket)
+
+        if game is None:
+            return {'type': 'board_sync', 'success': False, 'message': 'No active game'}
+
+        # Answered by the game's actor, so the position isn't read halfway through a move
+        game.actor.post(('sync', client_socket))
+        return None
+
+    def board_sync(self, game):
+        """Reply to a sync request"""
+        return {'type': 'board_sync', **self.position_state(game)}
+
+    def position_state(self, game):
+        """The whole position with its move count and key, for a client to start applying deltas from"""
+        return {
+            'board': game.get_board_state(),
+            'turn': game.current_turn,
+            'in_check': game.is_in_check(game.current_turn),
+            'seq': len(game.move_history),
+            'hash': game.position.key
+        }
+
     def handle_game_end(self, triggering_player, game_id, reason):
         """Handle game end scenarios"""
         game = self.games[game_id]
         player1 = game.white_player
         player2 = game.black_player
 
-        player1_username = self.clients[player1]['username']
-        player2_username = self.clients[player2]['username']
+        player1_username = game.usernames[player1]
+        player2_username = game.usernames[player2]
 
         if reason == 'checkmate':
             # The player who made the move wins
@@ -532,13 +1038,9 @@ class ChessServer:
             loser = game.get_opponent(triggering_player)
 
             # Update stats
-            winner_username = self.clients[winner]['username']
-            loser_username = self.clients[loser]['username']
-
-            self.users[winner_username]['wins'] += 1
-            self.users[winner_username]['games_played'] += 1
-            self.users[loser_username]['losses'] += 1
-            self.users[loser_username]['games_played'] += 1
+            winner_username = game.usernames[winner]
+            loser_username = game.usernames[loser]
+            self.record_result(winner_username, loser_username)
 
             # Notify players
             self.send_encrypted_response(winner, {
@@ -555,51 +1057,44 @@ class ChessServer:
 
             print(f"Game {game_id} ended: {winner_username} wins by checkmate")
 
-        elif reason == 'stalemate':
+        elif reason in ('stalemate', 'repetition'):
             # Draw
-            self.users[player1_username]['draws'] += 1
-            self.users[player1_username]['games_played'] += 1
-            self.users[player2_username]['draws'] += 1
-            self.users[player2_username]['games_played'] += 1
+            self.record_result(player1_username, player2_username, draw=True)
 
             # Notify both players
             for player in [player1, player2]:
                 self.send_encrypted_response(player, {
                     'type': 'game_end',
                     'result': 'draw',
-                    'reason': 'stalemate'
+                    'reason': reason
                 })
 
-            print(f"Game {game_id} ended: stalemate")
+            print(f"Game {game_id} ended: {reason}")
 
         # Clean up game
-        del self.games[game_id]
-        self.clients[player1]['game_id'] = None
-        self.clients[player2]['game_id'] = None
-        self.save_users()
+        self.remove_game(game)
 
     def handle_resign(self, client_socket):
         """Handle player resignation"""
-        game_id = self.clients[client_socket]['game_id']
+        game = self.get_game(client_socket)
 
-        if not game_id or game_id not in self.games:
-            return None
+        if game is not None:
+            game.actor.post(('resign', client_socket))
 
-        game = self.games[game_id]
-        resigning_player_username = self.clients[client_socket]['username']
+        return None  # No response to resigning player needed
 
-        # Find opponent
-        opponent = game.get_opponent(client_socket)
-        if not opponent:
-            return None
+    def apply_resign(self, game, client_socket):
+        """End the game in the opponent's favour, unless a move or the opponent ended it first"""
+        if game.game_over:
+            return
 
-        winner_username = self.clients[opponent]['username']
+        game.game_over = True
+        opponent = game.get_opponent(client_socket)
+        resigning_player_username = game.usernames[client_socket]
+        winner_username = game.usernames[opponent]
 
         # Update stats
-        self.users[winner_username]['wins'] += 1
-        self.users[winner_username]['games_played'] += 1
-        self.users[resigning_player_username]['losses'] += 1
-        self.users[resigning_player_username]['games_played'] += 1
+        self.record_result(winner_username, resigning_player_username)
 
         # Notify opponent they won
         self.send_encrypted_response(opponent, {
@@ -609,51 +1104,105 @@ class ChessServer:
         })
 
         # Clean up game
-        del self.games[game_id]
-        self.clients[client_socket]['game_id'] = None
-        self.clients[opponent]['game_id'] = None
+        self.remove_game(game)
+        print(f"Game {game.game_id}: {resigning_player_username} resigned, {winner_username} wins")
 
-        self.save_users()
-        print(f"Game {game_id}: {resigning_player_username} resigned, {winner_username} wins")
+    def apply_disconnect(self, game, client_socket):
+        """The opponent wins by disconnect, unless the game already ended"""
+        if client_socket not in (game.white_player, game.black_player):
+            return  # its seat has gone to a resumed connection
 
-        return None  # No response to resigning player needed
+        if not game.game_over:
+            game.game_over = True
+            opponent = game.get_opponent(client_socket)
+
+            # Update stats - opponent wins by disconnect
+            self.record_result(game.usernames[opponent], game.usernames[client_socket])
+
+            self.send_encrypted_response(opponent, {
+                'type': 'game_end',
+                'result': 'win',
+                'reason': 'opponent_disconnected'
+            })
+
+        self.remove_game(game)
+
+    def apply_resume(self, game, username, client_socket):
+        """Move a player's seat to their resumed connection, unless the game ended first"""
+        seat = next((player for player, name in game.usernames.items() if name == username), None)
+        resumed = False
+        stale = None
+        with self.lock:
+            # A resumed connection that has already gone again leaves the seat's grace timer running
+            if not game.game_over and seat is not None and client_socket in self.clients:
+                timer = self.suspended.pop((username, game.game_id), None)
+                if timer:
+                    timer.cancel()
+                stale = self.clients.get(seat)
+                if stale:
+                    stale['game_id'] = None
+                if seat == game.white_player:
+                    game.white_player = client_socket
+                else:
+                    game.black_player = client_socket
+                game.usernames[client_socket] = game.usernames.pop(seat)
+                self.clients[client_socket]['game_id'] = game.game_id
+                resumed = True
+
+        if resumed:
+            if stale:
+                # The connection the player had before hadn't noticed it was gone
+                self.drop_connection(seat)
+            print(f"Game {game.game_id}: {username} resumed")
+        self.send_encrypted_response(client_socket, self.session_resumed(client_socket, game if resumed else None))
+
+    def suspend_player(self, game, client_socket, username):
+        """Hold a disconnected player's seat for resume_grace_period; after that the opponent wins as before"""
+        key = (username, game.game_id)
+
+        def expire():
+            with self.lock:
+                if self.suspended.get(key) is not timer:
+                    return
+                del self.suspended[key]
+            game.actor.post(('disconnect', client_socket))
+
+        with self.lock:
+            timer = self.suspended[key] = self.timers.schedule(self.resume_grace_period, expire)
+        print(f"Game {game.game_id}: holding {username}'s seat {self.resume_grace_period}s for a resume")
 
     def cleanup_client(self, client_socket):
         """Clean up client connection"""
-        if client_socket in self.clients:
-            game_id = self.clients[client_socket]['game_id']
-            username = self.clients[client_socket].get('username', 'Unknown')
-            print(f"{username} disconnected")
+        with self.lock:
+            client_info = self.clients.get(client_socket)
 
-            # Handle game cleanup
-            if game_id and game_id in self.games:
-                game = self.games[game_id]
-                opponent = game.get_opponent(client_socket)
+            watch = self.connection_watches.pop(client_socket, None)
+            if watch:
+                watch['closed'] = True
 
-                if opponent:
-                    # Update stats - opponent wins by disconnect
-                    if username != 'Unknown':
-                        opponent_username = self.clients[opponent]['username']
-                        self.users[opponent_username]['wins'] += 1
-                        self.users[opponent_username]['games_played'] += 1
-                        self.users[username]['losses'] += 1
-                        self.users[username]['games_played'] += 1
-                        self.save_users()
-
-                    self.send_encrypted_response(opponent, {
-                        'type': 'game_end',
-                        'result': 'win',
-                        'reason': 'opponent_disconnected'
-                    })
-                    self.clients[opponent]['game_id'] = None
-
-                del self.games[game_id]
-
-            # Remove from waiting queue
+            # Remove from waiting queue (under the same lock, so it can't be paired from here on)
             if client_socket in self.waiting_players:
                 self.waiting_players.remove(client_socket)
 
-            del self.clients[client_socket]
+            game = self.get_game(client_socket)
+
+        if client_info is not None:
+            username = client_info.get('username') or 'Unknown'
+            print(f"{username} disconnected")
+
+            # Handle game cleanup after whatever the game's actor already has queued; a player
+            # with a session ticket gets a chance to resume first
+            if game is not None:
+                if client_info.get('resumable') and not game.game_over:
+                    self.suspend_player(game, client_socket, username)
+                else:
+                    game.actor.post(('disconnect', client_socket))
+
+            outbound = client_info.get('outbound')
+            if outbound:
+                outbound.close()
+            with self.lock:
+                self.clients.pop(client_socket, None)
 
         try:
             client_socket.close()
@@ -661,6 +1210,240 @@ class ChessServer:
             pass
 
 
+class AsyncChessServer(ChessServer):
+    """ChessServer front end on asyncio: one coroutine per connection instead of one thread.
+
+    Speaks the same DH handshake, length-prefixed AES framing and process_message
+    dispatch. Each connection's StreamWriter is its key in self.clients, so the
+    game and account handlers work unchanged. DH key generation and the key
+    exchange run in the handshake pool, password hashing in the loop's
+    default executor.
+    """
+
+    def __init__(self, host='10.100.102.43', port=8888):
+        super().__init__(host, port)
+        self.socket.close()  # asyncio.start_server opens its own listening socket
+        self.loop = None
+        self.loop_thread_id = None
+
+    def start_server(self):
+        """Start the chess server"""
+        asyncio.run(self.serve())
+
+    async def serve(self, **listen_options):
+        """Accept connections until cancelled"""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+
+        # The handshake processes are up before the first connection, whose handshake would otherwise
+        # start them on the loop thread
+        await self.loop.run_in_executor(None, self.handshake_pool.start)
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                            backlog=LISTEN_BACKLOG, **listen_options)
+        print(f"Chess server (asyncio) listening on {self.host}:{self.port}")
+        print("Features: User accounts, email reset, encryption, full chess rules")
+
+        # The timer wheel runs on the loop, so expiring a connection is a plain transport.abort()
+        timer_task = self.loop.create_task(self.run_timers())
+        self.schedule_stats_log()
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                timer_task.cancel()
+
+    async def run_timers(self):
+        while True:
+            await asyncio.sleep(self.timers.tick)
+            self.timers.advance()
+
+    def drop_connection(self, writer):
+        # Game actors drop connections too, from their own threads
+        if threading.get_ident() == self.loop_thread_id:
+            writer.transport.abort()
+        else:
+            self.loop.call_soon_threadsafe(writer.transport.abort)
+
+    def reject_connection(self, writer):
+        writer.transport.abort()
+
+    async def handle_connection(self, reader, writer):
+        """Handle individual client connection"""
+        if not self.admit_connection(writer):
+            self.reject_connection(writer)
+            return
+        address = writer.get_extra_info('peername')
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        try:
+            print(f"Starting key exchange with {address}")
+            frame_reader = FrameReader()
+            self.connection_watches[writer]['frame_reader'] = frame_reader
+
+            # Generate server keys and send their public halves, tailored to what the client offered
+            offer = await self.read_client_offer(reader, frame_reader)
+            dh_keypair = None
+            if self.offers_dh(offer):
+                dh_keypair = await self.handshake_pool.run_async(generate_dh_keypair, *self.dh_numbers)
+            keys = (dh_keypair, self.new_x25519_key())
+            server_data_bytes = self.server_hello(keys, offer)
+            writer.write(encode_frame(server_data_bytes))
+
+            # Receive client's public key (after an offer that came too late for the hello)
+            client_data_bytes = await self.read_frame(reader, frame_reader)
+            if client_data_bytes is not None and offer is None and parse_client_offer(client_data_bytes):
+                client_data_bytes = await self.read_frame(reader, frame_reader)
+            if client_data_bytes is None:
+                raise ConnectionError("Client disconnected during key exchange")
+
+            peer_key, version, record, wire, codec = self.parse_client_hello(client_data_bytes)
+            session = None
+            if version == HANDSHAKE_RESUME:
+                session, aes_key = self.resumed_session_key(server_data_bytes, peer_key)
+            elif version == HANDSHAKE_X25519:
+                aes_key = derive_x25519_session_key(keys[1], peer_key)
+            else:
+                aes_key = await self.handshake_pool.run_async(derive_dh_session_key, *self.dh_numbers,
+                                                              *keys[0], peer_key, version)
+            records, wire = self.open_session(version, record, wire, codec, aes_key, (peer_key, session))
+            print(f"Key exchange successful with {address}")
+
+            # Store client info
+            self.clients[writer] = {
+                'address': address,
+                'records': records,
+                'wire': wire,
+                'username': None,
+                'game_id': None
+            }
+            self.mark_established(writer)
+            if session is not None:
+                self.resume_session(writer, session)
+                # A cluster worker passes a session resumed into another worker's game on to that worker
+                if await self.after_response(writer, frame_reader):
+                    self.cleanup_client(writer)
+                    return
+        except Exception as e:
+            if isinstance(e, HandshakeOverloaded):
+                self.connection_stats['handshake_overloads'] += 1
+            elif isinstance(e, TicketError):
+                self.connection_stats['rejected_tickets'] += 1
+            if not isinstance(e, ConnectionError) or isinstance(e, HandshakeOverloaded):
+                print(f"Key exchange with {address} failed: {e}")
+            self.cleanup_client(writer)
+            return
+
+        await self.serve_connection(reader, writer, frame_reader)
+
+    async def serve_connection(self, reader, writer, frame_reader):
+        """Read and dispatch messages from a connection whose session key is in self.clients"""
+        address = self.clients[writer]['address']
+        records = self.clients[writer]['records']
+        wire = self.clients[writer]['wire']
+        watch = self.connection_watches.get(writer) or self.watch_connection(writer, frame_reader)
+        try:
+            while True:
+                # Receive encrypted message (None or an empty frame ends the session)
+                encrypted_data = await self.read_frame(reader, frame_reader)
+                if not encrypted_data:
+                    break
+                watch['last_activity'] = time.monotonic()
+
+                decrypted_msg = self.decrypt_message(encrypted_data, records)
+
+                message = wire.decode(decrypted_msg)
+                if message.get('type') in CPU_BOUND_MESSAGES:
+                    response = await self.loop.run_in_executor(None, self.process_message, writer, message)
+                else:
+                    response = self.process_message(writer, message)
+
+                if response:
+                    self.send_encrypted_response(writer, response)
+
+                if await self.after_response(writer, frame_reader):
+                    break
+
+                # Stop reading from a client that isn't reading its replies
+                await writer.drain()
+
+        except ConnectionError:
+            pass
+        except RecordError as e:
+            print(f"Dropping {address}: {e}")
+        except Exception as e:
+            print(f"Error handling client {address}: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            self.cleanup_client(writer)
+
+    async def after_response(self, writer, frame_reader):
+        """Hook run after each message is answered; True stops serving the connection"""
+        return False
+
+    async def read_client_offer(self, reader, frame_reader):
+        """The client's offer, if it sends one within client_offer_wait; None for clients that wait for the hello"""
+        if self.client_offer_wait <= 0:
+            return None
+        try:
+            frame = await asyncio.wait_for(self.read_frame(reader, frame_reader), self.client_offer_wait)
+        except asyncio.TimeoutError:
+            return None
+        if frame is None:
+            raise ConnectionError("Client disconnected during key exchange")
+        offer = parse_client_offer(frame)
+        if offer is None:
+            raise ValueError("Expected a client offer before the server hello")
+        return offer
+
+    async def read_frame(self, reader, frame_reader):
+        """Next frame from the stream, feeding the frame reader whatever has arrived; None on EOF"""
+        while True:
+            frame = frame_reader.next_frame()
+            if frame is not None:
+                return frame
+            data = await reader.read(READ_CHUNK_SIZE)
+            if not data:
+                if frame_reader.pending():
+                    raise ConnectionError("Connection closed in the middle of a frame")
+                return None
+            frame_reader.feed(data)
+
+    def send_encrypted_response(self, client_socket, response):
+        """Send encrypted response to client (buffered by the transport, never blocks the loop)"""
+        try:
+            client_info = self.clients.get(client_socket)
+            if client_info is None:
+                print("Error: Client socket not in clients list!")
+                return False
+
+            message = client_info['wire'].encode(response)
+
+            # Handlers running in the executor (or game actors) hand writes back to the loop,
+            # which seals them in the order they go out
+            if threading.get_ident() == self.loop_thread_id:
+                return self.queue_frame(client_socket, message)
+            self.loop.call_soon_threadsafe(self.queue_frame, client_socket, message)
+            return True
+        except Exception as e:
+            print(f"Error sending response: {e}")
+            return False
+
+    def queue_frame(self, writer, message):
+        """Seal a message and buffer its frame on the transport, dropping a peer whose backlog is over the limit"""
+        transport = writer.transport
+        client_info = self.clients.get(writer)
+        if transport.is_closing() or client_info is None:
+            return False
+        frame = encode_frame(self.encrypt_message(message, client_info['records']))
+        queued = transport.get_write_buffer_size() + len(frame)
+        if queued > MAX_OUTBOUND_BYTES:
+            print(f"Dropping connection: slow consumer ({queued} bytes queued)")
+            transport.abort()
+            return False
+        writer.write(frame)
+        return True
+
+
 class ChessGame:
     """Complete chess game with full rules including check/checkmate"""
 
@@ -669,10 +1452,18 @@ class ChessGame:
         self.white_player = player1
         self.black_player = player2
         self.current_turn = 'white'
-        self.board = self.initialize_board()
+        self.position = BitboardPosition.from_board(self.initialize_board())
         self.move_history = []
         self.game_over = False
 
+        # Set by the server: usernames by player, and the actor every move, resignation
+        # and disconnect for this game goes through
+        self.usernames = {}
+        self.actor = None
+
+        # Zobrist key -> times the position has occurred, for repetition draws
+        self.position_counts = {self.position.key: 1}
+
     def initialize_board(self):
         """Initialize 9x9 chess board with 2 queens"""
         board = [[None for _ in range(9)] for _ in range(9)]
@@ -710,8 +1501,8 @@ class ChessGame:
         return board
 
     def get_board_state(self):
-        """Get current board state"""
-        return self.board
+        """Get current board state as a 9x9 list of piece names"""
+        return self.position.to_board()
 
     def get_opponent(self, player):
         """Get opponent player"""
@@ -723,251 +1514,54 @@ class ChessGame:
 
     def find_king_position(self, color):
         """Find the position of the king for the given color"""
-        for row in range(9):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece == f'{color}_king':
-                    return (row, col)
-        return None
+        king_sq = self.position.king_square(COLOR_INDEX[color])
+        return square_to_pos(king_sq) if king_sq is not None else None
 
     def is_square_attacked(self, pos, by_color):
         """Check if a square is attacked by pieces of the given color"""
-        for row in range(9):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece and piece.startswith(by_color):
-                    if self.can_piece_attack(piece, (row, col), pos):
-                        return True
-        return False
-
-    def can_piece_attack(self, piece, from_pos, to_pos):
-        """Check if a piece can attack a target square"""
-        piece_type = piece.split('_')[1]
-        piece_color = piece.split('_')[0]
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        if not (0 <= to_row < 9 and 0 <= to_col < 9):
-            return False
-
-        if piece_type == 'pawn':
-            direction = -1 if piece_color == 'white' else 1
-            return (abs(from_col - to_col) == 1 and to_row == from_row + direction)
-
-        elif piece_type == 'rook':
-            if from_row != to_row and from_col != to_col:
-                return False
-            return self.is_path_clear(from_pos, to_pos)
-
-        elif piece_type == 'knight':
-            row_diff = abs(from_row - to_row)
-            col_diff = abs(from_col - to_col)
-            return (row_diff == 2 and col_diff == 1) or (row_diff == 1 and col_diff == 2)
-
-        elif piece_type == 'bishop':
-            if abs(from_row - to_row) != abs(from_col - to_col):
-                return False
-            return self.is_path_clear(from_pos, to_pos)
-
-        elif piece_type == 'queen':
-            is_rook_move = (from_row == to_row or from_col == to_col)
-            is_bishop_move = (abs(from_row - to_row) == abs(from_col - to_col))
-            if not (is_rook_move or is_bishop_move):
-                return False
-            return self.is_path_clear(from_pos, to_pos)
-
-        elif piece_type == 'king':
-            return (abs(from_row - to_row) <= 1 and
-                    abs(from_col - to_col) <= 1 and
-                    (from_row != to_row or from_col != to_col))
-
-        return False
+        return self.position.is_square_attacked(square(*pos), COLOR_INDEX[by_color])
 
     def is_in_check(self, color):
         """Check if the king of the given color is in check"""
-        king_pos = self.find_king_position(color)
-        if not king_pos:
-            return False
-
-        enemy_color = 'black' if color == 'white' else 'white'
-        return self.is_square_attacked(king_pos, enemy_color)
-
-    def is_path_clear(self, from_pos, to_pos):
-        """Check if path between positions is clear"""
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        row_step = 0 if from_row == to_row else (1 if to_row > from_row else -1)
-        col_step = 0 if from_col == to_col else (1 if to_col > from_col else -1)
-
-        current_row, current_col = from_row + row_step, from_col + col_step
-
-        while current_row != to_row or current_col != to_col:
-            if self.board[current_row][current_col] is not None:
-                return False
-            current_row += row_step
-            current_col += col_step
-
-        return True
+        return self.position.is_in_check(COLOR_INDEX[color])
 
     def is_legal_move(self, from_pos, to_pos, color):
         """Check if a move is legal (doesn't leave own king in check)"""
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        # Make the move temporarily
-        moving_piece = self.board[from_row][from_col]
-        captured_piece = self.board[to_row][to_col]
-
-        self.board[to_row][to_col] = moving_piece
-        self.board[from_row][from_col] = None
-
-        # Check if this leaves the king in check
-        in_check = self.is_in_check(color)
+        return self.position.is_legal_move(square(*from_pos), square(*to_pos), COLOR_INDEX[color])
 
-        # Restore the board
-        self.board[from_row][from_col] = moving_piece
-        self.board[to_row][to_col] = captured_piece
-
-        return not in_check
+    def legal_move_set(self, color):
+        """Set of legal (from_sq, to_sq) moves, shared with other games through the move cache"""
+        return legal_moves(self.position, COLOR_INDEX[color])
 
     def get_all_legal_moves(self, color):
         """Get all legal moves for a color"""
-        legal_moves = []
-
-        for row in range(9):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece and piece.startswith(color):
-                    for dest_row in range(9):
-                        for dest_col in range(9):
-                            from_pos = (row, col)
-                            to_pos = (dest_row, dest_col)
-
-                            if from_pos == to_pos:
-                                continue
-
-                            if self.is_valid_piece_move(from_pos, to_pos, piece, color):
-                                if self.is_legal_move(from_pos, to_pos, color):
-                                    legal_moves.append((from_pos, to_pos))
+        return [(square_to_pos(from_sq), square_to_pos(to_sq))
+                for from_sq, to_sq in self.legal_move_set(color)]
 
-        return legal_moves
+    def has_legal_move(self, color):
+        """Check if a color has any legal move (cached set if present, else stops at the first one found)"""
+        moves = move_cache.get((self.position.key, COLOR_INDEX[color]))
+        if moves is not None:
+            return bool(moves)
+        return self.position.has_legal_move(COLOR_INDEX[color])
 
     def is_checkmate(self, color):
         """Check if the given color is in checkmate"""
-        if not self.is_in_check(color):
-            return False
-
-        legal_moves = self.get_all_legal_moves(color)
-        return len(legal_moves) == 0
+        return self.is_in_check(color) and not self.has_legal_move(color)
 
     def is_stalemate(self, color):
         """Check if the given color is in stalemate"""
-        if self.is_in_check(color):
-            return False
-
-        legal_moves = self.get_all_legal_moves(color)
-        return len(legal_moves) == 0
+        return not self.is_in_check(color) and not self.has_legal_move(color)
 
-    def is_valid_piece_move(self, from_pos, to_pos, piece, player_color):
+    def is_valid_piece_move(self, from_pos, to_pos, player_color):
         """Check if piece can move (basic rules, no check consideration)"""
-        from_row, from_col = from_pos
         to_row, to_col = to_pos
 
         # Basic bounds checking
         if not (0 <= to_row < 9 and 0 <= to_col < 9):
             return False
 
-        # Can't capture own piece
-        target_piece = self.board[to_row][to_col]
-        if target_piece and target_piece.startswith(player_color):
-            return False
-
-        piece_type = piece.split('_')[1]
-
-        if piece_type == 'pawn':
-            return self.validate_pawn_move(from_pos, to_pos, player_color)
-        elif piece_type == 'rook':
-            return self.validate_rook_move(from_pos, to_pos)
-        elif piece_type == 'knight':
-            return self.validate_knight_move(from_pos, to_pos)
-        elif piece_type == 'bishop':
-            return self.validate_bishop_move(from_pos, to_pos)
-        elif piece_type == 'queen':
-            return self.validate_queen_move(from_pos, to_pos)
-        elif piece_type == 'king':
-            return self.validate_king_move(from_pos, to_pos)
-
-        return False
-
-    def validate_pawn_move(self, from_pos, to_pos, color):
-        """Validate pawn movement"""
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        direction = -1 if color == 'white' else 1
-
-        # Forward move
-        if from_col == to_col:
-            if to_row == from_row + direction:
-                return self.board[to_row][to_col] is None
-            elif to_row == from_row + 2 * direction:
-                # Double move from starting position
-                start_row = 7 if color == 'white' else 1
-                return (from_row == start_row and
-                        self.board[to_row][to_col] is None and
-                        self.board[from_row + direction][to_col] is None)
-
-        # Diagonal capture
-        elif abs(from_col - to_col) == 1 and to_row == from_row + direction:
-            return (self.board[to_row][to_col] is not None and
-                    not self.board[to_row][to_col].startswith(color))
-
-        return False
-
-    def validate_rook_move(self, from_pos, to_pos):
-        """Validate rook movement"""
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        if from_row != to_row and from_col != to_col:
-            return False
-
-        return self.is_path_clear(from_pos, to_pos)
-
-    def validate_knight_move(self, from_pos, to_pos):
-        """Validate knight movement"""
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        row_diff = abs(from_row - to_row)
-        col_diff = abs(from_col - to_col)
-
-        return (row_diff == 2 and col_diff == 1) or (row_diff == 1 and col_diff == 2)
-
-    def validate_bishop_move(self, from_pos, to_pos):
-        """Validate bishop movement"""
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        if abs(from_row - to_row) != abs(from_col - to_col):
-            return False
-
-        return self.is_path_clear(from_pos, to_pos)
-
-    def validate_queen_move(self, from_pos, to_pos):
-        """Validate queen movement"""
-        return (self.validate_rook_move(from_pos, to_pos) or
-                self.validate_bishop_move(from_pos, to_pos))
-
-    def validate_king_move(self, from_pos, to_pos):
-        """Validate king movement"""
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        return (abs(from_row - to_row) <= 1 and
-                abs(from_col - to_col) <= 1 and
-                (from_row != to_row or from_col != to_col))
+        return bool(self.position.move_targets(square(*from_pos)) >> square(to_row, to_col) & 1)
 
     def make_move(self, player, from_pos, to_pos):
         """Make a chess move with full rule validation"""
@@ -982,29 +1576,33 @@ class ChessGame:
         from_row, from_col = from_pos
         to_row, to_col = to_pos
 
-        piece = self.board[from_row][from_col]
+        if not (0 <= from_row < 9 and 0 <= from_col < 9):
+            return {'success': False, 'message': 'Invalid piece selection'}
+
+        from_sq = square(from_row, from_col)
+        piece = self.position.squares[from_sq]
 
-        if not piece or not piece.startswith(player_color):
+        if not piece or piece >> COLOR_SHIFT != COLOR_INDEX[player_color]:
             return {'success': False, 'message': 'Invalid piece selection'}
 
-        # Validate move
-        if not self.is_valid_piece_move(from_pos, to_pos, piece, player_color):
+        # Validate move against the (usually cached) legal move set
+        if not (0 <= to_row < 9 and 0 <= to_col < 9):
             return {'success': False, 'message': 'Invalid move'}
 
-        # Check if move leaves own king in check
-        if not self.is_legal_move(from_pos, to_pos, player_color):
+        to_sq = square(to_row, to_col)
+        if (from_sq, to_sq) not in self.legal_move_set(player_color):
+            if not self.is_valid_piece_move(from_pos, to_pos, player_color):
+                return {'success': False, 'message': 'Invalid move'}
             return {'success': False, 'message': 'Move leaves king in check'}
 
         # Make the move
-        captured_piece = self.board[to_row][to_col]
-        self.board[to_row][to_col] = piece
-        self.board[from_row][from_col] = None
+        captured_piece = PIECE_NAMES[self.position.make_move(from_sq, to_sq)]
 
         # Record move
         self.move_history.append({
             'from': from_pos,
             'to': to_pos,
-            'piece': piece,
+            'piece': PIECE_NAMES[piece],
             'captured': captured_piece
         })
 
@@ -1012,29 +1610,67 @@ class ChessGame:
         opponent_color = 'black' if self.current_turn == 'white' else 'white'
         self.current_turn = opponent_color
 
+        key = self.position.key
+        repetitions = self.position_counts.get(key, 0) + 1
+        self.position_counts[key] = repetitions
+
         # Check for game end conditions
         game_status = 'continue'
+        in_check = self.is_in_check(opponent_color)
 
-        if self.is_in_check(opponent_color):
-            if self.is_checkmate(opponent_color):
-                self.game_over = True
-                game_status = 'checkmate'
-            else:
-                game_status = 'check'
-        elif self.is_stalemate(opponent_color):
+        if not self.has_legal_move(opponent_color):
+            self.game_over = True
+            game_status = 'checkmate' if in_check else 'stalemate'
+        elif repetitions >= REPETITION_LIMIT:
             self.game_over = True
-            game_status = 'stalemate'
+            game_status = 'repetition'
+        elif in_check:
+            game_status = 'check'
 
         return {
             'success': True,
-            'board': self.board,
             'captured': captured_piece,
             'turn': self.current_turn,
             'game_status': game_status,
-            'in_check': self.is_in_check(opponent_color) if game_status != 'checkmate' else False
+            'in_check': in_check if game_status != 'checkmate' else False,
+            'seq': len(self.move_history),
+            'hash': self.position.key
         }
 
 
 if __name__ == "__main__":
-    server = ChessServer()
-    server.start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="9x9 chess server")
+    parser.add_argument('--host', default='10.100.102.43')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--async', dest='use_asyncio', action='store_true',
+                        help='serve connections from one asyncio event loop instead of a thread each')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='run this many worker processes on the port (SO_REUSEPORT) with a shared matchmaker')
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS,
+                        help='connections open at once (per worker); more are closed on accept')
+    parser.add_argument('--connection-timeout', type=float, default=CONNECTION_TIMEOUT,
+                        help='seconds allowed for the handshake and for receiving any one frame')
+    parser.add_argument('--handshake-processes', type=int, default=DEFAULT_PROCESSES,
+                        help='processes for handshake crypto; 0 runs it on the connection thread '
+                             '(cluster workers always do, being processes already)')
+    parser.add_argument('--handshakes', type=int, nargs='+', choices=SUPPORTED_HANDSHAKES,
+                        default=list(SUPPORTED_HANDSHAKES),
+                        help='handshake versions to accept; without 1 and 2 (DH) the hello is a bare X25519 key, '
+                             'without 4 session tickets are refused')
+    args = parser.parse_args()
+    if set(args.handshakes) == {HANDSHAKE_RESUME}:
+        parser.error('--handshakes needs a key exchange for clients to get session tickets in the first place')
+
+    if args.workers:
+        from cluster import run_cluster
+        run_cluster(args.host, args.port, args.workers, args.use_asyncio,
+                    args.max_connections, args.connection_timeout, tuple(args.handshakes))
+        raise SystemExit
+
+    server_class = AsyncChessServer if args.use_asyncio else ChessServer
+    server = server_class(args.host, args.port)
+    server.max_connections = args.max_connections
+    server.connection_timeout = args.connection_timeout
+    server.handshake_pool = HandshakePool(args.handshake_processes)
+    server.handshakes = tuple(args.handshakes)
+    server.start_server()
@@ -0,0 +1,207 @@
+"""In-process stress harness: player threads against a ChessServer that delivers into inboxes."""
+import queue
+import random
+import threading
+
+from engine import COLOR_INDEX, legal_moves, position_from_board, square_to_pos
+from server import ChessGame, ChessServer
+
+START_BOARD = ChessGame(None, None, None).get_board_state()
+
+# Seconds a player waits for its next message before the run counts as hung
+MESSAGE_TIMEOUT = 30
+
+
+class Connection:
+    """Stands in for a client socket: a hashable key with an inbox of server messages"""
+
+    def __init__(self, username):
+        self.username = username
+        self.inbox = queue.Queue()
+
+    def close(self):
+        pass
+
+
+class StressServer(ChessServer):
+    """ChessServer that delivers messages to in-memory inboxes instead of sockets"""
+
+    def __init__(self):
+        super().__init__('127.0.0.1', 0)
+        self.socket.close()
+
+    def send_encrypted_response(self, client_socket, response):
+        if client_socket not in self.clients:
+            return False
+        client_socket.inbox.put(response)
+        return True
+
+
+class Player(threading.Thread):
+    def __init__(self, server, username, args, seed):
+        super().__init__(daemon=True)
+        self.server = server
+        self.connection = Connection(username)
+        self.args = args
+        self.rng = random.Random(seed)
+        self.moves_made = []       # (from, to) this player made, in order
+        self.moves_seen = []       # (from, to) announced by opponent_move, in order
+        self.game_id = None
+        self.color = None
+        self.ending = None         # 'game_end', 'resigned', 'disconnected' or 'final_move'
+        self.game_ends = 0
+        self.pending_rejections = 0  # out-of-turn moves whose replies haven't arrived yet
+        self.error = None
+
+    def request(self, message):
+        return self.server.process_message(self.connection, message)
+
+    def receive(self):
+        return self.connection.inbox.get(timeout=MESSAGE_TIMEOUT)
+
+    def receive_move_result(self):
+        """The reply to this player's move (sent by the game's actor), counting any game_end before it"""
+        while True:
+            message = self.receive()
+            if message.get('type') == 'game_end':
+                self.game_ends += 1
+                continue
+            assert message.get('type') in (None, 'move_response'), message
+            if self.pending_rejections:
+                # Replies come in posting order: this one answers an earlier out-of-turn move
+                assert not message['success'], message
+                self.pending_rejections -= 1
+                continue
+            return message
+
+    def run(self):
+        try:
+            self.play()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            if self.ending != 'disconnected':
+                self.server.cleanup_client(self.connection)
+
+    def chaos(self):
+        """Maybe resign or disconnect right now; True if the game is over for this player"""
+        roll = self.rng.random()
+        if roll < self.args.resign:
+            self.request({'type': 'resign'})
+            self.ending = 'resigned'
+            return True
+        if roll < self.args.resign + self.args.disconnect:
+            self.server.cleanup_client(self.connection)
+            self.ending = 'disconnected'
+            return True
+        return False
+
+    def play(self):
+        server = self.server
+        server.clients[self.connection] = {
+            'address': None, 'records': None, 'username': self.connection.username, 'game_id': None
+        }
+        reply = self.request({'type': 'join_queue'})
+        assert reply['success'], reply
+
+        start = self.receive()
+        assert start['type'] == 'game_start', start
+        self.game_id, self.color = start['game_id'], start['color']
+
+        board, turn = START_BOARD, 'white'
+        while True:
+            if turn != self.color:
+                # Opponent's turn: sometimes act out of turn, then wait for their move
+                if self.chaos():
+                    return
+                if self.rng.random() < 0.05:
+                    # Never legal (a null move), and out of turn as well
+                    reply = self.request({'type': 'move', 'from': [4, 4], 'to': [4, 4]})
+                    if reply is None:
+                        self.pending_rejections += 1
+                    else:
+                        assert not reply['success'], reply
+                message = self.receive()
+                if message.get('type') in (None, 'move_response'):
+                    assert not message['success'] and self.pending_rejections, message
+                    self.pending_rejections -= 1
+                    continue
+                if message['type'] == 'game_end':
+                    self.ending, self.game_ends = 'game_end', self.game_ends + 1
+                    return
+                assert message['type'] == 'opponent_move', message
+                self.moves_seen.append((tuple(message['from']), tuple(message['to'])))
+                board, turn = message['board'], message['turn']
+                continue
+
+            if self.chaos():
+                return
+            if len(self.moves_made) >= self.args.max_moves:
+                self.request({'type': 'resign'})
+                self.ending = 'resigned'
+                return
+
+            position = position_from_board(board, COLOR_INDEX[turn])
+            from_sq, to_sq = self.rng.choice(sorted(legal_moves(position, COLOR_INDEX[turn])))
+            move = (square_to_pos(from_sq), square_to_pos(to_sq))
+            reply = self.request({'type': 'move', 'from': list(move[0]), 'to': list(move[1])})
+            if reply is None:
+                reply = self.receive_move_result()
+
+            if not reply['success']:
+                # Only a concurrent resignation or disconnect can reject a legal move
+                assert reply['message'] in ('Game is over', 'No active game'), reply
+                if not self.game_ends:
+                    message = self.receive()
+                    assert message['type'] == 'game_end', message
+                    self.game_ends += 1
+                self.ending = 'game_end'
+                return
+
+            self.moves_made.append(move)
+            if reply.get('game_over'):
+                self.ending = 'final_move'
+                return
+            board, turn = reply['board'], reply['turn']
+
+
+def check(server, players, started_games):
+    """List of invariant violations after the run"""
+    failures = []
+    for player in players:
+        if player.error:
+            failures.append(f"{player.connection.username}: {player.error}")
+        if player.game_ends > 1:
+            failures.append(f"{player.connection.username} got {player.game_ends} game_end messages")
+
+    by_game = {}
+    for player in players:
+        by_game.setdefault(player.game_id, {})[player.color] = player
+    for game_id, sides in by_game.items():
+        if len(sides) != 2:
+            failures.append(f"game {game_id} has players {sorted(sides)}")
+            continue
+        for mover, watcher in ((sides['white'], sides['black']), (sides['black'], sides['white'])):
+            # The watcher may have left before seeing the mover's last moves, never a different one
+            if mover.moves_made[:len(watcher.moves_seen)] != watcher.moves_seen:
+                failures.append(f"game {game_id}: {watcher.color} saw moves {mover.color} never made")
+
+    stats = server.users.values()
+    wins = sum(user['wins'] for user in stats)
+    losses = sum(user['losses'] for user in stats)
+    draws = sum(user['draws'] for user in stats)
+    played = sum(user['games_played'] for user in stats)
+    if wins != losses:
+        failures.append(f"{wins} wins but {losses} losses")
+    if wins + draws // 2 != started_games:
+        failures.append(f"{started_games} games started but {wins + draws // 2} results recorded")
+    if played != 2 * started_games:
+        failures.append(f"games_played adds up to {played}, expected {2 * started_games}")
+
+    if server.games:
+        failures.append(f"{len(server.games)} games left behind")
+    if server.waiting_players:
+        failures.append(f"{len(server.waiting_players)} players left in the queue")
+    if server.clients:
+        failures.append(f"{len(server.clients)} clients left behind")
+    return failures
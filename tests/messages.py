@@ -0,0 +1,46 @@
+"""Sample server messages shared by the tests and the record, wire and codec benchmarks."""
+from server import ChessGame
+
+BOARD = ChessGame(None, None, None).get_board_state()
+
+# Real message shapes, from a small rejection up to an opponent_move carrying the whole board
+RECORD_MESSAGES = {
+    'rejected move': {'success': False, 'message': 'Not your turn'},
+    'move_response': {'type': 'move_response', 'success': True, 'board': BOARD, 'captured': None, 'turn': 'black',
+                      'game_status': 'continue', 'in_check': False},
+    'opponent_move': {'type': 'opponent_move', 'from': [7, 4], 'to': [5, 4], 'board': BOARD, 'turn': 'black',
+                      'captured': None, 'game_status': 'continue'},
+    'login_response': {'type': 'login_response', 'success': True, 'username': 'player1',
+                       'stats': {'games_played': 12, 'wins': 7, 'losses': 4, 'draws': 1}}
+}
+
+# A game one move in, for the move and board messages the wire formats carry
+GAME = ChessGame(None, 'white', 'black')
+RESULT = GAME.make_move('white', [7, 4], [5, 4])
+MOVED_BOARD = GAME.get_board_state()
+
+# What the binary wire format encodes itself (a move, its result and opponent_move), and a message it leaves as JSON
+WIRE_MESSAGES = {
+    'move': {'type': 'move', 'from': [1, 3], 'to': [3, 3]},
+    'move result': {'success': True, 'board': MOVED_BOARD, 'captured': None, 'turn': 'black',
+                    'game_status': 'continue', 'in_check': False},
+    'opponent_move': {'type': 'opponent_move', 'from': [7, 4], 'to': [5, 4], 'board': MOVED_BOARD, 'turn': 'black',
+                      'in_check': False},
+    'login_response': {'type': 'login_response', 'success': True, 'username': 'player1',
+                       'stats': {'games_played': 12, 'wins': 7, 'losses': 4, 'draws': 1}}
+}
+
+# What WIRE_DELTA sessions get in place of WIRE_MESSAGES' move result and opponent_move
+POSITION = {'turn': 'black', 'in_check': False, 'seq': RESULT['seq'], 'hash': RESULT['hash']}
+DELTA_MESSAGES = {
+    'move result': {'type': 'move_response', **RESULT},
+    'opponent_move': {'type': 'opponent_move', 'from': [7, 4], 'to': [5, 4], 'captured': None, **POSITION},
+    'board_sync': {'type': 'board_sync', 'board': MOVED_BOARD, **POSITION}
+}
+
+# What still goes through a message codec whole: a board as WIRE_JSON sessions get it, and a plain JSON message
+CODEC_MESSAGES = {
+    'opponent_move': WIRE_MESSAGES['opponent_move'],
+    'login_response': {'type': 'login_response', 'success': True, 'username': 'player1',
+                       'stats': {'games_played': 12, 'wins': 7, 'losses': 4, 'draws': 1, 'rating': 1200}}
+}
@@ -0,0 +1,231 @@
+"""Reference move generation for the tests and benchmarks: the original 81x81 scan and random positions."""
+import random
+
+from engine import BitboardPosition, COLOR_INDEX
+from server import ChessGame
+
+
+class LegacyRules:
+    """The original list-of-strings ChessGame rules, kept as a reference implementation"""
+
+    def __init__(self, board):
+        self.board = [list(row) for row in board]
+
+    def find_king_position(self, color):
+        for row in range(9):
+            for col in range(9):
+                if self.board[row][col] == f'{color}_king':
+                    return (row, col)
+        return None
+
+    def is_square_attacked(self, pos, by_color):
+        for row in range(9):
+            for col in range(9):
+                piece = self.board[row][col]
+                if piece and piece.startswith(by_color):
+                    if self.can_piece_attack(piece, (row, col), pos):
+                        return True
+        return False
+
+    def can_piece_attack(self, piece, from_pos, to_pos):
+        piece_color, piece_type = piece.split('_')
+        from_row, from_col = from_pos
+        to_row, to_col = to_pos
+
+        if piece_type == 'pawn':
+            direction = -1 if piece_color == 'white' else 1
+            return abs(from_col - to_col) == 1 and to_row == from_row + direction
+        elif piece_type == 'rook':
+            return (from_row == to_row or from_col == to_col) and self.is_path_clear(from_pos, to_pos)
+        elif piece_type == 'knight':
+            return self.validate_knight_move(from_pos, to_pos)
+        elif piece_type == 'bishop':
+            return (abs(from_row - to_row) == abs(from_col - to_col) and
+                    self.is_path_clear(from_pos, to_pos))
+        elif piece_type == 'queen':
+            if not (from_row == to_row or from_col == to_col or
+                    abs(from_row - to_row) == abs(from_col - to_col)):
+                return False
+            return self.is_path_clear(from_pos, to_pos)
+        elif piece_type == 'king':
+            return self.validate_king_move(from_pos, to_pos)
+        return False
+
+    def is_in_check(self, color):
+        king_pos = self.find_king_position(color)
+        if not king_pos:
+            return False
+        return self.is_square_attacked(king_pos, 'black' if color == 'white' else 'white')
+
+    def is_path_clear(self, from_pos, to_pos):
+        from_row, from_col = from_pos
+        to_row, to_col = to_pos
+        row_step = 0 if from_row == to_row else (1 if to_row > from_row else -1)
+        col_step = 0 if from_col == to_col else (1 if to_col > from_col else -1)
+        row, col = from_row + row_step, from_col + col_step
+        while row != to_row or col != to_col:
+            if self.board[row][col] is not None:
+                return False
+            row += row_step
+            col += col_step
+        return True
+
+    def is_legal_move(self, from_pos, to_pos, color):
+        (from_row, from_col), (to_row, to_col) = from_pos, to_pos
+        moving_piece = self.board[from_row][from_col]
+        captured_piece = self.board[to_row][to_col]
+        self.board[to_row][to_col] = moving_piece
+        self.board[from_row][from_col] = None
+        in_check = self.is_in_check(color)
+        self.board[from_row][from_col] = moving_piece
+        self.board[to_row][to_col] = captured_piece
+        return not in_check
+
+    def get_all_legal_moves(self, color):
+        """Try every target square for every friendly piece"""
+        legal_moves = []
+        for row in range(9):
+            for col in range(9):
+                piece = self.board[row][col]
+                if piece and piece.startswith(color):
+                    for dest_row in range(9):
+                        for dest_col in range(9):
+                            from_pos = (row, col)
+                            to_pos = (dest_row, dest_col)
+                            if from_pos == to_pos:
+                                continue
+                            if self.is_valid_piece_move(from_pos, to_pos, piece, color):
+                                if self.is_legal_move(from_pos, to_pos, color):
+                                    legal_moves.append((from_pos, to_pos))
+        return legal_moves
+
+    def is_valid_piece_move(self, from_pos, to_pos, piece, player_color):
+        to_row, to_col = to_pos
+        target_piece = self.board[to_row][to_col]
+        if target_piece and target_piece.startswith(player_color):
+            return False
+
+        piece_type = piece.split('_')[1]
+        if piece_type == 'pawn':
+            return self.validate_pawn_move(from_pos, to_pos, player_color)
+        elif piece_type == 'rook':
+            return self.validate_rook_move(from_pos, to_pos)
+        elif piece_type == 'knight':
+            return self.validate_knight_move(from_pos, to_pos)
+        elif piece_type == 'bishop':
+            return self.validate_bishop_move(from_pos, to_pos)
+        elif piece_type == 'queen':
+            return self.validate_rook_move(from_pos, to_pos) or self.validate_bishop_move(from_pos, to_pos)
+        elif piece_type == 'king':
+            return self.validate_king_move(from_pos, to_pos)
+        return False
+
+    def validate_pawn_move(self, from_pos, to_pos, color):
+        (from_row, from_col), (to_row, to_col) = from_pos, to_pos
+        direction = -1 if color == 'white' else 1
+        if from_col == to_col:
+            if to_row == from_row + direction:
+                return self.board[to_row][to_col] is None
+            elif to_row == from_row + 2 * direction:
+                start_row = 7 if color == 'white' else 1
+                return (from_row == start_row and
+                        self.board[to_row][to_col] is None and
+                        self.board[from_row + direction][to_col] is None)
+        elif abs(from_col - to_col) == 1 and to_row == from_row + direction:
+            return (self.board[to_row][to_col] is not None and
+                    not self.board[to_row][to_col].startswith(color))
+        return False
+
+    def validate_rook_move(self, from_pos, to_pos):
+        if from_pos[0] != to_pos[0] and from_pos[1] != to_pos[1]:
+            return False
+        return self.is_path_clear(from_pos, to_pos)
+
+    def validate_knight_move(self, from_pos, to_pos):
+        row_diff = abs(from_pos[0] - to_pos[0])
+        col_diff = abs(from_pos[1] - to_pos[1])
+        return (row_diff == 2 and col_diff == 1) or (row_diff == 1 and col_diff == 2)
+
+    def validate_bishop_move(self, from_pos, to_pos):
+        if abs(from_pos[0] - to_pos[0]) != abs(from_pos[1] - to_pos[1]):
+            return False
+        return self.is_path_clear(from_pos, to_pos)
+
+    def validate_king_move(self, from_pos, to_pos):
+        return (abs(from_pos[0] - to_pos[0]) <= 1 and
+                abs(from_pos[1] - to_pos[1]) <= 1 and
+                from_pos != to_pos)
+
+
+def legacy_get_all_legal_moves(game, color):
+    """Original implementation: try every target square for every friendly piece"""
+    return LegacyRules(game.get_board_state()).get_all_legal_moves(color)
+
+
+def random_positions(count, seed, max_plies=80):
+    """Collect (game, color) pairs by playing random legal moves from the start position"""
+    rng = random.Random(seed)
+    positions = []
+
+    while len(positions) < count:
+        game = ChessGame('bench', 'white', 'black')
+        for _ in range(rng.randint(0, max_plies)):
+            moves = game.get_all_legal_moves(game.current_turn)
+            if not moves:
+                break
+            from_pos, to_pos = rng.choice(moves)
+            result = game.make_move(game.current_turn, from_pos, to_pos)
+            if game.game_over or not result['success']:
+                break
+        if not game.game_over:
+            positions.append((game, game.current_turn))
+
+    return positions
+
+
+def random_placements(count, seed, max_pieces=14):
+    """Scatter kings and random material on the board, which gives far more checks and pins than play"""
+    rng = random.Random(seed)
+    material = ['queen', 'queen', 'rook', 'rook', 'bishop', 'bishop', 'knight', 'knight'] + ['pawn'] * 9
+    positions = []
+
+    while len(positions) < count:
+        board = [[None for _ in range(9)] for _ in range(9)]
+        squares = rng.sample([(row, col) for row in range(9) for col in range(9)], max_pieces + 2)
+        board[squares[0][0]][squares[0][1]] = 'white_king'
+        board[squares[1][0]][squares[1][1]] = 'black_king'
+        for row, col in squares[2:2 + rng.randint(1, max_pieces)]:
+            board[row][col] = f"{rng.choice(['white', 'black'])}_{rng.choice(material)}"
+
+        color = rng.choice(['white', 'black'])
+        enemy = 'black' if color == 'white' else 'white'
+        game = ChessGame('bench', 'white', 'black')
+        game.position = BitboardPosition.from_board(board, COLOR_INDEX[color])
+        game.current_turn = color
+        if not game.is_in_check(enemy):  # side not to move must not be in check
+            positions.append((game, color))
+
+    return positions
+
+
+def full_enumeration_status(game, color):
+    """End-of-move status computed the way make_move used to: full move lists, repeated check tests"""
+    game.position.check_cache = None
+    if game.is_in_check(color):
+        game.position.check_cache = None
+        status = 'checkmate' if len(game.get_all_legal_moves(color)) == 0 else 'check'
+    else:
+        game.position.check_cache = None
+        status = 'stalemate' if len(game.get_all_legal_moves(color)) == 0 else 'continue'
+    game.position.check_cache = None
+    game.is_in_check(color)
+    return status
+
+
+def early_exit_status(game, color):
+    """End-of-move status as make_move computes it now"""
+    game.position.check_cache = None
+    in_check = game.is_in_check(color)
+    if not game.has_legal_move(color):
+        return 'checkmate' if in_check else 'stalemate'
+    return 'check' if in_check else 'continue'
@@ -0,0 +1,72 @@
+"""Matchmaker links: messages and descriptors cross whole, and resumed sessions reach their game's worker."""
+import os
+import socket
+import threading
+
+import pytest
+
+from cluster import Matchmaker, MessageReader, cluster_supported, send_message
+
+pytestmark = pytest.mark.skipif(not cluster_supported(), reason="needs Unix descriptor passing")
+
+
+@pytest.fixture
+def link():
+    ends = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    yield ends
+    for end in ends:
+        end.close()
+
+
+@pytest.mark.parametrize('size', [0, 100, 1024 * 1024])
+def test_message_and_socket_arrive_together(link, size):
+    sender, receiver = link
+    client, peer = socket.socketpair()
+    message = {'op': 'enqueue', 'client': {'unread': os.urandom(size).hex()}}
+
+    # A large message fills the link, so the reader has to be draining it meanwhile
+    thread = threading.Thread(target=send_message, args=(sender, message, [client]))
+    thread.start()
+    received, sockets = MessageReader(receiver).receive()
+    thread.join()
+    assert received == message
+    assert len(sockets) == 1
+
+    sockets[0].sendall(b'through the passed descriptor')
+    assert peer.recv(64) == b'through the passed descriptor'
+    for sock in sockets + [client, peer]:
+        sock.close()
+
+
+def test_non_blocking_reader_waits_for_the_last_part(link):
+    sender, receiver = link
+    receiver.setblocking(False)
+    reader = MessageReader(receiver)
+    assert reader.receive() is None
+
+    message = {'unread': 'x' * 200000}
+    thread = threading.Thread(target=send_message, args=(sender, message))
+    thread.start()
+    received = None
+    while received is None:
+        received = reader.receive()
+    thread.join()
+    assert received == (message, [])
+
+
+def test_matchmaker_routes_a_resume_to_the_games_worker():
+    links = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(2)]
+    matchmaker = Matchmaker([matchmaker_end for matchmaker_end, _ in links])
+    client, peer = socket.socketpair()
+    state = {'username': 'alice'}
+
+    send_message(links[0][1], {'op': 'resume', 'worker': 1, 'game_id': '1-abc', 'client': state}, [client])
+    matchmaker.handle_worker_message(links[0][0])
+    message, sockets = MessageReader(links[1][1]).receive()
+    assert message == {'op': 'adopt', 'match': False, 'clients': [state], 'resume': '1-abc'}
+    assert not matchmaker.waiting
+
+    sockets[0].sendall(b'to the game')
+    assert peer.recv(64) == b'to the game'
+    for sock in sockets + [client, peer] + [end for ends in links for end in ends]:
+        sock.close()
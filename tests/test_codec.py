@@ -0,0 +1,42 @@
+"""Message codecs: every message decodes to what was encoded, whichever codecs the two ends pick."""
+import pytest
+
+from codec import CODEC_JSON, SUPPORTED_CODECS, choose_codec, message_codec
+from tests.messages import CODEC_MESSAGES
+from wire import WIRE_JSON, wire_format
+
+
+@pytest.mark.parametrize('codec', SUPPORTED_CODECS)
+@pytest.mark.parametrize('name', CODEC_MESSAGES)
+def test_codec_round_trip(codec, name):
+    message = CODEC_MESSAGES[name]
+    assert message_codec(codec).decode(message_codec(codec).encode(message)) == message
+
+
+@pytest.mark.parametrize('codec', SUPPORTED_CODECS)
+def test_wire_formats_encode_through_the_sessions_codec(codec):
+    wire = wire_format(WIRE_JSON, codec)
+    message = CODEC_MESSAGES['login_response']
+    assert wire.encode(message) == message_codec(codec).encode(message)
+    assert wire.decode(wire.encode(message)) == message
+
+
+@pytest.mark.parametrize('value', [2 ** 70 + 1, -(2 ** 70 + 1), 2 ** 64 - 1])
+def test_json_codec_keeps_integers_beyond_64_bits(value):
+    codec = message_codec(CODEC_JSON)
+    decoded = codec.decode(codec.encode({'value': value}))['value']
+    assert decoded == value
+    assert type(decoded) is int
+
+
+def test_unsupported_codecs_are_refused():
+    with pytest.raises(ValueError):
+        message_codec(max(SUPPORTED_CODECS) + 1)
+    with pytest.raises(ValueError):
+        wire_format(WIRE_JSON, max(SUPPORTED_CODECS) + 1)
+
+
+def test_choose_codec_follows_the_servers_order():
+    assert choose_codec(SUPPORTED_CODECS) == SUPPORTED_CODECS[0]
+    assert choose_codec(tuple(reversed(SUPPORTED_CODECS))) == SUPPORTED_CODECS[-1]
+    assert choose_codec((99,)) == CODEC_JSON
@@ -0,0 +1,43 @@
+"""OutboundQueue: frames go out whole and in order, a slow peer never blocks put()."""
+import socket
+import threading
+
+from framing import FrameReader, OutboundQueue
+
+
+def identity(message):
+    return message
+
+
+def test_frames_arrive_in_order_once_the_peer_reads():
+    server, client = socket.socketpair()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    outbound = OutboundQueue(server, identity)
+    threads = threading.active_count()
+
+    # Far more than the socket buffer takes, so most of it waits for the flusher
+    messages = [bytes([index]) * 20000 for index in range(20)]
+    for message in messages:
+        assert outbound.put(message)
+    assert outbound.stalled_since() is not None
+
+    reader = FrameReader(client)
+    assert [bytes(reader.read_frame()) for _ in messages] == messages
+    assert outbound.flush(5)
+    assert outbound.stalled_since() is None
+    # One flusher per process at most, however many queues are behind
+    assert threading.active_count() <= threads + 1
+    outbound.close()
+    server.close()
+    client.close()
+
+
+def test_a_peer_that_stops_reading_is_dropped():
+    server, client = socket.socketpair()
+    outbound = OutboundQueue(server, identity, max_bytes=100000)
+    while outbound.put(bytes(10000)):
+        pass
+    assert outbound.dropped and outbound.closed
+    assert not outbound.put(b'after')
+    server.close()
+    client.close()
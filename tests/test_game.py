@@ -0,0 +1,24 @@
+"""ChessGame.make_move: what a move records and reports."""
+from engine import COLOR_INDEX, move_cache
+from server import ChessGame
+
+
+def test_move_history_records_piece_names():
+    game = ChessGame('game', 'alice', 'bob')
+    for player, from_pos, to_pos in (('alice', [7, 4], [5, 4]), ('bob', [1, 3], [3, 3]),
+                                     ('alice', [5, 4], [4, 4]), ('bob', [3, 3], [4, 4])):
+        assert game.make_move(player, from_pos, to_pos)['success']
+    assert game.move_history[0] == {'from': [7, 4], 'to': [5, 4], 'piece': 'white_pawn', 'captured': None}
+    assert game.move_history[-1] == {'from': [3, 3], 'to': [4, 4], 'piece': 'black_pawn', 'captured': 'white_pawn'}
+
+
+def test_move_status_does_not_build_the_opponents_move_set():
+    move_cache.clear()
+    game = ChessGame('game', 'alice', 'bob')
+    assert game.make_move('alice', [7, 4], [5, 4])['game_status'] == 'continue'
+    black_key = (game.position.key, COLOR_INDEX['black'])
+    assert move_cache.get(black_key) is None
+
+    # Validating the reply is what builds it
+    assert game.make_move('bob', [1, 3], [3, 3])['success']
+    assert move_cache.get(black_key) is not None
@@ -0,0 +1,100 @@
+"""Key exchange and session resumption, run in-process between ChessServer and client_key_exchange."""
+import base64
+import json
+
+import pytest
+
+from handshake import (HANDSHAKE_HKDF, HANDSHAKE_LEGACY, HANDSHAKE_RESUME, HANDSHAKE_X25519, HandshakePool, TicketError,
+                       client_key_exchange, client_offer, is_x25519_message, parse_client_offer)
+from records import RECORD_CBC, RECORD_GCM
+from server import ChessServer
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = ChessServer('127.0.0.1', 0)
+    server.handshake_pool = HandshakePool(0)
+    yield server
+    server.socket.close()
+
+
+def handshake(server, offer=None, **client_options):
+    """(server's record layer, client's record layer, resumed session) for one key exchange"""
+    keys, hello = server.create_server_hello(offer)
+    reply, client_records, _ = client_key_exchange(hello, **client_options)
+    server_records, _, session = server.complete_key_exchange(keys, hello, reply)
+    return server_records, client_records, session
+
+
+@pytest.mark.parametrize('version', [HANDSHAKE_LEGACY, HANDSHAKE_HKDF, HANDSHAKE_X25519])
+@pytest.mark.parametrize('record', [RECORD_CBC, RECORD_GCM])
+def test_key_exchange_agrees_on_a_key(server, version, record):
+    server_records, client_records, session = handshake(server, version=version, record=record)
+    assert session is None
+    assert server_records.open(client_records.seal(b'hello')) == b'hello'
+    assert client_records.open(server_records.seal(b'hello')) == b'hello'
+    assert server.handshake_versions[version] == 1
+
+
+def test_an_x25519_offer_gets_a_bare_hello_and_no_dh_key(server):
+    offer = parse_client_offer(client_offer())
+    keys, hello = server.create_server_hello(offer)
+    assert keys[0] is None
+    assert is_x25519_message(hello)
+
+    server_records, client_records, _ = handshake(server, offer)
+    assert server_records.open(client_records.seal(b'hello')) == b'hello'
+    assert server.handshake_versions[HANDSHAKE_X25519] == 1
+
+
+def test_a_dh_only_offer_gets_the_full_hello(server):
+    keys, hello = server.create_server_hello(parse_client_offer(client_offer(HANDSHAKE_HKDF)))
+    assert keys[0] is not None
+    assert not is_x25519_message(hello)
+
+
+def test_key_exchange_replies_are_not_offers(server):
+    keys, hello = server.create_server_hello()
+    for version in (HANDSHAKE_HKDF, HANDSHAKE_X25519):
+        reply, _, _ = client_key_exchange(hello, version)
+        assert parse_client_offer(reply) is None
+
+
+def test_resumption_restores_the_ticket_session(server):
+    ticket = server.session_tickets.issue('alice', 'game-1')
+    server_records, client_records, session = handshake(server, ticket=ticket)
+    assert (session['username'], session['game_id']) == ('alice', 'game-1')
+    assert server_records.open(client_records.seal(b'next')) == b'next'
+    assert server.handshake_versions[HANDSHAKE_RESUME] == 1
+
+
+def test_a_ticket_resumes_only_once(server):
+    ticket = server.session_tickets.issue('alice')
+    handshake(server, ticket=ticket)
+    with pytest.raises(TicketError):
+        handshake(server, ticket=ticket)
+
+
+def test_resumption_needs_the_tickets_secret(server):
+    ticket, secret = server.session_tickets.issue('alice')
+    keys, hello = server.create_server_hello()
+    reply = {'ticket': ticket, 'nonce': base64.b64encode(bytes(16)).decode('ascii'), 'record': RECORD_GCM}
+    with pytest.raises(TicketError):
+        server.complete_key_exchange(keys, hello, json.dumps(reply).encode('utf-8'))
+
+    # The ticket wasn't used up by the failed attempt
+    _, _, session = handshake(server, ticket=(ticket, secret))
+    assert session['username'] == 'alice'
+
+
+def test_resumption_is_refused_over_cbc(server):
+    ticket, secret = server.session_tickets.issue('alice')
+    keys, hello = server.create_server_hello()
+    reply = {'ticket': ticket, 'nonce': base64.b64encode(bytes(16)).decode('ascii')}
+    with pytest.raises(ValueError):
+        server.complete_key_exchange(keys, hello, json.dumps(reply).encode('utf-8'))
+
+    # A client pinned to CBC does a full key exchange instead
+    _, _, session = handshake(server, ticket=(ticket, secret), record=RECORD_CBC)
+    assert session is None
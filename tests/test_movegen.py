@@ -0,0 +1,32 @@
+"""Move generation against the original 81x81 target scan."""
+import pytest
+
+from engine import move_cache
+from tests.reference import (early_exit_status, full_enumeration_status, legacy_get_all_legal_moves,
+                             random_placements, random_positions)
+
+POSITIONS = random_positions(40, seed=1) + random_placements(80, seed=1)
+
+
+@pytest.fixture(autouse=True)
+def uncached():
+    """Generate every move set here rather than reading one cached by another test"""
+    max_entries = move_cache.max_entries
+    move_cache.max_entries = 0
+    move_cache.clear()
+    yield
+    move_cache.max_entries = max_entries
+
+
+@pytest.mark.parametrize('index', range(len(POSITIONS)))
+def test_move_set_matches_legacy_scan(index):
+    game, color = POSITIONS[index]
+    moves = game.get_all_legal_moves(color)
+    assert len(moves) == len(set(moves))
+    assert set(moves) == set(legacy_get_all_legal_moves(game, color))
+
+
+@pytest.mark.parametrize('index', range(len(POSITIONS)))
+def test_early_exit_status_matches_full_enumeration(index):
+    game, color = POSITIONS[index]
+    assert early_exit_status(game, color) == full_enumeration_status(game, color)
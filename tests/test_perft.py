@@ -0,0 +1,24 @@
+"""Perft counts for every backend against REFERENCE_COUNTS (what perft.py --check does, to depth 3)."""
+import contextlib
+import io
+
+import pytest
+
+from engine import parse_position
+from perft import BACKENDS, POSITIONS, REFERENCE_COUNTS, perft
+
+# Deepest count checked; the reference counts go further, at seconds to minutes each
+MAX_DEPTH = 3
+
+CASES = [(backend, position, depth)
+         for backend in BACKENDS
+         for position, references in REFERENCE_COUNTS.items()
+         for depth in range(1, min(MAX_DEPTH, len(references[BACKENDS[backend].rules])) + 1)]
+
+
+@pytest.mark.parametrize('backend, position, depth', CASES)
+def test_perft_matches_reference(backend, position, depth):
+    squares, turn = parse_position(POSITIONS[position])
+    with contextlib.redirect_stdout(io.StringIO()):
+        nodes = perft(BACKENDS[backend](squares, turn), depth)
+    assert nodes == REFERENCE_COUNTS[position][BACKENDS[backend].rules][depth - 1]
@@ -0,0 +1,72 @@
+"""Record layers: sealed frames open at the other end, and nothing else does."""
+import json
+import os
+
+import pytest
+
+from records import CLIENT, RECORD_CBC, RECORD_GCM, SERVER, SUPPORTED_RECORDS, RecordError, record_layer
+from tests.messages import RECORD_MESSAGES
+
+KEY = os.urandom(32)
+
+
+def session(version):
+    """(server, client) record layers for one session key"""
+    return record_layer(version, KEY, SERVER), record_layer(version, KEY, CLIENT)
+
+
+@pytest.mark.parametrize('version', SUPPORTED_RECORDS)
+@pytest.mark.parametrize('name', RECORD_MESSAGES)
+def test_seal_open_round_trip(version, name):
+    server, client = session(version)
+    plaintext = json.dumps(RECORD_MESSAGES[name]).encode('utf-8')
+    assert client.open(server.seal(plaintext)) == plaintext
+    assert server.open(client.seal(plaintext)) == plaintext
+
+
+def test_cbc_rejects_truncated_records():
+    server, client = session(RECORD_CBC)
+    with pytest.raises(RecordError):
+        client.open(server.seal(b'{"type": "move"}')[:-16])
+
+
+def test_gcm_rejects_tampered_records():
+    server, client = session(RECORD_GCM)
+    record = bytearray(server.seal(b'{"type": "resign"}'))
+    record[-1] ^= 1
+    with pytest.raises(RecordError):
+        client.open(bytes(record))
+
+
+def test_gcm_rejects_records_sent_back_to_their_sender():
+    server, _ = session(RECORD_GCM)
+    with pytest.raises(RecordError):
+        server.open(server.seal(b'{"type": "resign"}'))
+
+
+def test_gcm_rejects_replayed_records():
+    server, client = session(RECORD_GCM)
+    record = client.seal(b'{"type": "resign"}')
+    server.open(record)
+    with pytest.raises(RecordError):
+        server.open(record)
+
+
+def test_gcm_rejects_reordered_records():
+    server, client = session(RECORD_GCM)
+    first, second = client.seal(b'first'), client.seal(b'second')
+    assert server.open(second) == b'second'
+    with pytest.raises(RecordError):
+        server.open(first)
+
+
+def test_gcm_export_carries_on_in_another_process():
+    server, client = session(RECORD_GCM)
+    server.open(client.seal(b'before'))
+    record = client.seal(b'seen before the hand-off')
+    server.open(record)
+    adopted = record_layer(RECORD_GCM, KEY, SERVER, json.loads(json.dumps(server.export())))
+    with pytest.raises(RecordError):
+        adopted.open(record)
+    assert adopted.open(client.seal(b'after')) == b'after'
+    assert client.open(adopted.seal(b'reply')) == b'reply'
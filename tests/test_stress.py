@@ -0,0 +1,25 @@
+"""A small stress run: concurrent games end once each, moves arrive in order."""
+import argparse
+
+from tests.harness import Player, StressServer, check
+
+GAMES = 20
+
+
+def test_concurrent_games(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    options = argparse.Namespace(max_moves=20, resign=0.02, disconnect=0.02, seed=3)
+    server = StressServer()
+    usernames = [f'player{i}' for i in range(2 * GAMES)]
+    for username in usernames:
+        server.users[username] = {'games_played': 0, 'wins': 0, 'losses': 0, 'draws': 0}
+
+    players = [Player(server, username, options, options.seed * 100003 + i) for i, username in enumerate(usernames)]
+    for player in players:
+        player.start()
+    for player in players:
+        player.join(60)
+
+    assert not [player for player in players if player.is_alive()]
+    server.game_actors.stop()
+    assert check(server, players, GAMES) == []
@@ -0,0 +1,37 @@
+"""Wire formats: every message decodes to what was encoded."""
+import pytest
+
+from tests.messages import DELTA_MESSAGES, WIRE_MESSAGES
+from wire import SUPPORTED_WIRE_FORMATS, WIRE_BINARY, WIRE_DELTA, WIRE_JSON, wire_format
+
+
+@pytest.mark.parametrize('version', [WIRE_JSON, WIRE_BINARY])
+@pytest.mark.parametrize('name', WIRE_MESSAGES)
+def test_wire_round_trip(version, name):
+    wire = wire_format(version)
+    message = WIRE_MESSAGES[name]
+    assert wire.decode(wire.encode(message)) == message
+
+
+@pytest.mark.parametrize('name', DELTA_MESSAGES)
+def test_delta_round_trip(name):
+    wire = wire_format(WIRE_DELTA)
+    message = DELTA_MESSAGES[name]
+    assert wire.decode(wire.encode(message)) == message
+
+
+def test_deltas_are_smaller_than_whole_boards():
+    for name in ('move result', 'opponent_move'):
+        delta = wire_format(WIRE_DELTA).encode(DELTA_MESSAGES[name])
+        assert len(delta) < len(wire_format(WIRE_BINARY).encode(WIRE_MESSAGES[name]))
+
+
+def test_binary_moves_and_boards_are_smaller_than_json():
+    for name in ('move', 'move result', 'opponent_move'):
+        message = WIRE_MESSAGES[name]
+        assert len(wire_format(WIRE_BINARY).encode(message)) < len(wire_format(WIRE_JSON).encode(message))
+
+
+def test_unsupported_wire_formats_are_refused():
+    with pytest.raises(ValueError):
+        wire_format(max(SUPPORTED_WIRE_FORMATS) + 1)
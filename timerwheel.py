@@ -0,0 +1,87 @@
+"""Hashed timer wheel for connection deadlines.
+
+One wheel serves every connection on a server: a timer is an entry in the
+slot for the tick it expires on, so scheduling and cancelling are O(1) and
+a tick only looks at one slot, however many connections are open. Deadlines
+are rounded up to whole ticks, which is plenty for timeouts measured in
+seconds.
+
+The threaded server advances the wheel from one background thread (start());
+the asyncio server calls advance() from a task on its loop, so callbacks run
+on the loop thread.
+"""
+import math
+import threading
+import time
+import traceback
+
+# Seconds per tick, and ticks per revolution; later deadlines wait out whole revolutions
+DEFAULT_TICK = 1.0
+DEFAULT_SLOTS = 512
+
+
+class Timer:
+    """Handle for a scheduled callback"""
+
+    __slots__ = ('expires', 'callback', 'cancelled')
+
+    def __init__(self, expires, callback):
+        self.expires = expires  # tick number
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = int(time.monotonic() / tick)  # last tick processed
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def schedule(self, delay, callback):
+        """Call callback() once, no earlier than delay seconds from now; returns a Timer"""
+        ticks = max(1, math.ceil(delay / self.tick))
+        with self.lock:
+            timer = Timer(self.current + ticks, callback)
+            self.slots[timer.expires % len(self.slots)].append(timer)
+        return timer
+
+    def advance(self, now=None):
+        """Run every callback whose tick has passed; returns how many ran"""
+        target = int((time.monotonic() if now is None else now) / self.tick)
+        due = []
+        with self.lock:
+            while self.current < target:
+                self.current += 1
+                slot = self.slots[self.current % len(self.slots)]
+                if not slot:
+                    continue
+                keep = []
+                for timer in slot:
+                    if timer.cancelled:
+                        continue
+                    (due if timer.expires <= self.current else keep).append(timer)
+                slot[:] = keep
+
+        for timer in due:
+            try:
+                timer.callback()
+            except Exception as e:
+                print(f"Error in timer callback: {e}")
+                traceback.print_exc()
+        return len(due)
+
+    def start(self):
+        """Advance the wheel from a daemon thread, once per tick"""
+        self.thread = threading.Thread(target=self._run, name='timer-wheel', daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            self.advance()
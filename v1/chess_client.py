@@ -6,6 +6,10 @@ import sys
 import os
 from enum import Enum
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import COLOR_INDEX, legal_destinations, position_from_piece_dicts, square
+
 # Initialize Pygame
 pygame.init()
 
@@ -321,6 +325,10 @@ class ChessClient:
                 self.game_end_message = f"🤝 DRAW 🤝\nStalemate!"
                 self.game_end_timer = pygame.time.get_ticks() + 4000
                 self.state = GameState.GAME_END
+            elif status == 'repetition':
+                self.game_end_message = f"🤝 DRAW 🤝\nThreefold repetition!"
+                self.game_end_timer = pygame.time.get_ticks() + 4000
+                self.state = GameState.GAME_END
             else:
                 self.in_check = False
 
@@ -365,7 +373,7 @@ class ChessClient:
                     # Fallback - shouldn't happen but just in case
                     self.game_end_message = f"Game Over\n{game_message}"
                     print("Game ended - unclear result")
-            elif status == 'stalemate':
+            elif status in ('stalemate', 'repetition'):
                 self.game_end_message = f"🤝 DRAW 🤝\n{game_message}"
                 print("DRAW!")
 
@@ -436,143 +444,14 @@ class ChessClient:
             self.promotion_move = None
 
     def get_valid_moves(self, row, col):
-        """Calculate valid moves for a piece based on chess rules"""
-        valid_moves = []
+        """Calculate legal moves for a piece, including check and pin rules"""
         piece = self.board[row][col]
 
         if not piece:
-            return valid_moves
-
-        piece_type = piece['type']
-        piece_color = piece['color']
-
-        if piece_type == 'pawn':
-            valid_moves = self._get_pawn_moves(row, col, piece_color)
-        elif piece_type == 'rook':
-            valid_moves = self._get_rook_moves(row, col, piece_color)
-        elif piece_type == 'knight':
-            valid_moves = self._get_knight_moves(row, col, piece_color)
-        elif piece_type == 'bishop':
-            valid_moves = self._get_bishop_moves(row, col, piece_color)
-        elif piece_type == 'queen':
-            valid_moves = self._get_queen_moves(row, col, piece_color)
-        elif piece_type == 'king':
-            valid_moves = self._get_king_moves(row, col, piece_color)
-
-        return valid_moves
-
-    def _get_pawn_moves(self, row, col, color):
-        """Get valid pawn moves"""
-        moves = []
-        direction = -1 if color == 'white' else 1
-        start_row = 7 if color == 'white' else 1
-
-        # Forward move
-        new_row = row + direction
-        if 0 <= new_row < 9 and not self.board[new_row][col]:
-            moves.append((new_row, col))
-
-            # Double move from starting position
-            if row == start_row and not self.board[new_row + direction][col]:
-                moves.append((new_row + direction, col))
-
-        # Diagonal captures
-        for dc in [-1, 1]:
-            new_row, new_col = row + direction, col + dc
-            if (0 <= new_row < 9 and 0 <= new_col < 9 and
-                    self.board[new_row][new_col] and
-                    self.board[new_row][new_col]['color'] != color):
-                moves.append((new_row, new_col))
-
-        return moves
-
-    def _get_rook_moves(self, row, col, color):
-        """Get valid rook moves (straight lines)"""
-        moves = []
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-
-        for dr, dc in directions:
-            for i in range(1, 9):
-                new_row, new_col = row + dr * i, col + dc * i
-
-                if not (0 <= new_row < 9 and 0 <= new_col < 9):
-                    break
-
-                target = self.board[new_row][new_col]
-                if target:
-                    if target['color'] != color:
-                        moves.append((new_row, new_col))
-                    break
-                else:
-                    moves.append((new_row, new_col))
-
-        return moves
-
-    def _get_knight_moves(self, row, col, color):
-        """Get valid knight moves (L-shaped)"""
-        moves = []
-        knight_moves = [
-            (-2, -1), (-2, 1), (-1, -2), (-1, 2),
-            (1, -2), (1, 2), (2, -1), (2, 1)
-        ]
-
-        for dr, dc in knight_moves:
-            new_row, new_col = row + dr, col + dc
-
-            if 0 <= new_row < 9 and 0 <= new_col < 9:
-                target = self.board[new_row][new_col]
-                if not target or target['color'] != color:
-                    moves.append((new_row, new_col))
-
-        return moves
-
-    def _get_bishop_moves(self, row, col, color):
-        """Get valid bishop moves (diagonal lines)"""
-        moves = []
-        directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-
-        for dr, dc in directions:
-            for i in range(1, 9):
-                new_row, new_col = row + dr * i, col + dc * i
-
-                if not (0 <= new_row < 9 and 0 <= new_col < 9):
-                    break
-
-                target = self.board[new_row][new_col]
-                if target:
-                    if target['color'] != color:
-                        moves.append((new_row, new_col))
-                    break
-                else:
-                    moves.append((new_row, new_col))
-
-        return moves
-
-    def _get_queen_moves(self, row, col, color):
-        """Get valid queen moves (combination of rook and bishop)"""
-        moves = []
-        moves.extend(self._get_rook_moves(row, col, color))
-        moves.extend(self._get_bishop_moves(row, col, color))
-        return moves
-
-    def _get_king_moves(self, row, col, color):
-        """Get valid king moves (one square in any direction)"""
-        moves = []
-        directions = [
-            (-1, -1), (-1, 0), (-1, 1),
-            (0, -1), (0, 1),
-            (1, -1), (1, 0), (1, 1)
-        ]
-
-        for dr, dc in directions:
-            new_row, new_col = row + dr, col + dc
-
-            if 0 <= new_row < 9 and 0 <= new_col < 9:
-                target = self.board[new_row][new_col]
-                if not target or target['color'] != color:
-                    moves.append((new_row, new_col))
+            return []
 
-        return moves
+        position = position_from_piece_dicts(self.board, COLOR_INDEX[piece['color']])
+        return legal_destinations(position, square(row, col))
 
     def select_piece(self, row, col):
         """Select a piece if it belongs to the current player and it's their turn"""
@@ -2,8 +2,18 @@ import socket
 import threading
 import json
 import time
+import os
+import sys
 from enum import Enum
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import BitboardPosition, COLOR_INDEX, PIECE_TYPE_INDEX, make_piece, legal_moves, square, square_to_pos
+from engine.zobrist import PIECE_SQUARE_KEYS, SIDE_TO_MOVE_KEY, HAS_MOVED_KEYS
+
+# A game is drawn once the same position (including side to move) occurs this many times
+REPETITION_LIMIT = 3
+
 
 class PieceType(Enum):
     PAWN = "pawn"
@@ -53,6 +63,13 @@ class ChessGame:
         self.spectators = []
         self.setup_board()
 
+        # Engine position mirroring self.board; all move rules are answered from it
+        self.position = self.build_position()
+
+        # Zobrist key of the current position and how often each key has occurred
+        self.zobrist_key = self.compute_zobrist_key()
+        self.position_counts = {self.zobrist_key: 1}
+
     def setup_board(self):
         # Setup white pieces (bottom)
         piece_order = [PieceType.ROOK, PieceType.KNIGHT, PieceType.BISHOP, PieceType.QUEEN,
@@ -67,6 +84,38 @@ class ChessGame:
             self.board[0][col] = ChessPiece(piece_order[col], PieceColor.BLACK, 0, col)
             self.board[1][col] = ChessPiece(PieceType.PAWN, PieceColor.BLACK, 1, col)
 
+    def piece_code(self, piece):
+        """Engine piece code for a ChessPiece"""
+        return make_piece(COLOR_INDEX[piece.color.value], PIECE_TYPE_INDEX[piece.type.value])
+
+    def build_position(self):
+        """Build the engine position for the current board and side to move"""
+        squares = bytearray(81)
+        for row in range(9):
+            for col in range(9):
+                piece = self.board[row][col]
+                if piece:
+                    squares[square(row, col)] = self.piece_code(piece)
+        return BitboardPosition.from_squares(squares, COLOR_INDEX[self.current_player.value])
+
+    def piece_key(self, piece, row, col):
+        """Zobrist terms for a piece on a square, including its has_moved flag"""
+        sq = row * 9 + col
+        key = PIECE_SQUARE_KEYS[self.piece_code(piece)][sq]
+        if piece.has_moved:
+            key ^= HAS_MOVED_KEYS[sq]
+        return key
+
+    def compute_zobrist_key(self):
+        """Compute the Zobrist key of the current position from scratch"""
+        key = SIDE_TO_MOVE_KEY if self.current_player == PieceColor.BLACK else 0
+        for row in range(9):
+            for col in range(9):
+                piece = self.board[row][col]
+                if piece:
+                    key ^= self.piece_key(piece, row, col)
+        return key
+
     def is_valid_move(self, from_row, from_col, to_row, to_col, player_color):
         # Basic bounds checking
         if not (0 <= from_row < 9 and 0 <= from_col < 9 and 0 <= to_row < 9 and 0 <= to_col < 9):
@@ -76,17 +125,8 @@ class ChessGame:
         if not piece or piece.color != player_color:
             return False
 
-        # Can't capture own pieces
-        target = self.board[to_row][to_col]
-        if target and target.color == player_color:
-            return False
-
-        # Piece-specific movement validation
-        if not self._validate_piece_movement(piece, from_row, from_col, to_row, to_col):
-            return False
-
-        # Check if this move would leave the king in check
-        return self.is_move_legal(from_row, from_col, to_row, to_col, player_color)
+        # The legal move set already excludes own-piece captures and moves that leave the king in check
+        return (square(from_row, from_col), square(to_row, to_col)) in self.legal_move_set(player_color)
 
     def make_move(self, from_row, from_col, to_row, to_col, player_color, promotion_piece=None):
         if not self.is_valid_move(from_row, from_col, to_row, to_col, player_color):
@@ -95,9 +135,16 @@ class ChessGame:
         piece = self.board[from_row][from_col]
         captured_piece = self.board[to_row][to_col]
 
+        # Take the moving and captured pieces out of the key
+        self.zobrist_key ^= self.piece_key(piece, from_row, from_col)
+        if captured_piece:
+            self.zobrist_key ^= self.piece_key(captured_piece, to_row, to_col)
+
         # Move the piece
         self.board[to_row][to_col] = piece
         self.board[from_row][from_col] = None
+        to_sq = square(to_row, to_col)
+        self.position.make_move(square(from_row, from_col), to_sq)
 
         piece.row = to_row
         piece.col = to_col
@@ -117,6 +164,14 @@ class ChessGame:
                     piece.type = PieceType.QUEEN
                     promotion_occurred = True
 
+        if promotion_occurred:
+            self.position.remove_piece(to_sq)
+            self.position.put_piece(to_sq, self.piece_code(piece))
+
+        # Put the piece back in on its new square (after promotion) and flip the side to move
+        self.zobrist_key ^= self.piece_key(piece, to_row, to_col) ^ SIDE_TO_MOVE_KEY
+        self.position_counts[self.zobrist_key] = self.position_counts.get(self.zobrist_key, 0) + 1
+
         # Switch turns BEFORE checking game status
         self.current_player = PieceColor.BLACK if self.current_player == PieceColor.WHITE else PieceColor.WHITE
 
@@ -131,206 +186,44 @@ class ChessGame:
             'game_status': game_status
         }
 
-    def _validate_piece_movement(self, piece, from_row, from_col, to_row, to_col):
-        row_diff = abs(to_row - from_row)
-        col_diff = abs(to_col - from_col)
-
-        if piece.type == PieceType.PAWN:
-            return self._validate_pawn_move(piece, from_row, from_col, to_row, to_col)
-        elif piece.type == PieceType.ROOK:
-            return self._validate_rook_move(from_row, from_col, to_row, to_col)
-        elif piece.type == PieceType.KNIGHT:
-            return (row_diff == 2 and col_diff == 1) or (row_diff == 1 and col_diff == 2)
-        elif piece.type == PieceType.BISHOP:
-            return self._validate_bishop_move(from_row, from_col, to_row, to_col)
-        elif piece.type == PieceType.QUEEN:
-            return (self._validate_rook_move(from_row, from_col, to_row, to_col) or
-                    self._validate_bishop_move(from_row, from_col, to_row, to_col))
-        elif piece.type == PieceType.KING:
-            return row_diff <= 1 and col_diff <= 1 and (row_diff + col_diff > 0)
-
-        return False
-
-    def _validate_pawn_move(self, piece, from_row, from_col, to_row, to_col):
-        direction = -1 if piece.color == PieceColor.WHITE else 1
-        row_diff = to_row - from_row
-        col_diff = abs(to_col - from_col)
-
-        # Forward move (no capture)
-        if col_diff == 0:
-            if row_diff == direction and not self.board[to_row][to_col]:
-                return True
-            # Double move from starting position
-            if (not piece.has_moved and row_diff == 2 * direction and
-                    not self.board[to_row][to_col] and not self.board[from_row + direction][from_col]):
-                return True
-        # Diagonal capture
-        elif col_diff == 1 and row_diff == direction:
-            # For regular move validation, there must be an enemy piece to capture
-            target_piece = self.board[to_row][to_col]
-            if target_piece and target_piece.color != piece.color:
-                return True
-
-        return False
-
-    def _validate_rook_move(self, from_row, from_col, to_row, to_col):
-        if from_row != to_row and from_col != to_col:
-            return False
-        return self._is_path_clear(from_row, from_col, to_row, to_col)
-
-    def _validate_bishop_move(self, from_row, from_col, to_row, to_col):
-        if abs(to_row - from_row) != abs(to_col - from_col):
-            return False
-        return self._is_path_clear(from_row, from_col, to_row, to_col)
-
-    def _is_path_clear(self, from_row, from_col, to_row, to_col):
-        row_step = 0 if from_row == to_row else (1 if to_row > from_row else -1)
-        col_step = 0 if from_col == to_col else (1 if to_col > from_col else -1)
-
-        current_row, current_col = from_row + row_step, from_col + col_step
-
-        while current_row != to_row or current_col != to_col:
-            if self.board[current_row][current_col]:
-                return False
-            current_row += row_step
-            current_col += col_step
-
-        return True
-
     def find_king(self, color):
         """Find the king of the specified color"""
-        for row in range(9):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece and piece.type == PieceType.KING and piece.color == color:
-                    return (row, col)
-        return None
+        king_sq = self.position.king_square(COLOR_INDEX[color.value])
+        return square_to_pos(king_sq) if king_sq is not None else None
 
     def is_square_attacked(self, row, col, attacking_color):
         """Check if a square is attacked by any piece of the attacking color"""
-        for r in range(9):
-            for c in range(9):
-                piece = self.board[r][c]
-                if piece and piece.color == attacking_color:
-                    if self._can_piece_attack_square(piece, r, c, row, col):
-                        return True
-        return False
-
-    def _can_piece_attack_square(self, piece, from_row, from_col, target_row, target_col):
-        """Check if a piece can attack a specific square"""
-        # Special handling for pawns since they attack differently than they move
-        if piece.type == PieceType.PAWN:
-            return self._can_pawn_attack_square(piece, from_row, from_col, target_row, target_col)
-
-        # For other pieces, temporarily remove the target piece to check if it can be attacked
-        original_piece = self.board[target_row][target_col]
-        self.board[target_row][target_col] = None
-
-        can_attack = self._validate_piece_movement(piece, from_row, from_col, target_row, target_col)
-
-        # Restore the original piece
-        self.board[target_row][target_col] = original_piece
-
-        return can_attack
-
-    def _can_pawn_attack_square(self, pawn, from_row, from_col, target_row, target_col):
-        """Check if a pawn can attack a specific square"""
-        direction = -1 if pawn.color == PieceColor.WHITE else 1
-
-        # Pawn attacks diagonally one square forward
-        if target_row == from_row + direction:
-            if abs(target_col - from_col) == 1:
-                return True
-
-        return False
+        return self.position.is_square_attacked(square(row, col), COLOR_INDEX[attacking_color.value])
 
     def is_in_check(self, color):
         """Check if the king of the specified color is in check"""
-        king_pos = self.find_king(color)
-        if not king_pos:
+        if self.position.king_square(COLOR_INDEX[color.value]) is None:
             print(f"Warning: No king found for {color.value}")
             return False
-
-        enemy_color = PieceColor.BLACK if color == PieceColor.WHITE else PieceColor.WHITE
-        king_row, king_col = king_pos
-
-        # Check if any enemy piece can attack the king
-        for row in range(9):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece and piece.color == enemy_color:
-                    if self._can_piece_attack_square(piece, row, col, king_row, king_col):
-                        print(
-                            f"{color.value} king at ({king_row}, {king_col}) is in check from {piece.type.value} at ({row}, {col})")
-                        return True
-
-        return False
+        return self.position.is_in_check(COLOR_INDEX[color.value])
 
     def is_move_legal(self, from_row, from_col, to_row, to_col, color):
         """Check if a move is legal (doesn't leave king in check)"""
-        # Make the move temporarily
-        piece = self.board[from_row][from_col]
-        captured = self.board[to_row][to_col]
+        return self.position.is_legal_move(square(from_row, from_col), square(to_row, to_col),
+                                           COLOR_INDEX[color.value])
 
-        self.board[to_row][to_col] = piece
-        self.board[from_row][from_col] = None
-
-        # Check if king is in check after this move
-        king_safe = not self.is_in_check(color)
-
-        # Restore the board
-        self.board[from_row][from_col] = piece
-        self.board[to_row][to_col] = captured
-
-        return king_safe
+    def legal_move_set(self, color):
+        """Set of legal (from_sq, to_sq) moves, shared with other games through the move cache"""
+        return legal_moves(self.position, COLOR_INDEX[color.value])
 
     def get_legal_moves(self, color):
         """Get all legal moves (that don't leave king in check)"""
-        legal_moves = []
-
-        for row in range(9):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece and piece.color == color:
-                    # Get all possible moves for this piece
-                    for target_row in range(9):
-                        for target_col in range(9):
-                            if self.is_valid_move(row, col, target_row, target_col, color):
-                                # Make the move temporarily to see if it leaves king in check
-                                original_piece = self.board[target_row][target_col]
-                                self.board[target_row][target_col] = piece
-                                self.board[row][col] = None
-
-                                # Check if king is safe after this move
-                                king_safe = not self.is_in_check(color)
-
-                                # Restore the board
-                                self.board[row][col] = piece
-                                self.board[target_row][target_col] = original_piece
-
-                                if king_safe:
-                                    legal_moves.append((row, col, target_row, target_col))
-
-        print(f"{color.value} has {len(legal_moves)} legal moves")
-        return legal_moves
+        moves = [square_to_pos(from_sq) + square_to_pos(to_sq) for from_sq, to_sq in self.legal_move_set(color)]
+        print(f"{color.value} has {len(moves)} legal moves")
+        return moves
 
     def is_checkmate(self, color):
         """Check if the specified color is in checkmate"""
-        if not self.is_in_check(color):
-            return False
-
-        # If in check, see if there are any legal moves
-        legal_moves = self.get_legal_moves(color)
-        return len(legal_moves) == 0
+        return self.is_in_check(color) and not self.legal_move_set(color)
 
     def is_stalemate(self, color):
         """Check if the specified color is in stalemate"""
-        if self.is_in_check(color):
-            return False
-
-        # If not in check, see if there are any legal moves
-        legal_moves = self.get_legal_moves(color)
-        return len(legal_moves) == 0
+        return not self.is_in_check(color) and not self.legal_move_set(color)
 
     def get_game_status(self):
         """Get the current game status"""
@@ -351,6 +244,11 @@ class ChessGame:
                 'status': 'stalemate',
                 'message': 'Stalemate! Game is a draw.'
             }
+        elif self.position_counts.get(self.zobrist_key, 0) >= REPETITION_LIMIT:
+            return {
+                'status': 'repetition',
+                'message': 'Threefold repetition! Game is a draw.'
+            }
         elif self.is_in_check(current_color):
             return {
                 'status': 'check',
@@ -593,7 +491,7 @@ class ChessServer:
                 self.send_message(spectator_id, move_message)
 
             # Handle game end
-            if game_status['status'] in ['checkmate', 'stalemate']:
+            if game_status['status'] in ['checkmate', 'stalemate', 'repetition']:
                 game.state = GameState.FINISHED
 
                 print(f"Game {game_id} ended: {game_status['status']}")
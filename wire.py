@@ -0,0 +1,248 @@
+"""Wire formats: how a message dict becomes the plaintext of a frame, and back.
+
+WIRE_JSON sends everything through the session's codec; WIRE_BINARY and WIRE_DELTA pack moves and boards into bytes.
+"""
+import struct
+
+from codec import CODEC_JSON, SUPPORTED_CODECS, message_codec
+from engine import PIECE_CODES, PIECE_NAMES, decode_board, encode_board
+
+# Wire format versions, oldest first
+WIRE_JSON = 1
+WIRE_BINARY = 2
+WIRE_DELTA = 3
+SUPPORTED_WIRE_FORMATS = (WIRE_JSON, WIRE_BINARY, WIRE_DELTA)
+
+# Binary message type bytes. A square is one byte (row * 9 + column), pieces are engine
+# piece codes (0 for none), flags hold the side to move (bit 0), in_check (bit 1) and a
+# move result's GAME_STATUSES index (bits 2-4); seq is 4 bytes and hash 8, big-endian.
+# Codec messages start with a map header ('{', 0x80-0x8f, 0xde or 0xdf), never one of these.
+MOVE = 0x01               # from | to
+OPPONENT_MOVE = 0x02      # from | to | flags | board
+MOVE_RESULT = 0x03        # flags | captured | board
+MOVE_DELTA = 0x04         # from | to | flags | captured | seq | hash [| board]
+MOVE_RESULT_DELTA = 0x05  # flags | captured | seq | hash [| board]
+BOARD_SYNC = 0x06         # flags | seq | hash | board
+BINARY_LAYOUTS = {MOVE, OPPONENT_MOVE, MOVE_RESULT}
+
+BOARD_BYTES = 81
+TURNS = ('white', 'black')
+GAME_STATUSES = ('continue', 'check', 'checkmate', 'stalemate', 'repetition')
+
+# Keys each binary layout carries; a message with any other key goes through the
+# codec. The WIRE_DELTA sets leave out 'board', which a delta may or may not carry
+MOVE_KEYS = {'type', 'from', 'to'}
+OPPONENT_MOVE_KEYS = {'type', 'from', 'to', 'board', 'turn', 'in_check'}
+MOVE_RESULT_KEYS = {'success', 'board', 'captured', 'turn', 'game_status', 'in_check'}
+BINARY_TYPES = {'move', 'opponent_move', None}  # a move result has no 'type'
+MOVE_DELTA_KEYS = {'type', 'from', 'to', 'captured', 'turn', 'in_check', 'seq', 'hash'}
+MOVE_RESULT_DELTA_KEYS = {'type', 'success', 'captured', 'turn', 'game_status', 'in_check', 'seq', 'hash'}
+BOARD_SYNC_KEYS = {'type', 'turn', 'in_check', 'seq', 'hash'}
+DELTA_TYPES = {'move', 'opponent_move', 'move_response', 'board_sync'}
+
+# Fixed fields of the WIRE_DELTA layouts, after the type byte and before any board
+MOVE_DELTA_FIELDS = struct.Struct('>BBBBIQ')  # from, to, flags, captured, seq, hash
+MOVE_RESULT_DELTA_FIELDS = struct.Struct('>BBIQ')  # flags, captured, seq, hash
+BOARD_SYNC_FIELDS = struct.Struct('>BIQ')  # flags, seq, hash
+DELTA_FIELDS = {MOVE_DELTA: MOVE_DELTA_FIELDS, MOVE_RESULT_DELTA: MOVE_RESULT_DELTA_FIELDS,
+                BOARD_SYNC: BOARD_SYNC_FIELDS}
+
+
+def encode_square(pos):
+    """One byte for a [row, col] pair; ValueError if it isn't on the board"""
+    row, col = pos
+    if not (0 <= row < 9 and 0 <= col < 9):
+        raise ValueError(f"Square {pos!r} is off the board")
+    return row * 9 + col
+
+
+def decode_square(sq):
+    if sq >= BOARD_BYTES:
+        raise ValueError(f"Square {sq} is off the board")
+    return [sq // 9, sq % 9]
+
+
+def encode_flags(message, status=0):
+    return TURNS.index(message['turn']) | (bool(message['in_check']) << 1) | (status << 2)
+
+
+def encode_captured(message):
+    return PIECE_CODES[message['captured']] if message['captured'] else 0
+
+
+def unpack_delta(data, fields):
+    """(fixed fields, board or None) of a WIRE_DELTA layout; None if data is the wrong length for it"""
+    end = 1 + fields.size
+    if len(data) == end:
+        return fields.unpack_from(data, 1), None
+    if len(data) == end + BOARD_BYTES:
+        return fields.unpack_from(data, 1), decode_board(data[end:])
+    return None
+
+
+class JsonWire:
+    """Original wire format: every message through the codec"""
+
+    version = WIRE_JSON
+    deltas = False  # whether the server sends this session move deltas instead of boards
+
+    def __init__(self, codec):
+        self.codec = codec
+
+    def encode(self, message):
+        return self.codec.encode(message)
+
+    def decode(self, data):
+        return self.codec.decode(data)
+
+
+class BinaryWire(JsonWire):
+    """Moves and boards as bytes, everything else through the codec"""
+
+    version = WIRE_BINARY
+
+    def encode(self, message):
+        if message.get('type') not in BINARY_TYPES:
+            return super().encode(message)
+        try:
+            data = self.encode_binary(message)
+        except (KeyError, TypeError, ValueError):
+            data = None  # a shape the binary layouts don't cover
+        return data if data is not None else super().encode(message)
+
+    def encode_binary(self, message):
+        """Binary form of a move, opponent_move or move result; None for any other message"""
+        keys = message.keys()
+        kind = message.get('type')
+        if kind == 'move' and keys == MOVE_KEYS:
+            return bytes((MOVE, encode_square(message['from']), encode_square(message['to'])))
+        if kind == 'opponent_move' and keys == OPPONENT_MOVE_KEYS:
+            return bytes((OPPONENT_MOVE, encode_square(message['from']), encode_square(message['to']),
+                          encode_flags(message))) + encode_board(message['board'])
+        if kind is None and keys == MOVE_RESULT_KEYS and message['success'] is True:
+            status = GAME_STATUSES.index(message['game_status'])
+            return bytes((MOVE_RESULT, encode_flags(message, status), encode_captured(message))) + \
+                encode_board(message['board'])
+        return None
+
+    def decode(self, data):
+        kind = data[0] if data else None
+        if kind not in BINARY_LAYOUTS:
+            return super().decode(data)
+        if kind == MOVE and len(data) == 3:
+            return {'type': 'move', 'from': decode_square(data[1]), 'to': decode_square(data[2])}
+        if kind == OPPONENT_MOVE and len(data) == 4 + BOARD_BYTES:
+            flags = data[3]
+            return {
+                'type': 'opponent_move',
+                'from': decode_square(data[1]),
+                'to': decode_square(data[2]),
+                'board': decode_board(data[4:]),
+                'turn': TURNS[flags & 1],
+                'in_check': bool(flags & 2)
+            }
+        if kind == MOVE_RESULT and len(data) == 3 + BOARD_BYTES:
+            flags = data[1]
+            return {
+                'success': True,
+                'board': decode_board(data[3:]),
+                'captured': PIECE_NAMES[data[2] & 15],
+                'turn': TURNS[flags & 1],
+                'game_status': GAME_STATUSES[flags >> 2],
+                'in_check': bool(flags & 2)
+            }
+        return super().decode(data)
+
+
+class DeltaWire(BinaryWire):
+    """Binary, with move messages that carry the move instead of the board"""
+
+    version = WIRE_DELTA
+    deltas = True
+
+    def encode(self, message):
+        if message.get('type') not in DELTA_TYPES:
+            return self.codec.encode(message)
+        try:
+            data = self.encode_delta(message)
+        except (KeyError, TypeError, ValueError, struct.error):
+            data = None
+        return data if data is not None else super().encode(message)
+
+    def encode_delta(self, message):
+        """Binary form of a delta opponent_move or move_response, or a board_sync; None for any other message"""
+        keys = message.keys() - {'board'}
+        kind = message['type']
+        if kind == 'opponent_move' and keys == MOVE_DELTA_KEYS:
+            data = bytes((MOVE_DELTA,)) + MOVE_DELTA_FIELDS.pack(
+                encode_square(message['from']), encode_square(message['to']), encode_flags(message),
+                encode_captured(message), message['seq'], message['hash'])
+        elif kind == 'move_response' and keys == MOVE_RESULT_DELTA_KEYS and message['success'] is True:
+            status = GAME_STATUSES.index(message['game_status'])
+            data = bytes((MOVE_RESULT_DELTA,)) + MOVE_RESULT_DELTA_FIELDS.pack(
+                encode_flags(message, status), encode_captured(message), message['seq'], message['hash'])
+        elif kind == 'board_sync' and keys == BOARD_SYNC_KEYS and 'board' in message:
+            data = bytes((BOARD_SYNC,)) + BOARD_SYNC_FIELDS.pack(encode_flags(message), message['seq'],
+                                                                   message['hash'])
+        else:
+            return None
+        return data + encode_board(message['board']) if 'board' in message else data
+
+    def decode(self, data):
+        kind = data[0] if data else None
+        unpacked = unpack_delta(data, DELTA_FIELDS[kind]) if kind in DELTA_FIELDS else None
+        if unpacked is None or (kind == BOARD_SYNC and unpacked[1] is None):
+            return super().decode(data)
+
+        fields, board = unpacked
+        if kind == MOVE_DELTA:
+            from_sq, to_sq, flags, captured, seq, key = fields
+            message = {
+                'type': 'opponent_move',
+                'from': decode_square(from_sq),
+                'to': decode_square(to_sq),
+                'captured': PIECE_NAMES[captured & 15],
+                'turn': TURNS[flags & 1],
+                'in_check': bool(flags & 2),
+                'seq': seq,
+                'hash': key
+            }
+        elif kind == MOVE_RESULT_DELTA:
+            flags, captured, seq, key = fields
+            message = {
+                'type': 'move_response',
+                'success': True,
+                'captured': PIECE_NAMES[captured & 15],
+                'turn': TURNS[flags & 1],
+                'game_status': GAME_STATUSES[flags >> 2],
+                'in_check': bool(flags & 2),
+                'seq': seq,
+                'hash': key
+            }
+        else:
+            flags, seq, key = fields
+            message = {'type': 'board_sync', 'turn': TURNS[flags & 1], 'in_check': bool(flags & 2),
+                       'seq': seq, 'hash': key}
+        if board is not None:
+            message['board'] = board
+        return message
+
+
+WIRE_CLASSES = {WIRE_JSON: JsonWire, WIRE_BINARY: BinaryWire, WIRE_DELTA: DeltaWire}
+WIRE_FORMATS = {(version, codec): wire_class(message_codec(codec))
+                for version, wire_class in WIRE_CLASSES.items() for codec in SUPPORTED_CODECS}
+
+
+def wire_format(version, codec=CODEC_JSON):
+    """Encoder for a wire format version and codec (they hold no state, so connections share them)"""
+    if version not in WIRE_CLASSES:
+        raise ValueError(f"Unsupported wire format {version!r}")
+    if codec not in SUPPORTED_CODECS:
+        raise ValueError(f"Unsupported codec {codec!r}")
+    return WIRE_FORMATS[(version, codec)]
+
+
+def choose_wire_format(offered, supported=SUPPORTED_WIRE_FORMATS):
+    """Newest wire format in both lists"""
+    common = set(offered) & set(supported)
+    return max(common) if common else WIRE_JSON